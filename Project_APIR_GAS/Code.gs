@@ -9,9 +9,20 @@ const CONFIG = {
   
   // FLASK API CONFIGURATION
   FLASK_API_URL: 'https://project-apir.onrender.com', 
-  API_ENDPOINT: '/api/parse'
+  API_ENDPOINT: '/api/parse',
+
+  // Invoices loaded per history page (served by the API's invoice store)
+  HISTORY_PAGE_SIZE: 200
 };
 
+/**
+ * Shared secrets for the API, kept in Script Properties rather than in code:
+ * APIR_API_KEY (= the server's HISTORY_API_KEY) and APIR_DELETE_KEY (= HISTORY_DELETE_KEY).
+ */
+function apiKey(name) {
+  return PropertiesService.getScriptProperties().getProperty(name) || "";
+}
+
 function doGet(e) {
   return HtmlService.createHtmlOutputFromFile('Index')
       .setTitle('Invoice AI Hub')
@@ -48,21 +59,126 @@ function login(email, password) {
 /**
  * Gets the user's session data
  * REQUIRES email since we are in anonymous mode
+ * Pass `before` (the previous response's nextBefore) to load the next, older page.
  */
-function getUserData(userEmail) {
+function getUserData(userEmail, before) {
   try {
     if (!userEmail) throw new Error("No email provided");
     
-    const resources = UserResourceManager.get(userEmail);
-    
-    // Read history from sheet
-    const ss = SpreadsheetApp.openById(resources.sheetId);
+    // Sheet pages (API unreachable, or its store couldn't be filled) continue from the sheet
+    if (typeof before === "string" && before.indexOf("sheet:") === 0) {
+      return sheetHistoryPage(userEmail, Number(before.slice(6)));
+    }
+
+    // One indexed page from the API's invoice store instead of reading the whole sheet
+    let page = fetchHistoryPage(userEmail, before);
+    // An empty store (new or redeployed server) is refilled from the sheet, which always has everything
+    if (page && page.invoices.length === 0 && !before && backfillHistory(userEmail)) {
+      page = fetchHistoryPage(userEmail);
+    }
+    if (page && (page.invoices.length > 0 || before)) {
+      const result = {
+        success: true,
+        email: userEmail,
+        history: page.invoices,
+        nextBefore: page.next_before
+      };
+      // Totals over the whole history, so the dashboard never has to load every page
+      if (page.summary) {
+        result.stats = { processedCount: page.summary.invoices, totalValue: page.summary.total_value };
+      }
+      return result;
+    }
+
+    // API unreachable or nothing stored there: page through the sheet instead
+    return sheetHistoryPage(userEmail, null);
+  } catch (e) {
+    return { success: false, error: e.toString() };
+  }
+}
+
+/**
+ * Uploads the user's sheet rows to the API's invoice store. The API only imports them
+ * while it holds no history for the user. Returns true if anything was imported.
+ */
+function backfillHistory(userEmail) {
+  const resources = UserResourceManager.get(userEmail);
+  const sheet = SpreadsheetApp.openById(resources.sheetId).getSheets()[0];
+  const lastRow = sheet.getLastRow();
+  if (lastRow < 2) return false;
+  const timeZone = Session.getScriptTimeZone();
+  const rows = sheet.getRange(2, 1, lastRow - 1, 13).getValues().map(row => row.map((value, col) => {
+    if (!(value instanceof Date)) return value;
+    // Sheets turns "2024-01-15" into a Date; send dates back as printed and the timestamp in UTC
+    return col === 12 ? value.toISOString() : Utilities.formatDate(value, timeZone, "yyyy-MM-dd");
+  }));
+  try {
+    const response = UrlFetchApp.fetch(CONFIG.FLASK_API_URL + "/api/history/import", {
+      "method": "post",
+      "contentType": "application/json",
+      "payload": JSON.stringify({ user: userEmail.trim().toLowerCase(), rows: rows }),
+      "headers": { "X-API-Key": apiKey("APIR_API_KEY") },
+      "muteHttpExceptions": true
+    });
+    if (response.getResponseCode() !== 200) return false;
+    return JSON.parse(response.getContentText()).imported > 0;
+  } catch (e) {
+    Logger.log("History backfill failed: " + e.toString());
+    return false;
+  }
+}
+
+/**
+ * One page of history read straight from the sheet, newest first. `beforeRow` is the
+ * sheet row the previous page started at (null = start from the last row).
+ */
+function sheetHistoryPage(userEmail, beforeRow) {
+  const resources = UserResourceManager.get(userEmail);
+  const page = readSheetRows(resources.sheetId, beforeRow, CONFIG.HISTORY_PAGE_SIZE);
+  const result = {
+    success: true,
+    email: userEmail,
+    history: page.rows.reverse(),
+    nextBefore: page.firstRow > 2 ? "sheet:" + page.firstRow : null
+  };
+  if (!beforeRow) result.stats = sheetSummary(resources.sheetId);
+  return result;
+}
+
+/**
+ * Invoice count and total value over the whole sheet, computed here so the client doesn't
+ * need every row. Consecutive line-item rows of one invoice share its header, file and timestamp.
+ */
+function sheetSummary(sheetId) {
+  const sheet = SpreadsheetApp.openById(sheetId).getSheets()[0];
+  const lastRow = sheet.getLastRow();
+  const stats = { processedCount: 0, totalValue: 0 };
+  if (lastRow < 2) return stats;
+  const data = sheet.getRange(2, 1, lastRow - 1, 13).getValues();
+  let previous = null;
+  data.forEach(row => {
+    const key = [row[0], row[1], row[5], row[11], String(row[12])].join("\u0000");
+    if (key === previous) return;
+    previous = key;
+    stats.processedCount++;
+    stats.totalValue += Number(row[5]) || 0;
+  });
+  return stats;
+}
+
+/**
+ * Reads up to `count` data rows of the user's sheet ending just above `beforeRow`.
+ */
+function readSheetRows(sheetId, beforeRow, count) {
+    const ss = SpreadsheetApp.openById(sheetId);
     const sheet = ss.getSheets()[0];
-    const data = sheet.getDataRange().getValues();
+    const lastRow = beforeRow ? beforeRow - 1 : sheet.getLastRow();
+    if (lastRow < 2) return { rows: [], firstRow: 2 };
+    const firstRow = Math.max(2, lastRow - count + 1);
+    const data = sheet.getRange(firstRow, 1, lastRow - firstRow + 1, 13).getValues();
     
     const history = [];
-    if (data.length > 1) {
-      for (let i = 1; i < data.length; i++) {
+    for (let i = 0; i < data.length; i++) {
         const row = data[i];
         history.push({
            vendor_name: row[0],
@@ -81,17 +197,8 @@ function getUserData(userEmail) {
            file_url: row[11],
            timestamp: row[12] ? row[12].toString() : ""
         });
-      }
     }
-
-    return {
-      success: true,
-      email: userEmail,
-      history: history.reverse()
-    };
-  } catch (e) {
-    return { success: false, error: e.toString() };
-  }
+    return { rows: history, firstRow: firstRow };
 }
 
 /**
@@ -101,6 +208,7 @@ function clearUserWorkspace(userEmail) {
   try {
     if (!userEmail) throw new Error("No email provided");
     UserResourceManager.clear(userEmail);
+    deleteHistory(userEmail);
     return { success: true };
   } catch(e) {
     return { success: false, error: e.toString() };
@@ -124,7 +232,7 @@ function processInvoiceUpload(base64Data, filename, mimeType, userEmail) {
     const fileUrl = file.getUrl();
     
     // 2. Call Flask API
-    const apiResult = callFlaskAPI(blob, filename);
+    const apiResult = callFlaskAPI(blob, filename, userEmail, fileUrl);
     
     if (!apiResult.success) {
       throw new Error("API Error: " + apiResult.error);
@@ -190,18 +298,18 @@ const UserResourceManager = {
       if (files.hasNext()) {
         sheet = SpreadsheetApp.open(files.next());
       } else {
-        sheet = this.createSheet(folder, sheetName);
+        sheet = this.createSheet(folder, sheetName, email);
       }
     } else {
       folder = root.createFolder(folderName);
-      sheet = this.createSheet(folder, sheetName);
+      sheet = this.createSheet(folder, sheetName, email);
     }
     
     const resources = { folderId: folder.getId(), sheetId: sheet.getId() };
     return resources;
   },
   
-  createSheet: function(folder, name) {
+  createSheet: function(folder, name, email) {
     const ss = SpreadsheetApp.create(name);
     const file = DriveApp.getFileById(ss.getId());
     file.moveTo(folder); 
@@ -213,6 +321,12 @@ const UserResourceManager = {
         "Item Description", "Qty", "Unit Price", "Amount", "File URL", "Timestamp"
     ]);
     sheet.getRange(1, 1, 1, 13).setFontWeight("bold").setBackground("#e0e7ff");
+
+    // A recreated workspace gets its history back from the API in one batch write
+    const exported = fetchSheetRows(email);
+    if (exported && exported.rows.length > 0) {
+      sheet.getRange(2, 1, exported.rows.length, exported.columns.length).setValues(exported.rows);
+    }
     return ss;
   },
   
@@ -329,10 +443,16 @@ const MasterUserDB = {
   }
 };
 
-function callFlaskAPI(blob, filename) {
+function callFlaskAPI(blob, filename, userEmail, fileUrl) {
   const url = CONFIG.FLASK_API_URL + "/api/parse";
-  const payload = { "file": blob };
-  const options = { "method": "post", "payload": payload, "muteHttpExceptions": true };
+  // user and file_url let the API record the invoices in its history store
+  const payload = { "file": blob, "user": userEmail || "", "file_url": fileUrl || "" };
+  const options = {
+    "method": "post",
+    "payload": payload,
+    "headers": { "X-API-Key": apiKey("APIR_API_KEY") },
+    "muteHttpExceptions": true
+  };
   
   try {
     const response = UrlFetchApp.fetch(url, options);
@@ -345,6 +465,42 @@ function callFlaskAPI(blob, filename) {
   }
 }
 
+/**
+ * Calls a JSON endpoint of the Flask API. Returns null if it is unreachable or fails.
+ */
+function fetchFromAPI(path, params, method, keyName) {
+  const query = Object.keys(params)
+    .filter(key => params[key] !== undefined && params[key] !== null && params[key] !== "")
+    .map(key => encodeURIComponent(key) + "=" + encodeURIComponent(params[key]))
+    .join("&");
+  try {
+    const response = UrlFetchApp.fetch(CONFIG.FLASK_API_URL + path + "?" + query,
+                                       { "method": method || "get",
+                                         "headers": { "X-API-Key": apiKey(keyName || "APIR_API_KEY") },
+                                         "muteHttpExceptions": true });
+    if (response.getResponseCode() !== 200) return null;
+    const result = JSON.parse(response.getContentText());
+    return result.success ? result : null;
+  } catch (e) {
+    Logger.log("API request failed: " + e.toString());
+    return null;
+  }
+}
+
+function fetchHistoryPage(userEmail, before) {
+  return fetchFromAPI("/api/history", {
+    user: userEmail.trim().toLowerCase(), limit: CONFIG.HISTORY_PAGE_SIZE, before: before
+  });
+}
+
+function fetchSheetRows(userEmail) {
+  return fetchFromAPI("/api/history/rows", { user: userEmail.trim().toLowerCase() });
+}
+
+function deleteHistory(userEmail) {
+  return fetchFromAPI("/api/history", { user: userEmail.trim().toLowerCase() }, "delete", "APIR_DELETE_KEY");
+}
+
 function saveToUserSheet(sheetId, data) {
   try {
     const ss = SpreadsheetApp.openById(sheetId);
@@ -361,13 +517,12 @@ function saveToUserSheet(sheetId, data) {
       data.currency || "USD"
     ];
 
-    if (data.line_items && data.line_items.length > 0) {
-      data.line_items.forEach(item => {
-        sheet.appendRow([...common, item.description||"", item.quantity||0, item.unit_price||0, item.amount||0, data.file_url, timestamp]);
-      });
-    } else {
-      sheet.appendRow([...common, "", "", "", "", data.file_url, timestamp]);
-    }
+    const rows = (data.line_items && data.line_items.length > 0)
+      ? data.line_items.map(item => [...common, item.description||"", item.quantity||0, item.unit_price||0, item.amount||0, data.file_url, timestamp])
+      : [[...common, "", "", "", "", data.file_url, timestamp]];
+
+    // One batch write for all line items instead of an appendRow call per row
+    sheet.getRange(sheet.getLastRow() + 1, 1, rows.length, rows[0].length).setValues(rows);
     return { success: true };
   } catch (e) {
     return { success: false, error: e.toString() };
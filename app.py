@@ -1,43 +1,324 @@
 import os
+import hmac
+import time
+import queue
+import logging
 import secrets
-from flask import Flask, request, jsonify, render_template
+import threading
+import functools
+from tempfile import SpooledTemporaryFile
+from flask import Blueprint, Flask, Request, Response, current_app, request, jsonify, render_template
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from src.pipeline import Pipeline
+from src.cache import ExtractionCache
+from src.vendor_templates import VendorTemplateStore
+from src.jobs import JobQueue
+from src.invoice_store import MAX_EXPORT_ROWS, InvoiceStore
+from src.metrics import REGISTRY
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+# LOG_LEVEL=DEBUG brings back per-request detail such as raw LLM responses
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Uploads up to UPLOAD_SPILL_BYTES are parsed into memory and handed to the pipeline as
+# bytes; only larger ones spill to a temp file (werkzeug's own default spills at 500KB).
+UPLOAD_SPILL_BYTES = int(float(os.getenv("UPLOAD_SPILL_MB", "8")) * 1024 * 1024)
+
+class InMemoryUploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledTemporaryFile(max_size=UPLOAD_SPILL_BYTES, mode="rb+")
 
 # Configuration
 UPLOAD_FOLDER = 'temp_uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'tiff', 'bmp', 'txt'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+MAX_LONG_POLL_SECONDS = 60
+DEFAULT_CORS_ORIGINS = r"https://script.google.com,https://.*\.googleusercontent\.com"
+
+def build_pipeline():
+    """Builds the Pipeline from the environment. Imported here so `import app` stays cheap."""
+    from src.pipeline import Pipeline
+    from src.dedup import DuplicateIndex
+
+    # Content-addressed cache so re-uploads of the same file skip OCR and the LLM.
+    # Set EXTRACTION_CACHE_PATH to an empty string to disable.
+    cache_path = os.getenv("EXTRACTION_CACHE_PATH", "cache/extraction_cache.sqlite3")
+    extraction_cache = None
+    if cache_path:
+        extraction_cache = ExtractionCache(
+            cache_path,
+            max_bytes=int(float(os.getenv("EXTRACTION_CACHE_MAX_MB", "512")) * 1024 * 1024),
+            max_age_seconds=float(os.getenv("EXTRACTION_CACHE_MAX_AGE_DAYS", "30")) * 86400
+        )
+
+    # Vendor templates learned from validated results let recurring layouts skip the LLM.
+    # Set VENDOR_TEMPLATES_PATH to an empty string to disable.
+    templates_path = os.getenv("VENDOR_TEMPLATES_PATH", "cache/vendor_templates.json")
+    vendor_templates = None
+    if templates_path:
+        vendor_templates = VendorTemplateStore(
+            templates_path,
+            min_confidence=float(os.getenv("VENDOR_TEMPLATE_MIN_CONFIDENCE", "0.9")),
+            min_samples=int(os.getenv("VENDOR_TEMPLATE_MIN_SAMPLES", "2"))
+        )
+
+    # Near-duplicate index: rescans, photos and re-exports of invoices already extracted are
+    # flagged, or answered without the LLM when DUPLICATE_MODE=reuse. Empty path disables it.
+    duplicates_path = os.getenv("DUPLICATE_INDEX_PATH", "cache/duplicates.sqlite3")
+    duplicates = None
+    if duplicates_path:
+        duplicates = DuplicateIndex(
+            duplicates_path,
+            threshold=float(os.getenv("DUPLICATE_THRESHOLD", "0.85")),
+            mode=os.getenv("DUPLICATE_MODE", "reuse")
+        )
+
+    # NOTE: Ensure OPENAI_API_KEY is in .env
+    # OCR_WORKERS > 1 OCRs scanned PDF pages in parallel (0 = one per CPU)
+    # OCR_MAX_RASTER_MB caps decoded page bitmaps per request so long scans can't OOM a worker
+    return Pipeline(
+        use_mock=False,
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        llm_provider=os.getenv("LLM_PROVIDER", "openai"),
+        ocr_workers=int(os.getenv("OCR_WORKERS", "1")),
+        ocr_backend=os.getenv("OCR_BACKEND", "auto"),
+        ocr_lang=os.getenv("OCR_LANG", "eng"),
+        ocr_dpi=int(os.getenv("OCR_DPI", "200")),
+        ocr_grayscale=os.getenv("OCR_GRAYSCALE", "false").lower() == "true",
+        ocr_preprocess=os.getenv("OCR_PREPROCESS", "none"),
+        ocr_preprocess_dpi=int(os.getenv("OCR_PREPROCESS_DPI", "300")),
+        max_raster_mb=float(os.getenv("OCR_MAX_RASTER_MB")) if os.getenv("OCR_MAX_RASTER_MB") else None,
+        cache=extraction_cache,
+        templates=vendor_templates,
+        duplicates=duplicates,
+        max_input_tokens=int(os.getenv("LLM_MAX_INPUT_TOKENS", "12000")),
+        llm_batch_window=float(os.getenv("LLM_BATCH_WINDOW", "0")),
+        llm_batch_size=int(os.getenv("LLM_BATCH_SIZE", "8")),
+        llm_batch_doc_tokens=int(os.getenv("LLM_BATCH_DOC_TOKENS", "2000")),
+        validation_reask=os.getenv("VALIDATION_REASK", "true").lower() == "true",
+        validation_report=os.getenv("VALIDATION_REPORT", "false").lower() == "true"
+    )
+
+class PipelineLoader:
+    """Creates the Pipeline on first use, or ahead of it in a background warm-up thread.
+
+    The server starts listening (and /health answers) straight away; a request that
+    arrives before warm-up has finished waits for it instead of building a second one.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.state = "cold"  # cold -> warming_up -> ready | failed
+        self.error = None
+        self._pipeline = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def get(self):
+        if self._pipeline is None:
+            with self._lock:
+                if self._pipeline is None:
+                    self._pipeline = self.factory()
+        return self._pipeline
+
+    def warm_up(self):
+        started = time.perf_counter()
+        self.state = "warming_up"
+        try:
+            self.get().warm_up()
+        except Exception as e:
+            # Requests still build whatever they need on demand and report their own errors
+            self.state, self.error = "failed", str(e)
+            logger.error("Pipeline warm-up failed: %s", e)
+            return
+        self.state = "ready"
+        logger.info("Pipeline ready %.2fs after warm-up started", time.perf_counter() - started)
+
+    def start_warm_up(self) -> threading.Thread:
+        thread = threading.Thread(target=self.warm_up, name="pipeline-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+def create_app(warm_up=None):
+    """App factory. Heavy imports and Pipeline construction are deferred to a background
+    warm-up (PIPELINE_WARMUP=true, the default) or to the first request that needs them."""
+    app = Flask(__name__)
+    app.request_class = InMemoryUploadRequest
+    # The Apps Script calls the API server-side (UrlFetchApp) and the bundled UI is same-origin,
+    # so browsers on other origins get no CORS grant; CORS_ORIGINS adds more (comma-separated)
+    CORS(app, origins=[o.strip() for o in os.getenv("CORS_ORIGINS", DEFAULT_CORS_ORIGINS).split(",") if o.strip()])
+    # Shared secrets the Apps Script sends as X-API-Key. History is only served, and uploads
+    # only attributed to a user, with HISTORY_API_KEY; deleting a history needs HISTORY_DELETE_KEY.
+    app.config["HISTORY_API_KEY"] = os.getenv("HISTORY_API_KEY", "")
+    app.config["HISTORY_DELETE_KEY"] = os.getenv("HISTORY_DELETE_KEY", "")
+    # /metrics reveals providers, backends and traffic, so it is only served with METRICS_API_KEY
+    app.config["METRICS_API_KEY"] = os.getenv("METRICS_API_KEY", "")
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+
+    # Ensure upload directory exists
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+    loader = PipelineLoader(build_pipeline)
+
+    # Every extracted invoice is recorded per user for /api/history and /api/history/rows.
+    # Set INVOICE_STORE_PATH to an empty string to disable.
+    store_path = os.getenv("INVOICE_STORE_PATH", "cache/invoices.sqlite3")
+    store = InvoiceStore(store_path) if store_path else None
+
+    # Background job queue for /api/jobs. Uploads return job IDs immediately and are
+    # processed by JOB_WORKERS threads; JOB_QUEUE_SIZE bounds the backlog.
+    jobs = JobQueue(
+        lambda source, filename, **options: process_upload(loader.get(), source, filename, store=store, **options),
+        workers=int(os.getenv("JOB_WORKERS", "2")),
+        max_queue=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+        result_ttl=float(os.getenv("JOB_RESULT_TTL", "3600"))
+    )
+    app.extensions["apir"] = {"pipeline": loader, "jobs": jobs, "store": store}
+    app.register_blueprint(api)
+
+    if warm_up is None:
+        warm_up = os.getenv("PIPELINE_WARMUP", "true").lower() == "true"
+    if warm_up:
+        loader.start_warm_up()
+    return app
+
+def pipeline_loader() -> PipelineLoader:
+    return current_app.extensions["apir"]["pipeline"]
+
+def job_queue() -> JobQueue:
+    return current_app.extensions["apir"]["jobs"]
+
+def invoice_store() -> InvoiceStore:
+    return current_app.extensions["apir"]["store"]
+
+def process_upload(pipeline, source, filename, store=None, user=None, file_url=None):
+    """Runs the pipeline on an upload held in memory (bytes) or spilled to disk (path)
+    and records the invoices it found in `store` under `user`, if given."""
+    if isinstance(source, bytes):
+        result = pipeline.process_bytes(source, filename)
+    else:
+        result = pipeline.process_file(source)
+    if store is not None and user:
+        store.add(result, user=user, source_file=filename, file_url=file_url)
+    return result
+
+def has_key(config_name):
+    """True if the request's X-API-Key (or Authorization: Bearer, as Prometheus sends it)
+    matches the configured secret (never when it is unset)."""
+    expected = current_app.config.get(config_name, "")
+    given = request.headers.get("X-API-Key", "")
+    authorization = request.headers.get("Authorization", "")
+    if not given and authorization.startswith("Bearer "):
+        given = authorization[len("Bearer "):].strip()
+    return bool(expected) and hmac.compare_digest(given, expected)
 
-# Ensure upload directory exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+def requires_key(config_name):
+    """Rejects requests whose key (see has_key) doesn't match app.config[config_name]; with no
+    key configured the route is disabled."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            if not current_app.config.get(config_name):
+                return jsonify({"success": False, "error": f"{config_name} is not configured"}), 403
+            if not has_key(config_name):
+                return jsonify({"success": False, "error": "Invalid or missing API key"}), 401
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
 
-# Initialize Pipeline
-# NOTE: Ensure OPENAI_API_KEY is in .env
-pipeline = Pipeline(use_mock=False, openai_api_key=os.getenv("OPENAI_API_KEY"))
+def upload_options():
+    """Optional form fields sent alongside uploads: the uploader and where the file is kept.
+
+    `user` is only honoured from a caller holding HISTORY_API_KEY, so nobody else can write
+    into a user's history.
+    """
+    if not has_key("HISTORY_API_KEY"):
+        return {"user": None, "file_url": None}
+    return {"user": request.form.get('user'), "file_url": request.form.get('file_url')}
+
+api = Blueprint("api", __name__)
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
+def save_upload(file):
+    """Saves an upload under a unique name in UPLOAD_FOLDER and returns its path."""
+    filename = secure_filename(file.filename)
+    unique_filename = f"{secrets.token_hex(8)}_{filename}"
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+    file.save(file_path)
+    return file_path
+
+def read_upload(file):
+    """Returns the upload's bytes if it fits under UPLOAD_SPILL_BYTES, otherwise its saved path."""
+    stream = file.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size <= UPLOAD_SPILL_BYTES:
+        return stream.read()
+    return save_upload(file)
+
+def long_poll_seconds():
+    try:
+        return min(max(float(request.args.get('wait', 0)), 0), MAX_LONG_POLL_SECONDS)
+    except ValueError:
+        return 0
+
+@api.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/health', methods=['GET'])
+@api.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "healthy", "service": "Project APIR Pipeline"}), 200
+    """Liveness plus readiness: never waits on the pipeline, which may still be warming up."""
+    loader = pipeline_loader()
+    return jsonify({
+        "status": "healthy",
+        "service": "Project APIR Pipeline",
+        "ready": loader.ready,
+        "pipeline": loader.state
+    }), 200
+
+@api.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    extraction_cache = pipeline_loader().get().cache
+    if extraction_cache is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, "layers": extraction_cache.stats()}), 200
+
+@api.route('/metrics', methods=['GET'])
+@requires_key("METRICS_API_KEY")
+def metrics():
+    """Prometheus text exposition of pipeline counters and latency histograms."""
+    return Response(REGISTRY.render_prometheus(), mimetype="text/plain; version=0.0.4")
 
-@app.route('/api/parse', methods=['POST'])
+@api.route('/api/templates/stats', methods=['GET'])
+def template_stats():
+    vendor_templates = pipeline_loader().get().templates
+    if vendor_templates is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **vendor_templates.stats()}), 200
+
+@api.route('/api/duplicates/stats', methods=['GET'])
+def duplicate_stats():
+    duplicates = pipeline_loader().get().duplicates
+    if duplicates is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **duplicates.stats()}), 200
+
+@api.route('/api/parse', methods=['POST'])
 def parse_invoice():
     # 1. Check if file is present
     if 'file' not in request.files:
@@ -49,22 +330,24 @@ def parse_invoice():
         return jsonify({"error": "No selected file"}), 400
     
     if file and allowed_file(file.filename):
-        # 2. Save file securely with unique name
-        filename = secure_filename(file.filename)
-        unique_filename = f"{secrets.token_hex(8)}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+        # 2. Keep small uploads in memory; only oversized ones are saved to disk
+        file_path = None
         
         try:
-            file.save(file_path)
-            print(f"File saved to {file_path}")
+            source = read_upload(file)
+            if isinstance(source, str):
+                file_path = source
+                logger.debug("File spilled to %s", file_path)
             
             # 3. Process with Pipeline
-            print("Starting pipeline processing...")
-            result = pipeline.process_file(file_path)
+            logger.debug("Starting pipeline processing...")
+            result = process_upload(pipeline_loader().get(), source, file.filename,
+                                    store=invoice_store(), **upload_options())
             
             # 4. Clean up
-            os.remove(file_path)
-            print(f"Cleaned up {file_path}")
+            if file_path:
+                os.remove(file_path)
+                logger.debug("Cleaned up %s", file_path)
             
             # 5. Return result
             # 5. Return result
@@ -79,12 +362,148 @@ def parse_invoice():
             
         except Exception as e:
             # Attempt cleanup if failed
-            if os.path.exists(file_path):
+            if file_path and os.path.exists(file_path):
                 os.remove(file_path)
             return jsonify({"success": False, "error": str(e)}), 500
     
     return jsonify({"error": "File type not allowed"}), 400
 
+@api.route('/api/jobs', methods=['POST'])
+def submit_jobs():
+    """Accepts one or more files (multipart field `files`, or `file`) and queues each as a job."""
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({"error": "No file part"}), 400
+
+    jobs = []
+    rejected = []
+    options = upload_options()
+    for file in files:
+        if file.filename == '' or not allowed_file(file.filename):
+            rejected.append({"filename": file.filename, "error": "File type not allowed"})
+            continue
+        source = read_upload(file)
+        try:
+            jobs.append(job_queue().submit(source, file.filename, options))
+        except queue.Full:
+            if isinstance(source, str):
+                os.remove(source)
+            rejected.append({"filename": file.filename, "error": "Job queue is full, retry later"})
+
+    if not jobs:
+        status = 503 if any("queue is full" in r["error"] for r in rejected) else 400
+        return jsonify({"success": False, "jobs": [], "rejected": rejected}), status
+
+    return jsonify({
+        "success": True,
+        "jobs": [{"job_id": j["job_id"], "filename": j["filename"], "status": j["status"]} for j in jobs],
+        "rejected": rejected
+    }), 202
+
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status and, once finished, its result. `?wait=N` long-polls up to N seconds."""
+    job = job_queue().wait([job_id], long_poll_seconds())[0]
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job), 200
+
+@api.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    """Batch status for `?ids=a,b,c`. `?wait=N` long-polls until all are finished."""
+    job_ids = [job_id for job_id in request.args.get('ids', '').split(',') if job_id]
+    if not job_ids:
+        return jsonify(job_queue().stats()), 200
+    jobs = job_queue().wait(job_ids, long_poll_seconds())
+    return jsonify({
+        "jobs": [job or {"job_id": job_id, "status": "unknown"} for job_id, job in zip(job_ids, jobs)]
+    }), 200
+
+def history_filters():
+    return {
+        "vendor": request.args.get('vendor'),
+        "invoice_number": request.args.get('invoice_number'),
+        "date_from": request.args.get('date_from'),
+        "date_to": request.args.get('date_to'),
+    }
+
+def int_arg(name, default=None):
+    """Integer query parameter, or `default` when absent. Raises ValueError when malformed."""
+    value = request.args.get(name, '').strip()
+    return int(value) if value else default
+
+@api.route('/api/history', methods=['GET'])
+@requires_key("HISTORY_API_KEY")
+def get_history():
+    """One page of a user's invoices, newest first.
+
+    `?user=` is required; `limit`, and `before` (the previous page's `next_before`) page
+    through the rest. Optional filters: `vendor`, `invoice_number`, `date_from`, `date_to`.
+    The first page also carries `summary`: the count and total value of every matching invoice.
+    """
+    store = invoice_store()
+    if store is None:
+        return jsonify({"enabled": False}), 404
+    user = request.args.get('user', '').strip()
+    if not user:
+        return jsonify({"success": False, "error": "user is required"}), 400
+    try:
+        limit, before = int_arg('limit', 50), int_arg('before')
+    except ValueError:
+        return jsonify({"success": False, "error": "limit and before must be integers"}), 400
+    page = store.history(user, limit=limit, before=before, **history_filters())
+    if before is None:
+        page["summary"] = store.summary(user, **history_filters())
+    return jsonify({"success": True, **page}), 200
+
+@api.route('/api/history/rows', methods=['GET'])
+@requires_key("HISTORY_API_KEY")
+def export_history_rows():
+    """A user's invoices as sheet rows (one per line item, oldest first) for a single bulk write.
+
+    Pass the previous response's `last_id` as `?after=` to fetch only newer rows.
+    """
+    store = invoice_store()
+    if store is None:
+        return jsonify({"enabled": False}), 404
+    user = request.args.get('user', '').strip()
+    if not user:
+        return jsonify({"success": False, "error": "user is required"}), 400
+    try:
+        after, limit = int_arg('after', 0), int_arg('limit', MAX_EXPORT_ROWS)
+    except ValueError:
+        return jsonify({"success": False, "error": "after and limit must be integers"}), 400
+    return jsonify({"success": True, **store.sheet_rows(user, after=after, limit=limit, **history_filters())}), 200
+
+@api.route('/api/history/import', methods=['POST'])
+@requires_key("HISTORY_API_KEY")
+def import_history():
+    """Backfills a user's empty history from their sheet: JSON {"user", "rows"} in SHEET_COLUMNS
+    order, oldest first. Users who already have history are left unchanged (`imported` = 0)."""
+    store = invoice_store()
+    if store is None:
+        return jsonify({"enabled": False}), 404
+    body = request.get_json(silent=True) or {}
+    user = str(body.get('user') or '').strip()
+    rows = body.get('rows')
+    if not user or not isinstance(rows, list) or not all(isinstance(row, list) for row in rows):
+        return jsonify({"success": False, "error": "user and a list of rows are required"}), 400
+    return jsonify({"success": True, "imported": store.import_sheet_rows(user, rows)}), 200
+
+@api.route('/api/history', methods=['DELETE'])
+@requires_key("HISTORY_DELETE_KEY")
+def delete_history():
+    store = invoice_store()
+    if store is None:
+        return jsonify({"enabled": False}), 404
+    user = request.args.get('user', '').strip()
+    if not user:
+        return jsonify({"success": False, "error": "user is required"}), 400
+    return jsonify({"success": True, "deleted": store.delete_user(user)}), 200
+
+# Module-level app for `gunicorn app:app` and `python app.py`
+app = create_app()
+
 if __name__ == '__main__':
     # Running on 0.0.0.0 to easily allow local network testing if needed
     app.run(host='0.0.0.0', port=5000, debug=True)
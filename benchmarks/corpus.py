@@ -0,0 +1,136 @@
+import os
+import random
+from typing import List, Tuple
+from PIL import Image, ImageDraw, ImageFont
+
+# Synthetic invoices for benchmarking. Everything is generated locally (no fonts or
+# fixtures to download), and a fixed seed keeps corpora identical between runs.
+
+PAGE_WIDTH_PTS, PAGE_HEIGHT_PTS = 612, 792  # US Letter
+LINES_PER_PAGE = 45
+VENDORS = ["Acme Supplies Ltd", "Globex Corporation", "Initech Services", "Umbrella Logistics", "Stark Components"]
+PRODUCTS = ["Widget", "Gadget", "Bracket", "Cable assembly", "Service hours", "Shipping", "Bolt pack", "Sensor"]
+
+def invoice_lines(seed: int, pages: int) -> List[List[str]]:
+    """Text of one invoice, split into pages of LINES_PER_PAGE lines (header, items, totals)."""
+    rng = random.Random(seed)
+    vendor = rng.choice(VENDORS)
+    number = f"INV-{seed:05d}"
+    header = [
+        vendor,
+        "123 Industrial Way, Springfield",
+        f"Invoice #: {number}",
+        f"Date: 2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "",
+        "Description Qty Unit Price Amount",
+    ]
+    per_page = LINES_PER_PAGE - 2  # each page also gets a running header and a page counter
+    item_count = max(1, pages * per_page - len(header) - 4)
+    items = []
+    subtotal = 0.0
+    for i in range(item_count):
+        qty = rng.randint(1, 20)
+        price = round(rng.uniform(1, 500), 2)
+        subtotal += qty * price
+        items.append(f"{rng.choice(PRODUCTS)} {i + 1} {qty} {price:,.2f} {qty * price:,.2f}")
+    tax = round(subtotal * 0.08, 2)
+    totals = [f"Subtotal {subtotal:,.2f}", f"Tax {tax:,.2f}", f"Total Due {subtotal + tax:,.2f}", "Thank you for your business"]
+
+    body = header + items + totals
+    result = []
+    for start in range(0, len(body), per_page):
+        page_no = len(result) + 1
+        result.append([f"{vendor} - {number}"] + body[start:start + per_page] + [f"Page {page_no}"])
+    return result
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_text_pdf(path: str, pages: List[List[str]]):
+    """Writes a minimal PDF with a real text layer (Helvetica, one text object per page)."""
+    objects = []  # object bodies, numbered from 1
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(b"")  # filled in once the kids are known
+    kids = []
+    for lines in pages:
+        stream = "BT /F1 10 Tf 50 760 Td 14 TL\n" + "".join(f"({_pdf_escape(line)}) '\n" for line in lines) + "ET"
+        stream_bytes = stream.encode("latin-1", "replace")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream_bytes) + stream_bytes + b"\nendstream")
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (pages_id, PAGE_WIDTH_PTS, PAGE_HEIGHT_PTS, font_id, content_id)
+        ))
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{k} 0 R" for k in kids).encode(), len(kids))
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+def render_page(lines: List[str], dpi: int = 150, seed: int = 0) -> Image.Image:
+    """Draws a page like a flatbed scan: grayscale, slight noise, no text layer."""
+    scale = dpi / 72
+    image = Image.new("L", (int(PAGE_WIDTH_PTS * scale), int(PAGE_HEIGHT_PTS * scale)), 255)
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=int(10 * scale))
+    except TypeError:  # Pillow < 10.1 has a single fixed-size bitmap font
+        font = ImageFont.load_default()
+    y = 32 * scale
+    for line in lines:
+        draw.text((50 * scale, y), line, fill=0, font=font)
+        y += 14 * scale
+    rng = random.Random(seed)
+    pixels = image.load()
+    for _ in range(image.width * image.height // 2000):
+        pixels[rng.randrange(image.width), rng.randrange(image.height)] = rng.randint(0, 160)
+    return image
+
+def write_scanned_pdf(path: str, pages: List[List[str]], dpi: int = 150, seed: int = 0):
+    images = [render_page(lines, dpi, seed + i) for i, lines in enumerate(pages)]
+    images[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+
+def write_image(path: str, pages: List[List[str]], dpi: int = 150, seed: int = 0):
+    render_page(pages[0], dpi, seed).save(path)
+
+def write_text(path: str, pages: List[List[str]]):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\f".join("\n".join(lines) for lines in pages))
+
+WRITERS = {
+    "text_pdf": (".pdf", lambda path, pages, seed: write_text_pdf(path, pages)),
+    "scanned_pdf": (".pdf", lambda path, pages, seed: write_scanned_pdf(path, pages, seed=seed)),
+    "image": (".png", lambda path, pages, seed: write_image(path, pages, seed=seed)),
+    "text": (".txt", lambda path, pages, seed: write_text(path, pages)),
+}
+
+def build_corpus(directory: str, kind: str, pages: int, files: int, seed: int = 0) -> Tuple[List[str], int]:
+    """Generates `files` invoices of one kind and returns (paths, total pages)."""
+    extension, writer = WRITERS[kind]
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    total_pages = 0
+    for i in range(files):
+        doc_seed = seed * 1000 + i
+        doc_pages = invoice_lines(doc_seed, pages)
+        if kind == "image":
+            doc_pages = doc_pages[:1]
+        path = os.path.join(directory, f"{kind}_{pages}p_{i:03d}{extension}")
+        writer(path, doc_pages, doc_seed)
+        paths.append(path)
+        total_pages += len(doc_pages)
+    return paths, total_pages
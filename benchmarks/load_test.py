@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import build_corpus
+from benchmarks.run_benchmarks import RESULTS_DIR, _percentile, git_revision
+
+# Closed-loop load test against recorded LLM responses (see src/llm_replay.py), fully offline:
+#   python -m benchmarks.load_test --concurrency 8 --requests 200
+#   python -m benchmarks.load_test --replay replay/corpus.jsonl --latency sample --latency-scale 0.5
+# Without --replay, a corpus is first recorded from the stub LLM server with --stub-latency/--stub-jitter.
+# `--url` drives an already running server instead (which must itself run with LLM_PROVIDER=replay).
+
+TARGETS = {
+    "pipeline": "Pipeline.process_file in-process",
+    "api": "POST /api/parse over HTTP (in-process server unless --url)",
+}
+
+def record_corpus(paths: List[str], output: str, latency: float, jitter: float, concurrency: int) -> int:
+    """Runs every document once through the real OpenAI client against the stub server, recording to `output`."""
+    from stub_llm_server import start_stub_server
+    from src.pipeline import Pipeline
+
+    server = start_stub_server(port=0, latency=latency, jitter=jitter)
+    env = {
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}/v1",
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_MODEL": "stub",
+        "LLM_RECORD_PATH": output,
+    }
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        pipeline = Pipeline(llm_provider="openai", openai_api_key="stub")
+        pipeline.warm_up()  # keep one-off import costs out of the recorded latencies
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(pipeline.process_file, paths))
+    finally:
+        server.shutdown()
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    with open(output, "r", encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+def drive(call: Callable[[str], bool], paths: List[str], requests: int, concurrency: int) -> Dict[str, Any]:
+    """Keeps `concurrency` requests in flight until `requests` have completed, cycling over `paths`."""
+    latencies: List[float] = []
+    errors = 0
+    issued = 0
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal issued, errors
+        while True:
+            with lock:
+                if issued >= requests:
+                    return
+                path = paths[issued % len(paths)]
+                issued += 1
+            started = time.perf_counter()
+            try:
+                ok = call(path)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors += 0 if ok else 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"load-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "latency_mean_s": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        **{f"latency_p{pct}_s": round(_percentile(latencies, pct), 4) for pct in (50, 90, 95, 99)},
+        "latency_max_s": round(max(latencies), 4) if latencies else 0.0,
+    }
+
+def llm_totals() -> Dict[str, float]:
+    """Replayed LLM calls, their total time and lookup results so far, from the metrics registry."""
+    from src.metrics import LLM_REPLAY_TOTAL, LLM_SECONDS
+    data = LLM_SECONDS.snapshot().get(("replay",))
+    replay = {key[0]: value for key, value in LLM_REPLAY_TOTAL.values().items()}
+    return {
+        "calls": sum(data[:-1]) if data else 0,
+        "seconds": data[-1] if data else 0.0,
+        "hits": replay.get("hit", 0),
+        "misses": replay.get("miss", 0),
+    }
+
+def llm_delta(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, Any]:
+    calls = after["calls"] - before["calls"]
+    return {
+        "calls": calls,
+        "mean_s": round((after["seconds"] - before["seconds"]) / calls, 4) if calls else 0.0,
+        "replay_hits": after["hits"] - before["hits"],
+        "replay_misses": after["misses"] - before["misses"],
+    }
+
+def pipeline_target(validation_reask: bool) -> Callable[[str], bool]:
+    from src.pipeline import Pipeline
+    pipeline = Pipeline(llm_provider="replay", validation_reask=validation_reask)
+    pipeline.warm_up()
+
+    def call(path: str) -> bool:
+        invoices = pipeline.process_file(path)
+        return bool(invoices) and not any("error" in inv for inv in invoices)
+    return call
+
+def multipart(filename: str, data: bytes) -> tuple:
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n").encode("utf-8")
+    return head + data + f"\r\n--{boundary}--\r\n".encode("utf-8"), f"multipart/form-data; boundary={boundary}"
+
+def api_target(url: Optional[str], timeout: float) -> tuple:
+    """(call, shutdown). Without `url`, serves a fresh app with the replay provider on a free port."""
+    server = None
+    if url is None:
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no access log line per request
+        from app import app as flask_app
+        flask_app.extensions["apir"]["pipeline"].get()  # build before timing, as after warm-up
+        server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="load-server", daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+    endpoint = url.rstrip("/") + "/api/parse"
+    documents = {}
+
+    def call(path: str) -> bool:
+        if path not in documents:
+            with open(path, "rb") as f:
+                documents[path] = f.read()
+        body, content_type = multipart(os.path.basename(path), documents[path])
+        req = urllib.request.Request(endpoint, data=body, headers={"Content-Type": content_type}, method="POST")
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                return bool(json.loads(response.read()).get("success"))
+        except urllib.error.HTTPError:
+            return False
+
+    def shutdown():
+        if server is not None:
+            server.shutdown()
+    return call, shutdown
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the pipeline and /api/parse against recorded LLM responses")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"Comma-separated subset of {', '.join(TARGETS)}")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests kept in flight (default: 8)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per target (default: 200)")
+    parser.add_argument("--replay", default=None, help="Recorded corpus (LLM_RECORD_PATH output); default: record one from the stub server")
+    parser.add_argument("--latency", default="recorded", choices=["recorded", "sample"], help="Replay each response's own latency or draw from all of them (default: recorded)")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier on replayed latencies; 0 = no delay (default: 1.0)")
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="Stub server base latency when recording (default: 0.2)")
+    parser.add_argument("--stub-jitter", type=float, default=0.3, help="Stub server extra random latency when recording (default: 0.3)")
+    parser.add_argument("--kind", default="text", choices=["text", "text_pdf"], help="Generated documents (default: text)")
+    parser.add_argument("--files", type=int, default=20, help="Distinct documents to cycle over (default: 20)")
+    parser.add_argument("--pages", type=int, default=1, help="Pages per document (default: 1)")
+    parser.add_argument("--no-reask", action="store_true", help="Don't re-ask the LLM about inconsistent invoices")
+    parser.add_argument("--url", default=None, help="Drive an already running server at this base URL instead")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout for the api target (default: 120)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Results JSON path (default: benchmarks/results/load-<timestamp>.json)")
+    parser.add_argument("--keep-corpus", action="store_true", help="Keep the generated documents and recorded corpus")
+    args = parser.parse_args(argv)
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    for target in targets:
+        if target not in TARGETS:
+            parser.error(f"unknown target {target!r}")
+
+    workdir = tempfile.mkdtemp(prefix="apir-load-")
+    paths, _ = build_corpus(os.path.join(workdir, "documents"), args.kind, args.pages, args.files, args.seed)
+    replay = args.replay
+    if replay is None:
+        replay = os.path.join(workdir, "replay.jsonl")
+        print(f"Recording {len(paths)} documents from the stub server "
+              f"(latency {args.stub_latency}s + up to {args.stub_jitter}s)...")
+        print(f"Recorded {record_corpus(paths, replay, args.stub_latency, args.stub_jitter, args.concurrency)} responses")
+
+    # Nothing may answer from a store instead of the LLM, or later rounds would measure lookups
+    os.environ.update({
+        "LLM_PROVIDER": "replay",
+        "LLM_REPLAY_PATH": replay,
+        "LLM_REPLAY_LATENCY": args.latency,
+        "LLM_REPLAY_LATENCY_SCALE": str(args.latency_scale),
+        "VALIDATION_REASK": "false" if args.no_reask else "true",
+        "EXTRACTION_CACHE_PATH": "",
+        "VENDOR_TEMPLATES_PATH": "",
+        "DUPLICATE_INDEX_PATH": "",
+        "INVOICE_STORE_PATH": "",
+        "PIPELINE_WARMUP": "false",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+    os.environ.pop("LLM_RECORD_PATH", None)
+    import logging
+    logging.basicConfig(level=os.environ["LOG_LEVEL"].upper())
+
+    run = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "targets": [],
+    }
+    try:
+        for target in targets:
+            print(f"Running {target}: {args.requests} requests at concurrency {args.concurrency}...")
+            shutdown = None
+            if target == "pipeline":
+                call = pipeline_target(not args.no_reask)
+            else:
+                call, shutdown = api_target(args.url, args.timeout)
+            before = llm_totals()
+            try:
+                result = drive(call, paths, args.requests, max(1, args.concurrency))
+            finally:
+                if shutdown is not None:
+                    shutdown()
+            result = {"name": target, **result}
+            if not (target == "api" and args.url):
+                result["llm"] = llm_delta(before, llm_totals())
+            run["targets"].append(result)
+    finally:
+        if args.keep_corpus:
+            print(f"Corpus kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'target':<9} {'reqs':>5} {'errors':>6} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'max s':>7} {'llm s':>7}  replay hit/miss")
+    for r in run["targets"]:
+        llm = r.get("llm")
+        print(f"{r['name']:<9} {r['requests']:>5} {r['errors']:>6} {r['throughput_rps']:>8.2f} {r['latency_p50_s']:>7.3f} "
+              f"{r['latency_p95_s']:>7.3f} {r['latency_p99_s']:>7.3f} {r['latency_max_s']:>7.3f} "
+              f"{llm['mean_s'] if llm else float('nan'):>7.3f}  "
+              + (f"{llm['replay_hits']:g}/{llm['replay_misses']:g}" if llm else "-"))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nSaved results to {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
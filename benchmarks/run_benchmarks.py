@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import time
+import shutil
+import inspect
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import build_corpus
+
+# End-to-end pipeline benchmark on synthetic corpora. Runs fully offline against MockLLM
+# or the local stub LLM server, e.g.:
+#   python -m benchmarks.run_benchmarks --files 5
+#   python -m benchmarks.run_benchmarks --llm stub --stub-latency 0.2 --compare benchmarks/results/<baseline>.json
+
+DEFAULT_SCENARIOS = "text_pdf:1,text_pdf:10,scanned_pdf:1,scanned_pdf:3,image:1,text:1,text:10"
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+STAGES = ("startup", "prepare", "native_extract", "rasterize", "preprocess", "ocr", "llm", "validate", "export_json", "export_csv")
+
+class StageTimer:
+    """Accumulates exclusive wall time per stage for wrapped methods.
+
+    Nested stages are subtracted from their parent, so "native_extract" excludes the
+    rasterization and OCR it triggers. Meant for one thread; OCR worker processes are
+    timed from the outside as part of "ocr".
+    """
+
+    def __init__(self):
+        self.totals: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self._stack: List[List[Any]] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        frame = [name, 0.0]
+        self._stack.append(frame)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stack.pop()
+            self.totals[name] = self.totals.get(name, 0.0) + elapsed - frame[1]
+            if self._stack:
+                self._stack[-1][1] += elapsed
+
+    def wrap(self, obj: Any, attr: str, name: str):
+        original = getattr(obj, attr)
+        if inspect.isgeneratorfunction(original):
+            def timed_gen(*args, **kwargs):
+                gen = original(*args, **kwargs)
+                while True:
+                    with self.stage(name):
+                        try:
+                            item = next(gen)
+                        except StopIteration:
+                            return
+                    yield item
+            setattr(obj, attr, timed_gen)
+        else:
+            def timed(*args, **kwargs):
+                with self.stage(name):
+                    return original(*args, **kwargs)
+            setattr(obj, attr, timed)
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def run_scenario(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs one scenario. Called in a fresh process so peak RSS belongs to it alone."""
+    if scenario.get("base_url"):
+        os.environ["OPENAI_BASE_URL"] = scenario["base_url"]
+        os.environ["OPENAI_API_KEY"] = "stub"
+        os.environ["OPENAI_MODEL"] = "stub"
+    if scenario["tracemalloc"]:
+        import tracemalloc
+        tracemalloc.start()
+
+    timer = StageTimer()
+    latencies = []
+    errors = 0
+    quiet = open(os.devnull, "w") if not scenario["verbose"] else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        with timer.stage("startup"):
+            from src.pipeline import Pipeline
+            pipeline = Pipeline(
+                use_mock=scenario["llm"] == "mock",
+                openai_api_key=os.getenv("OPENAI_API_KEY"),
+                ocr_workers=scenario["ocr_workers"],
+                ocr_backend=scenario["ocr_backend"],
+                ocr_dpi=scenario["dpi"],
+                ocr_preprocess=scenario["preprocess"]
+            )
+        timer.wrap(pipeline, "_prepare", "prepare")
+        timer.wrap(pipeline, "_finalize", "validate")
+        timer.wrap(pipeline, "save_to_json", "export_json")
+        timer.wrap(pipeline, "save_to_csv", "export_csv")
+        timer.wrap(pipeline.llm, "analyze_text", "llm")
+        timer.wrap(pipeline.ocr, "extract_pdf_pages", "native_extract")
+        timer.wrap(pipeline.ocr, "iter_pdf_pages", "rasterize")
+        timer.wrap(pipeline.ocr, "ocr_images", "ocr")
+        timer.wrap(pipeline.ocr, "extract_text_from_image", "ocr")
+        if pipeline.ocr.preprocessor is not None:
+            # In-process pages only; with --ocr-workers > 1 preprocessing runs inside the workers
+            timer.wrap(pipeline.ocr.preprocessor, "preprocess", "preprocess")
+
+        started = time.perf_counter()
+        results = []
+        for path in scenario["paths"]:
+            file_started = time.perf_counter()
+            try:
+                invoices = pipeline.process_file(path)
+            except Exception as e:
+                invoices = [{"error": str(e), "file": path}]
+            latencies.append(time.perf_counter() - file_started)
+            errors += sum(1 for inv in invoices if "error" in inv)
+            results.extend(invoices)
+        pipeline.save_to_json(results, os.path.join(scenario["workdir"], "results.json"))
+        pipeline.save_to_csv(results, os.path.join(scenario["workdir"], "results.csv"))
+        wall = time.perf_counter() - started
+        pipeline.ocr.close()
+    if quiet:
+        quiet.close()
+
+    py_peak_mb = None
+    if scenario["tracemalloc"]:
+        py_peak_mb = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+
+    files = len(scenario["paths"])
+    return {
+        "name": scenario["name"],
+        "kind": scenario["kind"],
+        "pages_per_file": scenario["pages"],
+        "files": files,
+        "pages": scenario["total_pages"],
+        "wall_s": round(wall, 4),
+        "files_per_s": round(files / wall, 3) if wall else 0.0,
+        "pages_per_s": round(scenario["total_pages"] / wall, 3) if wall else 0.0,
+        "latency_p50_s": round(_percentile(latencies, 50), 4),
+        "latency_p95_s": round(_percentile(latencies, 95), 4),
+        "stages_s": {stage: round(seconds, 4) for stage, seconds in timer.totals.items()},
+        "peak_rss_mb": _peak_rss_mb(),
+        "py_peak_mb": py_peak_mb,
+        "errors": errors,
+    }
+
+def missing_tools(kind: str) -> Optional[str]:
+    """Reason a scenario can't run here, or None. Scans need poppler and tesseract."""
+    if kind == "scanned_pdf" and not shutil.which("pdftoppm"):
+        return "poppler (pdftoppm) not installed"
+    if kind in ("scanned_pdf", "image") and not shutil.which("tesseract"):
+        try:
+            import tesserocr  # noqa: F401
+        except ImportError:
+            return "tesseract not installed"
+    return None
+
+def parse_scenarios(spec: str) -> List[Dict[str, Any]]:
+    scenarios = []
+    for item in spec.split(","):
+        kind, _, pages = item.strip().partition(":")
+        scenarios.append({"kind": kind, "pages": int(pages or 1), "name": f"{kind}:{int(pages or 1)}p"})
+    return scenarios
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Prints per-scenario deltas against a baseline run and returns the regressed scenario names."""
+    base = {s["name"]: s for s in baseline.get("scenarios", []) if "wall_s" in s}
+    regressions = []
+    print(f"\nComparison with {baseline.get('meta', {}).get('revision') or 'baseline'} (threshold {threshold:.0%}):")
+    for scenario in current["scenarios"]:
+        old = base.get(scenario["name"])
+        if old is None or "wall_s" not in scenario:
+            continue
+        # Compare per-file time so runs with a different --files count still line up
+        new_per_file = scenario["wall_s"] / scenario["files"]
+        old_per_file = old["wall_s"] / old["files"]
+        change = (new_per_file - old_per_file) / old_per_file if old_per_file else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(scenario["name"])
+        print(f"  {scenario['name']:<16} {old_per_file * 1000:9.1f} ms/file -> {new_per_file * 1000:9.1f} ms/file ({change:+.1%}){flag}")
+        for stage, seconds in scenario["stages_s"].items():
+            before = old.get("stages_s", {}).get(stage, 0.0)
+            after = seconds
+            if stage != "startup":  # paid once per run, not per file
+                before, after = before / old["files"], after / scenario["files"]
+            if before and abs(after - before) / before > threshold and max(before, after) > 0.001:
+                unit = "ms" if stage == "startup" else "ms/file"
+                print(f"      {stage:<14} {before * 1000:9.1f} -> {after * 1000:9.1f} {unit}")
+    return regressions
+
+def print_summary(run: Dict[str, Any]):
+    print(f"\n{'scenario':<16} {'files':>5} {'pages':>5} {'files/s':>9} {'pages/s':>9} {'p95 s':>8} {'rss MB':>7}  top stages")
+    for s in run["scenarios"]:
+        if "skipped" in s:
+            print(f"{s['name']:<16} skipped: {s['skipped']}")
+            continue
+        top = sorted(s["stages_s"].items(), key=lambda kv: kv[1], reverse=True)[:3]
+        stages = ", ".join(f"{k}={v:.3f}s" for k, v in top if v > 0)
+        print(f"{s['name']:<16} {s['files']:>5} {s['pages']:>5} {s['files_per_s']:>9.2f} {s['pages_per_s']:>9.2f} "
+              f"{s['latency_p95_s']:>8.3f} {str(s['peak_rss_mb']):>7}  {stages}")
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline on synthetic invoices")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS, help=f"Comma-separated kind:pages list (default: {DEFAULT_SCENARIOS})")
+    parser.add_argument("--files", type=int, default=5, help="Files per scenario (default: 5)")
+    parser.add_argument("--llm", default="mock", choices=["mock", "stub"], help="MockLLM in-process or the local stub server over HTTP (default: mock)")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Stub server response latency in seconds")
+    parser.add_argument("--ocr-workers", type=int, default=1)
+    parser.add_argument("--ocr-backend", default="auto", choices=["auto", "tesserocr", "pytesseract"])
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--preprocess", default="none", help="Image cleanup before OCR, as for src.main --preprocess (default: none)")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report peak Python heap (slows allocation-heavy stages)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Results JSON path (default: benchmarks/results/bench-<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="Baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Per-file slowdown that counts as a regression (default: 0.10)")
+    parser.add_argument("--keep-corpus", action="store_true", help="Keep the generated files and outputs")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline output")
+    args = parser.parse_args(argv)
+
+    server = None
+    base_url = None
+    if args.llm == "stub":
+        from stub_llm_server import start_stub_server
+        server = start_stub_server(port=0, latency=args.stub_latency)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    workdir = tempfile.mkdtemp(prefix="apir-bench-")
+    run = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "scenarios": [],
+    }
+    # spawn, not fork: each scenario starts from a clean interpreter with its own peak RSS
+    context = multiprocessing.get_context("spawn")
+    try:
+        for scenario in parse_scenarios(args.scenarios):
+            reason = missing_tools(scenario["kind"])
+            if reason:
+                run["scenarios"].append({"name": scenario["name"], "kind": scenario["kind"], "skipped": reason})
+                continue
+            scenario_dir = os.path.join(workdir, scenario["name"].replace(":", "_"))
+            paths, total_pages = build_corpus(scenario_dir, scenario["kind"], scenario["pages"], args.files, args.seed)
+            scenario.update({
+                "paths": paths,
+                "total_pages": total_pages,
+                "workdir": scenario_dir,
+                "llm": args.llm,
+                "base_url": base_url,
+                "ocr_workers": args.ocr_workers,
+                "ocr_backend": args.ocr_backend,
+                "dpi": args.dpi,
+                "preprocess": args.preprocess,
+                "tracemalloc": args.tracemalloc,
+                "verbose": args.verbose,
+            })
+            print(f"Running {scenario['name']} ({len(paths)} files, {total_pages} pages)...")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                run["scenarios"].append(executor.submit(run_scenario, scenario).result())
+    finally:
+        if server is not None:
+            server.shutdown()
+        if args.keep_corpus:
+            print(f"Corpus kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_summary(run)
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(run, json.load(f), args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
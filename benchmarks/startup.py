@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.run_benchmarks import RESULTS_DIR, git_revision
+
+# Cold-start benchmark: every sample is a fresh interpreter, so nothing is already imported, e.g.:
+#   python -m benchmarks.startup --runs 5
+#   python -m benchmarks.startup --importtime 15
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child. Times are measured from just before the first project import,
+# so interpreter startup (the same for every revision) is reported separately as "process".
+PROBE = r"""
+import sys, json, time
+started = time.perf_counter()
+mode = sys.argv[1]
+out = {}
+if mode == "cli":
+    import src.main
+    out["import_s"] = time.perf_counter() - started
+else:
+    import app
+    out["import_s"] = time.perf_counter() - started
+    client = app.app.test_client()
+    client.get("/health")
+    out["first_health_s"] = time.perf_counter() - started
+    if mode == "app_warm":
+        loader = app.app.extensions["apir"]["pipeline"]
+        while loader.state in ("cold", "warming_up"):
+            time.sleep(0.01)
+        out["ready_s"] = time.perf_counter() - started
+        out["warm_up"] = loader.state
+print(json.dumps(out))
+"""
+
+SCENARIOS = {
+    "cli": "import src.main",
+    "app": "import app + first /health, PIPELINE_WARMUP=false",
+    "app_warm": "import app + first /health + background warm-up finished",
+}
+
+def run_probe(mode: str, env: Dict[str, str]) -> Dict[str, float]:
+    started = time.perf_counter()
+    output = subprocess.check_output([sys.executable, "-c", PROBE, mode], cwd=ROOT, env=env, text=True)
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_s"] = time.perf_counter() - started
+    return result
+
+def import_profile(module: str, env: Dict[str, str], top: int) -> List[Dict[str, Any]]:
+    """Slowest modules by cumulative import time, from `python -X importtime`."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append({"module": name.strip(), "cumulative_ms": round(int(cumulative) / 1000, 1)})
+    return sorted(rows, key=lambda r: r["cumulative_ms"], reverse=True)[:top]
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure import and cold-start time of the CLI and the API server")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per scenario; medians are reported (default: 5)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="Also list the N slowest imports of app and src.main")
+    parser.add_argument("--output", default=None, help="Results JSON path (default: benchmarks/results/startup-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="apir-startup-")
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "startup-benchmark")  # clients are built, never called
+    env.update({
+        "EXTRACTION_CACHE_PATH": os.path.join(workdir, "cache.sqlite3"),
+        "VENDOR_TEMPLATES_PATH": os.path.join(workdir, "templates.json"),
+        "LOG_LEVEL": "WARNING",
+    })
+
+    run = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "scenarios": [],
+    }
+    print(f"\n{'scenario':<10} {'import ms':>10} {'/health ms':>11} {'ready ms':>9} {'process ms':>11}  description")
+    for mode in [m.strip() for m in args.scenarios.split(",") if m.strip()]:
+        if mode not in SCENARIOS:
+            parser.error(f"unknown scenario {mode!r}")
+        mode_env = dict(env, PIPELINE_WARMUP="true" if mode == "app_warm" else "false")
+        samples = [run_probe(mode, mode_env) for _ in range(max(1, args.runs))]
+        medians = {
+            key: round(statistics.median(s[key] for s in samples) * 1000, 1)
+            for key in ("import_s", "first_health_s", "ready_s", "process_s") if key in samples[0]
+        }
+        warm_up = {s.get("warm_up") for s in samples} - {None}
+        run["scenarios"].append({"name": mode, "runs": len(samples), "median_ms": medians, "warm_up": sorted(warm_up)})
+        cells = [f"{medians[k]:.1f}" if k in medians else "-" for k in ("import_s", "first_health_s", "ready_s", "process_s")]
+        note = f" (warm-up {', '.join(sorted(warm_up))})" if warm_up - {"ready"} else ""
+        print(f"{mode:<10} {cells[0]:>10} {cells[1]:>11} {cells[2]:>9} {cells[3]:>11}  {SCENARIOS[mode]}{note}")
+
+    if args.importtime:
+        run["imports"] = {}
+        for module in ("app", "src.main"):
+            rows = import_profile(module, dict(env, PIPELINE_WARMUP="false"), args.importtime)
+            run["imports"][module] = rows
+            print(f"\nSlowest imports under {module}:")
+            for row in rows:
+                print(f"  {row['cumulative_ms']:9.1f} ms  {row['module']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"startup-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nSaved results to {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3 @@
+# test_api.py and src/test_api.py are manual scripts against a running server and the
+# OpenAI API (they need `requests` and real credentials), not part of the test suite.
+collect_ignore = ["test_api.py", "src/test_api.py"]
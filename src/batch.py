@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import logging
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from src.cache import ExtractionCache
+from src.vendor_templates import VendorTemplateStore
+from src.dedup import REUSE, DuplicateIndex
+from src.exporters import ResultExporter
+
+logger = logging.getLogger(__name__)
+
+class CheckpointJournal:
+    """Append-only JSONL record of finished files, so a crashed batch can resume.
+
+    Each line is {"file", "sha256", "results", "elapsed", "finished_at"}. A file counts as
+    done only if both its path and content hash match, so edited files are reprocessed.
+    Only {file: sha256} stays in memory for the life of the journal; the results of a
+    resumed run are held until take_latest_records() hands them over once.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.records: List[Dict[str, Any]] = []
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if resume and os.path.exists(path):
+            self.records = self._load()
+        elif os.path.exists(path):
+            os.remove(path)  # fresh run: don't mix in a previous batch
+        self._done = {r["file"]: r["sha256"] for r in self.records}
+
+    def _load(self) -> List[Dict[str, Any]]:
+        records = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A crash mid-write leaves a truncated last line; everything before it is intact
+                    logger.warning("Skipping unreadable checkpoint line %d in %s", line_no, self.path)
+        return records
+
+    def is_done(self, file_path: str) -> bool:
+        # Only hash files the journal knows about; unseen paths are never done
+        if file_path not in self._done:
+            return False
+        return self._done[file_path] == ExtractionCache.hash_file(file_path)
+
+    def append(self, file_path: str, results: List[Dict[str, Any]], elapsed: float):
+        record = {
+            "file": file_path,
+            "sha256": ExtractionCache.hash_file(file_path),
+            "results": results,
+            "elapsed": round(elapsed, 3),
+            "finished_at": time.time(),
+        }
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        # Results are on disk; keeping them here too would grow without bound under --watch
+        self._done[file_path] = record["sha256"]
+
+    def take_latest_records(self) -> List[Dict[str, Any]]:
+        """The records loaded on resume, one per file (the latest run of a reprocessed file).
+
+        Called once to replay them into the outputs; they are released afterwards.
+        """
+        latest = {}
+        for record in self.records:
+            latest[record["file"]] = record
+        self.records = []
+        return list(latest.values())
+
+class ProgressReporter:
+    """Prints files done, throughput and ETA after each completed file."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.started = time.time()
+
+    def update(self, file_path: str):
+        self.done += 1
+        elapsed = time.time() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else 0.0
+        print(f"[{self.done}/{self.total}] {os.path.basename(file_path)} | "
+              f"{rate * 60:.1f} files/min | elapsed {self._fmt(elapsed)} | ETA {self._fmt(eta)}")
+
+    def summary(self) -> str:
+        elapsed = time.time() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        return f"Processed {self.done} files in {self._fmt(elapsed)} ({rate * 60:.1f} files/min)"
+
+    @staticmethod
+    def _fmt(seconds: float) -> str:
+        seconds = int(seconds)
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+# Each pool process builds its own Pipeline once (OCR engine, LLM client, cache connection)
+_worker_pipeline = None
+
+def _init_worker(pipeline_kwargs: Dict[str, Any]):
+    global _worker_pipeline
+    from src.pipeline import Pipeline
+    kwargs = dict(pipeline_kwargs)
+    cache_path = kwargs.pop("cache_path", None)
+    templates_path = kwargs.pop("templates_path", None)
+    template_confidence = kwargs.pop("template_confidence", 0.9)
+    duplicates_path = kwargs.pop("duplicates_path", None)
+    duplicate_mode = kwargs.pop("duplicate_mode", REUSE)
+    duplicate_threshold = kwargs.pop("duplicate_threshold", 0.85)
+    # Each process learns into its own copy and rewrites the file; the last writer wins
+    templates = VendorTemplateStore(templates_path, min_confidence=template_confidence) if templates_path else None
+    if templates is not None:
+        # Pool processes exit without running atexit hooks, so flush pending templates this way
+        multiprocessing.util.Finalize(templates, templates.close, exitpriority=10)
+    _worker_pipeline = Pipeline(
+        cache=ExtractionCache(cache_path) if cache_path else None,
+        templates=templates,
+        # SQLite serializes writers, so every process shares one duplicate index
+        duplicates=DuplicateIndex(duplicates_path, threshold=duplicate_threshold, mode=duplicate_mode) if duplicates_path else None,
+        **kwargs
+    )
+
+def _process_in_worker(file_path: str) -> Tuple[str, List[Dict[str, Any]], float]:
+    started = time.time()
+    try:
+        results = _worker_pipeline.process_file(file_path)
+    except Exception as e:
+        logger.error("Error processing %s: %s", file_path, e)
+        results = [{"error": str(e), "file": file_path}]
+    return file_path, results, time.time() - started
+
+def run_parallel(files: Iterable[str], pipeline_kwargs: Dict[str, Any], workers: int,
+                 journal: CheckpointJournal, progress: Optional[ProgressReporter] = None,
+                 exporter: Optional[ResultExporter] = None):
+    """Processes files across `workers` processes, journaling (and exporting) each result as soon as it lands."""
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(pipeline_kwargs,)
+    ) as executor:
+        futures = [executor.submit(_process_in_worker, file_path) for file_path in files]
+        for future in as_completed(futures):
+            file_path, results, elapsed = future.result()
+            journal.append(file_path, results, elapsed)
+            if exporter is not None:
+                exporter.write(file_path, results)
+            if progress is not None:
+                progress.update(file_path)
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional
+from src.metrics import CACHE_LOOKUPS_TOTAL
+
+# Cache layers. OCR text is reusable across LLM providers but keyed by the OCR settings that
+# produced it; results are keyed per provider/model and extraction settings.
+TEXT_LAYER = "text"
+RESULT_LAYER = "result"
+
+# Eviction is a table scan, so only run it every N writes rather than on every put.
+EVICT_EVERY_N_PUTS = 50
+
+class ExtractionCache:
+    """Persistent, content-addressed cache of extracted text and validated invoice results.
+
+    Entries are keyed by the SHA-256 of the uploaded bytes, so the same file re-uploaded
+    under any name is a hit. Stored in a local SQLite database and evicted by age and
+    total size (least recently used first).
+    """
+
+    def __init__(self, db_path: str = "cache/extraction_cache.sqlite3",
+                 max_bytes: Optional[int] = None, max_age_seconds: Optional[float] = None):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._stats = {layer: {"hits": 0, "misses": 0} for layer in (TEXT_LAYER, RESULT_LAYER)}
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # One shared connection guarded by a lock; Flask serves requests from several threads.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    layer TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (layer, key)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed_at)")
+            self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _get(self, layer: str, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM entries WHERE layer = ? AND key = ?", (layer, key)
+            ).fetchone()
+            if row and self.max_age_seconds and now - row[1] > self.max_age_seconds:
+                self._conn.execute("DELETE FROM entries WHERE layer = ? AND key = ?", (layer, key))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self._stats[layer]["misses"] += 1
+                CACHE_LOOKUPS_TOTAL.inc(layer=layer, result="miss")
+                return None
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE layer = ? AND key = ?", (now, layer, key)
+            )
+            self._conn.commit()
+            self._stats[layer]["hits"] += 1
+            CACHE_LOOKUPS_TOTAL.inc(layer=layer, result="hit")
+            return row[0]
+
+    def _put(self, layer: str, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (layer, key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (layer, key, value, len(value.encode("utf-8")), now, now)
+            )
+            self._conn.commit()
+            self._puts_since_evict += 1
+            due = self._puts_since_evict >= EVICT_EVERY_N_PUTS
+        if due:
+            self.evict()
+
+    def get_text(self, content_hash: str, settings: str = "") -> Optional[str]:
+        """Returns cached text for this file as extracted under `settings` (see OCREngine.settings_key)."""
+        return self._get(TEXT_LAYER, f"{content_hash}:{settings}" if settings else content_hash)
+
+    def put_text(self, content_hash: str, text: str, settings: str = ""):
+        self._put(TEXT_LAYER, f"{content_hash}:{settings}" if settings else content_hash, text)
+
+    def get_result(self, content_hash: str, namespace: str) -> Optional[List[Dict[str, Any]]]:
+        """Returns cached validated invoices for this file under this provider/model namespace."""
+        value = self._get(RESULT_LAYER, f"{namespace}:{content_hash}")
+        return json.loads(value) if value is not None else None
+
+    def put_result(self, content_hash: str, namespace: str, invoices: List[Dict[str, Any]]):
+        self._put(RESULT_LAYER, f"{namespace}:{content_hash}", json.dumps(invoices, default=str))
+
+    def evict(self):
+        """Drops expired entries, then least recently used ones until the cache fits max_bytes."""
+        with self._lock:
+            self._puts_since_evict = 0
+            if self.max_age_seconds:
+                self._conn.execute(
+                    "DELETE FROM entries WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+                )
+            if self.max_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+                if total > self.max_bytes:
+                    # Walk entries oldest-access first and find the cutoff that frees enough space
+                    excess = total - self.max_bytes
+                    cutoff = None
+                    for accessed_at, size in self._conn.execute(
+                        "SELECT accessed_at, size FROM entries ORDER BY accessed_at"
+                    ):
+                        excess -= size
+                        cutoff = accessed_at
+                        if excess <= 0:
+                            break
+                    if cutoff is not None:
+                        self._conn.execute("DELETE FROM entries WHERE accessed_at <= ?", (cutoff,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process plus current on-disk size per layer."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT layer, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY layer"
+            ).fetchall()
+            stats = {layer: dict(counts) for layer, counts in self._stats.items()}
+        for layer in stats:
+            stats[layer].update({"entries": 0, "bytes": 0})
+        for layer, count, size in rows:
+            stats.setdefault(layer, {"hits": 0, "misses": 0}).update({"entries": count, "bytes": size})
+        for layer_stats in stats.values():
+            lookups = layer_stats["hits"] + layer_stats["misses"]
+            layer_stats["hit_rate"] = round(layer_stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# What to do with a near-duplicate: return the earlier extraction without calling the LLM,
+# or extract it again and only mark the results
+REUSE = "reuse"
+FLAG = "flag"
+
+SHINGLE_CHARS = 5
+NUM_PERM = 128
+# Mersenne prime for the universal hash family; multipliers stay below 2**31 so
+# a * x + b never overflows uint64 for 32-bit shingle hashes
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_CANDIDATES = 50
+# Shingles hashed per step, bounding the (num_perm x shingles) matrix to a few MB on long documents
+SIGNATURE_BLOCK = 4096
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+def shingles(text: str, size: int = SHINGLE_CHARS) -> set:
+    """Character n-grams of text lowercased to letters and digits, so OCR spacing, punctuation
+    and line-break differences between two scans of the same invoice don't matter."""
+    normalized = _NON_WORD.sub(" ", text.lower()).strip()
+    if len(normalized) <= size:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """(bands, rows) with bands * rows == num_perm whose LSH threshold (1/b)^(1/r) is closest
+    below `threshold`, so likely matches become candidates and are then checked exactly."""
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+class DuplicateIndex:
+    """Finds earlier documents that are the same invoice in a different file.
+
+    Two indexes in one SQLite database:
+      - MinHash signatures of shingled, normalized text, banded for LSH. A lookup reads one
+        bucket per band and compares only the candidates found there, so it stays fast as
+        the corpus grows. A rescan, photo or re-export of an invoice still shares most shingles.
+      - (vendor, invoice number, total) keys of validated invoices, which catch repeats whose
+        text differs too much, e.g. a reprint with a different layout.
+
+    A text match needs at least `threshold` estimated Jaccard similarity and its invoice
+    numbers present in the new text. In "reuse" mode one from the same provider/model is
+    returned instead of calling the LLM; otherwise matches are only flagged.
+    """
+
+    def __init__(self, db_path: str = "cache/duplicates.sqlite3", threshold: float = 0.85,
+                 mode: str = REUSE, num_perm: int = NUM_PERM):
+        if mode not in (REUSE, FLAG):
+            raise ValueError(f"Unknown duplicate mode {mode!r}; use {REUSE} or {FLAG}")
+        self.db_path = db_path
+        self.threshold = threshold
+        self.mode = mode
+        self.num_perm = num_perm
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self._permutations = None
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # One shared connection guarded by a lock, as in ExtractionCache
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source TEXT,
+                    content_hash TEXT,
+                    namespace TEXT NOT NULL,
+                    signature BLOB NOT NULL,
+                    invoices TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            # Bucket and key lookups are primary-key searches; WITHOUT ROWID keeps them in one b-tree
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS lsh_buckets (
+                    band INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    document_id INTEGER NOT NULL,
+                    PRIMARY KEY (band, bucket, document_id)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS invoice_keys (
+                    key TEXT NOT NULL,
+                    document_id INTEGER NOT NULL,
+                    PRIMARY KEY (key, document_id)
+                ) WITHOUT ROWID
+            """)
+            self._conn.commit()
+
+    def _hash_params(self) -> Tuple["np.ndarray", "np.ndarray"]:
+        import numpy as np
+        if self._permutations is None:
+            # Fixed seed: stored signatures must stay comparable across runs and processes
+            rng = np.random.RandomState(1)
+            a = rng.randint(1, 1 << 31, size=self.num_perm, dtype=np.uint64)
+            b = rng.randint(0, 1 << 31, size=self.num_perm, dtype=np.uint64)
+            self._permutations = (a, b)
+        return self._permutations
+
+    def signature(self, text: str) -> Optional["np.ndarray"]:
+        """MinHash signature (num_perm uint32 values), or None for text without any shingles."""
+        import numpy as np
+        grams = shingles(text)
+        if not grams:
+            return None
+        hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+        a, b = self._hash_params()
+        signature = np.full(self.num_perm, 0xFFFFFFFF, dtype=np.uint64)
+        for start in range(0, len(hashes), SIGNATURE_BLOCK):
+            # (num_perm, shingles) matrix of permuted hashes; the signature is each row's minimum
+            permuted = (np.outer(a, hashes[start:start + SIGNATURE_BLOCK]) + b[:, None]) % np.uint64(MERSENNE_PRIME)
+            np.minimum(signature, (permuted & np.uint64(0xFFFFFFFF)).min(axis=1), out=signature)
+        return signature.astype(np.uint32)
+
+    def _buckets(self, signature: "np.ndarray") -> List[Tuple[int, int]]:
+        buckets = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            digest = hashlib.blake2b(chunk, digest_size=8).digest()
+            buckets.append((band, int.from_bytes(digest, "big", signed=True)))
+        return buckets
+
+    @staticmethod
+    def invoice_key(invoice: Dict[str, Any]) -> Optional[str]:
+        """Normalized (vendor, invoice number, total) key, or None if any part is missing."""
+        vendor = " ".join(_NON_WORD.sub(" ", (invoice.get("vendor_name") or "").lower()).split())
+        number = _NON_WORD.sub("", (invoice.get("invoice_number") or "").lower())
+        total = invoice.get("total_amount")
+        if not vendor or not number or total is None:
+            return None
+        return f"{vendor}|{number}|{float(total):.2f}"
+
+    def find_similar(self, signature: Optional["np.ndarray"]) -> Optional[Dict[str, Any]]:
+        """Most similar earlier document at or above the threshold, or None."""
+        import numpy as np
+        if signature is None:
+            return None
+        with self._lock:
+            candidates = set()
+            for band, bucket in self._buckets(signature):
+                candidates.update(row[0] for row in self._conn.execute(
+                    "SELECT document_id FROM lsh_buckets WHERE band = ? AND bucket = ?"
+                    " ORDER BY document_id DESC LIMIT ?", (band, bucket, MAX_CANDIDATES)
+                ))
+            if not candidates:
+                return None
+            # Newest first: a document reprocessed many times keeps its most recent extraction
+            ids = sorted(candidates, reverse=True)[:MAX_CANDIDATES]
+            rows = self._conn.execute(
+                f"SELECT id, source, content_hash, namespace, signature, invoices FROM documents"
+                f" WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+        best = None
+        for doc_id, source, content_hash, namespace, stored, invoices in rows:
+            similarity = float(np.mean(np.frombuffer(stored, dtype=np.uint32) == signature))
+            if similarity >= self.threshold and (best is None or similarity > best["similarity"]):
+                best = {"document_id": doc_id, "source": source, "content_hash": content_hash,
+                        "namespace": namespace, "similarity": round(similarity, 3), "invoices": json.loads(invoices)}
+        return best
+
+    @staticmethod
+    def confirms(match: Dict[str, Any], text: str) -> bool:
+        """True if every invoice number of an earlier match also appears in `text`.
+
+        Two different invoices from one vendor share most of their text, so similarity
+        alone isn't enough to reuse an extraction; the identifying number must match too.
+        """
+        haystack = _NON_WORD.sub("", text.lower())
+        numbers = [_NON_WORD.sub("", (inv.get("invoice_number") or "").lower()) for inv in match["invoices"]]
+        return bool(numbers) and all(number and number in haystack for number in numbers)
+
+    def find_key(self, invoice: Dict[str, Any], exclude: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Earlier document with an invoice of the same vendor, number and total, or None."""
+        key = self.invoice_key(invoice)
+        if key is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT d.id, d.source, d.content_hash FROM invoice_keys k JOIN documents d ON d.id = k.document_id"
+                " WHERE k.key = ? AND d.id != ? ORDER BY d.id DESC LIMIT 1", (key, exclude or -1)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"document_id": row[0], "source": row[1], "content_hash": row[2], "key": key}
+
+    def add(self, signature: Optional["np.ndarray"], invoices: Iterable[Dict[str, Any]], namespace: str,
+            source: Optional[str] = None, content_hash: Optional[str] = None) -> Optional[int]:
+        """Indexes a document's validated invoices. Returns its ID (None if there is nothing to index)."""
+        invoices = [inv for inv in invoices if "error" not in inv]
+        if signature is None or not invoices:
+            return None
+        clean = [{k: v for k, v in inv.items() if k != "duplicate_of"} for inv in invoices]
+        with self._lock:
+            doc_id = self._conn.execute(
+                "INSERT INTO documents (source, content_hash, namespace, signature, invoices, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (source, content_hash, namespace, signature.tobytes(), json.dumps(clean, default=str), time.time())
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO lsh_buckets (band, bucket, document_id) VALUES (?, ?, ?)",
+                [(band, bucket, doc_id) for band, bucket in self._buckets(signature)]
+            )
+            keys = {key for key in map(self.invoice_key, clean) if key}
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO invoice_keys (key, document_id) VALUES (?, ?)", [(key, doc_id) for key in keys]
+            )
+            self._conn.commit()
+        return doc_id
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        return {"documents": documents, "threshold": self.threshold, "mode": self.mode,
+                "bands": self.bands, "rows_per_band": self.rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,250 @@
+import os
+import csv
+import json
+import typing
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Tuple
+from src.schema import InvoiceData, LineItem
+
+# Streaming result writers. Each file's invoices are written as soon as it finishes, so
+# memory stays bounded by one file (or one Parquet row group) instead of the whole batch.
+
+def _column_type(annotation: Any) -> str:
+    """Maps a pydantic field annotation to a column type: "float64" or "string"."""
+    args = [a for a in typing.get_args(annotation) if a is not type(None)]
+    base = args[0] if args else annotation
+    return "float64" if base in (float, int) else "string"
+
+def _build_schema() -> List[Tuple[str, str]]:
+    # One row per line item, repeating the invoice header, like Pipeline.save_to_csv
+    columns = [("source_file", "string")]
+    columns += [(name, _column_type(field.annotation))
+                for name, field in InvoiceData.model_fields.items() if name != "line_items"]
+    columns += [(name, _column_type(field.annotation)) for name, field in LineItem.model_fields.items()]
+    return columns
+
+EXPORT_SCHEMA = _build_schema()
+EXPORT_COLUMNS = [name for name, _ in EXPORT_SCHEMA]
+_FLOAT_COLUMNS = {name for name, kind in EXPORT_SCHEMA if kind == "float64"}
+
+def _coerce(column: str, value: Any) -> Any:
+    if value is None or value == "":
+        return None
+    if column in _FLOAT_COLUMNS:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return str(value)
+
+def flatten_invoices(source_file: str, invoices: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Yields typed rows for EXPORT_SCHEMA. Error entries are skipped."""
+    for invoice in invoices:
+        if "error" in invoice:
+            continue
+        header = {name: _coerce(name, invoice.get(name)) for name in EXPORT_COLUMNS}
+        header["source_file"] = source_file
+        items = invoice.get("line_items") or [{}]
+        for item in items:
+            row = dict(header)
+            for name in LineItem.model_fields:
+                row[name] = _coerce(name, item.get(name))
+            yield row
+
+class ResultExporter(ABC):
+    """Base class: write() once per finished file, close() at the end of the run."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @abstractmethod
+    def write(self, source_file: str, invoices: List[Dict[str, Any]]):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CsvExporter(ResultExporter):
+    """Appends flattened rows, flushed after every file so a crash loses at most one file."""
+
+    def __init__(self, path: str, append: bool = False):
+        super().__init__(path)
+        write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self._file = open(path, "a" if append else "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=EXPORT_COLUMNS)
+        if write_header:
+            self._writer.writeheader()
+
+    def write(self, source_file: str, invoices: List[Dict[str, Any]]):
+        self._writer.writerows(flatten_invoices(source_file, invoices))
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+class JsonlExporter(ResultExporter):
+    """One JSON object per invoice, errors included, tagged with its source file."""
+
+    def __init__(self, path: str, append: bool = False):
+        super().__init__(path)
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, source_file: str, invoices: List[Dict[str, Any]]):
+        for invoice in invoices:
+            self._file.write(json.dumps(dict(invoice, source_file=source_file), default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+class JsonArrayExporter(ResultExporter):
+    """Streams the same top-level JSON list Pipeline.save_to_json writes, one element at a time."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._file = open(path, "w", encoding="utf-8")
+        self._file.write("[")
+        self._count = 0
+
+    def write(self, source_file: str, invoices: List[Dict[str, Any]]):
+        for invoice in invoices:
+            self._file.write(",\n" if self._count else "\n")
+            self._file.write(json.dumps(invoice, indent=4, default=str))
+            self._count += 1
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.write("\n]\n" if self._count else "]\n")
+            self._file.close()
+
+class _ArrowExporter(ResultExporter):
+    """Buffers rows and writes them as Arrow record batches of `row_group_size` rows."""
+
+    def __init__(self, path: str, row_group_size: int = 10000):
+        super().__init__(path)
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("pyarrow is required for Parquet/Arrow export. Please run `pip install pyarrow`")
+        self._pa = pa
+        self.schema = arrow_schema()
+        self.row_group_size = max(1, row_group_size)
+        self._columns: Dict[str, List[Any]] = {name: [] for name in EXPORT_COLUMNS}
+        self._buffered = 0
+        self._writer = None
+        self._closed = False
+
+    def write(self, source_file: str, invoices: List[Dict[str, Any]]):
+        for row in flatten_invoices(source_file, invoices):
+            for name in EXPORT_COLUMNS:
+                self._columns[name].append(row[name])
+            self._buffered += 1
+            if self._buffered >= self.row_group_size:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffered:
+            return
+        batch = self._pa.RecordBatch.from_pydict(self._columns, schema=self.schema)
+        if self._writer is None:
+            self._writer = self._open_writer()
+        self._write_batch(batch)
+        self._columns = {name: [] for name in EXPORT_COLUMNS}
+        self._buffered = 0
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._flush()
+        if self._writer is None:
+            # No rows at all: still leave a valid, empty file with the schema
+            self._writer = self._open_writer()
+        self._writer.close()
+
+    @abstractmethod
+    def _open_writer(self):
+        pass
+
+    @abstractmethod
+    def _write_batch(self, batch):
+        pass
+
+class ParquetExporter(_ArrowExporter):
+    def _open_writer(self):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.path, self.schema, compression="zstd")
+
+    def _write_batch(self, batch):
+        self._writer.write_batch(batch)
+
+class ArrowExporter(_ArrowExporter):
+    """Arrow IPC file (.arrow / .feather v2), memory-mappable by pyarrow and pandas."""
+
+    def _open_writer(self):
+        return self._pa.ipc.new_file(self.path, self.schema)
+
+    def _write_batch(self, batch):
+        self._writer.write_batch(batch)
+
+def arrow_schema():
+    import pyarrow as pa
+    types = {"float64": pa.float64(), "string": pa.string()}
+    return pa.schema([(name, types[kind]) for name, kind in EXPORT_SCHEMA])
+
+EXPORT_FORMATS = {
+    "csv": ".csv",
+    "json": ".json",
+    "jsonl": ".jsonl",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+
+def get_exporter(fmt: str, path: str, row_group_size: int = 10000) -> ResultExporter:
+    if fmt == "csv":
+        return CsvExporter(path)
+    if fmt == "json":
+        return JsonArrayExporter(path)
+    if fmt == "jsonl":
+        return JsonlExporter(path)
+    if fmt == "parquet":
+        return ParquetExporter(path, row_group_size)
+    if fmt == "arrow":
+        return ArrowExporter(path, row_group_size)
+    raise ValueError(f"Unknown export format: {fmt}. Choose from: {', '.join(EXPORT_FORMATS)}")
+
+class MultiExporter(ResultExporter):
+    """Fans each finished file out to several exporters sharing one output base path."""
+
+    def __init__(self, base_path: str, formats: List[str], row_group_size: int = 10000):
+        self.path = base_path
+        self.exporters: List[ResultExporter] = []
+        try:
+            for fmt in formats:
+                self.exporters.append(get_exporter(fmt, base_path + EXPORT_FORMATS.get(fmt, ""), row_group_size))
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def paths(self) -> List[str]:
+        return [exporter.path for exporter in self.exporters]
+
+    def write(self, source_file: str, invoices: List[Dict[str, Any]]):
+        for exporter in self.exporters:
+            exporter.write(source_file, invoices)
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.close()
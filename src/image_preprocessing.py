@@ -0,0 +1,235 @@
+import time
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from PIL import Image
+from src.metrics import PREPROCESS_SECONDS
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# numpy is imported inside the functions that need it, so merely configuring (or
+# disabling) preprocessing doesn't add its import time to startup.
+
+logger = logging.getLogger(__name__)
+
+# Ordered so each step works on the smallest useful image: one channel instead of three,
+# then fewer pixels, straighten while still anti-aliased, threshold, and trim the margins.
+PREPROCESS_STEPS = ("grayscale", "downscale", "deskew", "binarize", "crop")
+
+# Assumed page size when an image carries no trustworthy DPI (phone photos, screenshots)
+PAGE_SHORT_SIDE_INCHES = 8.5
+MAX_DESKEW_DEGREES = 5.0
+DESKEW_THUMBNAIL_PX = 1000
+DESKEW_MAX_POINTS = 200000
+CROP_PADDING_PX = 12
+# Margins are found on a grid of CROP_BLOCK_PX cells; a cell needs this many dark pixels to
+# count as ink, so isolated scanner speckle doesn't stop the crop but a glyph stroke does.
+CROP_BLOCK_PX = 8
+CROP_MIN_BLOCK_INK = 6
+
+def _bitmap_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+def otsu_threshold(gray: "np.ndarray") -> int:
+    """Otsu's threshold over a uint8 array, fully vectorized over the 256-bin histogram."""
+    import numpy as np
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    if not total:
+        return 128
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    sum_bg = np.cumsum(hist * levels)
+    mean_bg = np.divide(sum_bg, weight_bg, out=np.zeros(256), where=weight_bg > 0)
+    mean_fg = np.divide(sum_bg[-1] - sum_bg, weight_fg, out=np.zeros(256), where=weight_fg > 0)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between))
+
+def estimate_skew(gray: "np.ndarray", max_degrees: float = MAX_DESKEW_DEGREES) -> float:
+    """Skew angle in degrees by projection profile: text lines are straightest where the
+    row histogram of dark pixels is spikiest. Coarse 0.5 deg sweep, then a 0.05 deg refine.
+
+    The result is the rotation (counter-clockwise, as PIL's Image.rotate) that levels the text."""
+    import numpy as np
+    dark = gray <= otsu_threshold(gray)
+    ys, xs = np.nonzero(dark)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > DESKEW_MAX_POINTS:
+        pick = np.random.default_rng(0).choice(len(ys), DESKEW_MAX_POINTS, replace=False)
+        ys, xs = ys[pick], xs[pick]
+    ys = ys.astype(np.float64)
+    xs = xs.astype(np.float64)
+    offset = gray.shape[1]
+
+    def score(angle: float) -> float:
+        theta = np.deg2rad(angle)
+        rows = np.round(ys * np.cos(theta) - xs * np.sin(theta)).astype(np.int64) + offset
+        profile = np.bincount(rows)
+        return float(np.sum(profile.astype(np.float64) ** 2))
+
+    coarse = np.arange(-max_degrees, max_degrees + 1e-9, 0.5)
+    best = max(coarse, key=score)
+    fine = np.arange(best - 0.5, best + 0.5 + 1e-9, 0.05)
+    return round(float(max(fine, key=score)), 2)
+
+class ImagePreprocessor:
+    """Shrinks and cleans page images before OCR.
+
+    `steps` is any ordered subset of PREPROCESS_STEPS. Each call to preprocess() returns
+    the processed image and a per-step report of time and bitmap size; totals across
+    calls are kept for stats().
+    """
+
+    def __init__(self, steps: Optional[List[str]] = None, target_dpi: int = 300):
+        steps = list(PREPROCESS_STEPS if steps is None else steps)
+        unknown = [s for s in steps if s not in PREPROCESS_STEPS]
+        if unknown:
+            raise ValueError(f"Unknown preprocessing step(s): {', '.join(unknown)}. Choose from: {', '.join(PREPROCESS_STEPS)}")
+        # Always run in the canonical order, whatever order they were listed in
+        self.steps = [s for s in PREPROCESS_STEPS if s in steps]
+        self.target_dpi = target_dpi
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def from_spec(cls, spec: Optional[str], target_dpi: int = 300) -> Optional["ImagePreprocessor"]:
+        """Parses "none", "all" or a comma-separated step list (as used by flags and env vars)."""
+        spec = (spec or "none").strip().lower()
+        if spec in ("", "none", "off"):
+            return None
+        if spec in ("all", "default"):
+            return cls(target_dpi=target_dpi)
+        return cls([s.strip() for s in spec.split(",") if s.strip()], target_dpi)
+
+    def source_dpi(self, image: Image.Image) -> float:
+        """DPI the image was captured at, falling back to a page-width estimate."""
+        dpi = image.info.get("dpi")
+        page_dpi = min(image.size) / PAGE_SHORT_SIDE_INCHES
+        if dpi and float(dpi[0]) > 72:
+            # Trust embedded DPI unless it claims the page is far smaller than a letter sheet
+            return max(float(dpi[0]), page_dpi) if float(dpi[0]) * 4 < page_dpi else float(dpi[0])
+        return page_dpi
+
+    def _target_size(self, image: Image.Image) -> Optional[Tuple[int, int]]:
+        scale = self.target_dpi / self.source_dpi(image)
+        if scale >= 0.95:
+            return None
+        return max(1, int(image.width * scale)), max(1, int(image.height * scale))
+
+    def _draft(self, image: Image.Image) -> bool:
+        """Lets the JPEG decoder do the bulk of the downscale (and grayscale) via DCT scaling.
+
+        Only effective before the pixels are loaded; draft() never goes below the requested size.
+        """
+        if image.format != "JPEG" or "downscale" not in self.steps:
+            return False
+        size = self._target_size(image)
+        return bool(size and image.draft("L" if "grayscale" in self.steps else image.mode, size))
+
+    def _downscale(self, image: Image.Image) -> Image.Image:
+        size = self._target_size(image)
+        if size is None:
+            return image
+        # reduce() box-averages by an integer factor first; bicubic finishes the last <2x
+        return image.resize(size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+
+    def _grayscale(self, image: Image.Image) -> Image.Image:
+        return image if image.mode == "L" else image.convert("L")
+
+    def _deskew(self, image: Image.Image) -> Image.Image:
+        import numpy as np
+        gray = self._grayscale(image)
+        thumb = gray
+        if max(gray.size) > DESKEW_THUMBNAIL_PX:
+            # Skew is scale-invariant, so measure it on a thumbnail
+            thumb = gray.copy()
+            thumb.thumbnail((DESKEW_THUMBNAIL_PX, DESKEW_THUMBNAIL_PX))
+        angle = estimate_skew(np.asarray(thumb))
+        if abs(angle) < 0.2:
+            return image
+        logger.debug("Deskewing by %.2f degrees", angle)
+        fill = 255 if image.mode == "L" else (255,) * len(image.getbands())
+        return image.rotate(angle, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=fill)
+
+    def _binarize(self, image: Image.Image) -> Image.Image:
+        import numpy as np
+        gray = np.asarray(self._grayscale(image))
+        # 0/255 in mode "L" rather than mode "1": every OCR backend accepts it unchanged
+        return Image.fromarray(np.where(gray > otsu_threshold(gray), 255, 0).astype(np.uint8), "L")
+
+    def _crop(self, image: Image.Image) -> Image.Image:
+        import numpy as np
+        gray = np.asarray(self._grayscale(image))
+        dark = gray <= otsu_threshold(gray)
+        b = CROP_BLOCK_PX
+        h, w = (dark.shape[0] // b) * b, (dark.shape[1] // b) * b
+        if not h or not w:
+            return image
+        ink = dark[:h, :w].reshape(h // b, b, w // b, b).sum(axis=(1, 3)) >= CROP_MIN_BLOCK_INK
+        rows = np.flatnonzero(ink.any(axis=1))
+        cols = np.flatnonzero(ink.any(axis=0))
+        if not len(rows) or not len(cols):
+            return image
+        box = (
+            max(0, int(cols[0]) * b - CROP_PADDING_PX),
+            max(0, int(rows[0]) * b - CROP_PADDING_PX),
+            min(image.width, (int(cols[-1]) + 1) * b + CROP_PADDING_PX),
+            min(image.height, (int(rows[-1]) + 1) * b + CROP_PADDING_PX),
+        )
+        if box == (0, 0, image.width, image.height):
+            return image
+        return image.crop(box)
+
+    def preprocess(self, image: Image.Image) -> Tuple[Image.Image, Dict[str, Dict[str, float]]]:
+        """Runs the configured steps. Returns (image, {step: {"ms", "bytes_before", "bytes_after"}})."""
+        report: Dict[str, Dict[str, float]] = {}
+        undecoded = _bitmap_bytes(image)
+        started = time.perf_counter()
+        drafted = None
+        if self._draft(image):
+            # The reduced-size decode is credited to "downscale", which it mostly replaces
+            image.load()
+            drafted = (time.perf_counter() - started, undecoded)
+        for step in self.steps:
+            before = _bitmap_bytes(image)
+            started = time.perf_counter()
+            image = getattr(self, f"_{step}")(image)
+            elapsed = time.perf_counter() - started
+            if step == "downscale" and drafted:
+                elapsed, before = elapsed + drafted[0], drafted[1]
+            report[step] = {"ms": elapsed * 1000, "bytes_before": before, "bytes_after": _bitmap_bytes(image)}
+        self.record(report)
+        return image, report
+
+    def record(self, report: Dict[str, Dict[str, float]]):
+        """Adds one image's report to the running totals and metrics.
+
+        Pool workers send their reports back with the OCR text, so the parent records them here.
+        """
+        with self._lock:
+            for step, values in report.items():
+                PREPROCESS_SECONDS.observe(values["ms"] / 1000, step=step)
+                totals = self._totals.setdefault(step, {"images": 0, "ms": 0.0, "bytes_before": 0, "bytes_after": 0})
+                totals["images"] += 1
+                for key in ("ms", "bytes_before", "bytes_after"):
+                    totals[key] += values[key]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per step: images, total and average ms, and how much the step shrank the bitmap."""
+        with self._lock:
+            totals = {step: dict(values) for step, values in self._totals.items()}
+        stats = {}
+        for step in self.steps:
+            if step not in totals:
+                continue
+            t = totals[step]
+            stats[step] = {
+                "images": int(t["images"]),
+                "total_ms": round(t["ms"], 1),
+                "avg_ms": round(t["ms"] / t["images"], 2),
+                "size_reduction": round(1 - t["bytes_after"] / t["bytes_before"], 4) if t["bytes_before"] else 0.0,
+            }
+        return stats
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Column order of the Apps Script user sheet (see UserResourceManager.createSheet in Code.gs),
+# so exported rows can be written with a single Range.setValues call.
+SHEET_COLUMNS = [
+    "Vendor", "Invoice #", "Date", "Due Date", "Tax", "Total", "Currency",
+    "Item Description", "Qty", "Unit Price", "Amount", "File URL", "Timestamp"
+]
+
+MAX_PAGE_SIZE = 500
+MAX_EXPORT_ROWS = 5000
+
+_FIELDS = ("vendor_name", "invoice_number", "invoice_date", "due_date", "tax_amount", "total_amount", "currency")
+
+def _vendor_key(vendor_name: Optional[str]) -> str:
+    return " ".join((vendor_name or "").lower().split())
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat(timespec="seconds")
+
+def _epoch(value: Any, default: float) -> float:
+    """Seconds since the epoch of an ISO timestamp (as exported from the sheet), or `default`."""
+    try:
+        parsed = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return default
+    return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+class InvoiceStore:
+    """Local SQLite record of every invoice the service has extracted, per user.
+
+    Serves history pages and sheet rows without the client re-reading its whole
+    spreadsheet. Pages are ordered newest first and paginated by keyset (`before` =
+    the last ID of the previous page), so each page costs the same however much
+    history a user has. Lookups by user, vendor, invoice number, invoice date and
+    time are all indexed.
+    """
+
+    def __init__(self, db_path: str = "cache/invoices.sqlite3"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # One shared connection guarded by a lock, as in ExtractionCache
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS invoices (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user TEXT NOT NULL,
+                    vendor_name TEXT,
+                    vendor_key TEXT NOT NULL,
+                    invoice_number TEXT,
+                    invoice_date TEXT,
+                    due_date TEXT,
+                    tax_amount REAL,
+                    total_amount REAL,
+                    currency TEXT,
+                    line_items TEXT NOT NULL,
+                    source_file TEXT,
+                    file_url TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            # Every query is scoped to one user, so each index leads with it. IDs grow with
+            # created_at, and SQLite index entries end in the rowid, so (user) alone serves
+            # newest-first pages in index order without sorting the user's whole history.
+            for name, columns in (
+                ("user", "user"),
+                ("user_vendor", "user, vendor_key"),
+                ("user_number", "user, invoice_number"),
+                ("user_date", "user, invoice_date"),
+            ):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_invoices_{name} ON invoices ({columns})")
+            self._conn.commit()
+
+    @staticmethod
+    def normalize_user(user: Optional[str]) -> str:
+        return (user or "").strip().lower()
+
+    def _row(self, invoice: Dict[str, Any], user: Optional[str], source_file: Optional[str],
+             file_url: Optional[str], created_at: float) -> Tuple[Any, ...]:
+        return (
+            self.normalize_user(user),
+            *(invoice.get(field) for field in _FIELDS),
+            _vendor_key(invoice.get("vendor_name")),
+            json.dumps(invoice.get("line_items") or [], default=str),
+            source_file,
+            file_url,
+            created_at,
+        )
+
+    def _insert(self, rows: List[Tuple[Any, ...]]) -> List[int]:
+        """Inserts rows built by _row; the caller holds the lock and commits."""
+        ids = []
+        for row in rows:
+            cursor = self._conn.execute(
+                "INSERT INTO invoices (user, vendor_name, invoice_number, invoice_date, due_date, tax_amount,"
+                " total_amount, currency, vendor_key, line_items, source_file, file_url, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row
+            )
+            ids.append(cursor.lastrowid)
+        return ids
+
+    def add(self, invoices: Iterable[Dict[str, Any]], user: Optional[str] = None,
+            source_file: Optional[str] = None, file_url: Optional[str] = None) -> List[int]:
+        """Records a file's validated invoices (error entries are skipped) and returns their IDs."""
+        now = time.time()
+        rows = [self._row(invoice, user, source_file, file_url, now) for invoice in invoices if "error" not in invoice]
+        if not rows:
+            return []
+        with self._lock:
+            ids = self._insert(rows)
+            self._conn.commit()
+        return ids
+
+    def import_sheet_rows(self, user: Optional[str], rows: List[List[Any]]) -> int:
+        """Backfills an empty history from the user's sheet (SHEET_COLUMNS order, oldest first).
+
+        Consecutive rows that differ only in their line item are one invoice. Does nothing if
+        the user already has history, so a repeated import never duplicates it. Returns the
+        number of invoices imported.
+        """
+        now = time.time()
+        invoices, previous = [], None
+        for row in rows:
+            row = list(row) + [""] * (len(SHEET_COLUMNS) - len(row))
+            header = tuple(row[:7]) + (row[11], row[12])
+            item = {"description": row[7] or "", "quantity": _number(row[8]),
+                    "unit_price": _number(row[9]), "amount": _number(row[10])}
+            if header == previous:
+                invoices[-1][0]["line_items"].append(item)
+                continue
+            previous = header
+            invoice = {
+                "vendor_name": row[0] or None, "invoice_number": str(row[1]) if row[1] != "" else None,
+                "invoice_date": str(row[2])[:10] or None, "due_date": str(row[3])[:10] or None,
+                "tax_amount": _number(row[4]), "total_amount": _number(row[5]), "currency": row[6] or None,
+                "line_items": [item] if any(v not in (None, "") for v in item.values()) else [],
+            }
+            invoices.append((invoice, row[11] or None, _epoch(row[12], now)))
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM invoices WHERE user = ? LIMIT 1", (self.normalize_user(user),)).fetchone():
+                return 0
+            self._insert([self._row(invoice, user, None, file_url, created_at)
+                          for invoice, file_url, created_at in invoices])
+            self._conn.commit()
+        return len(invoices)
+
+    def _where(self, user: Optional[str], vendor: Optional[str] = None, invoice_number: Optional[str] = None,
+               date_from: Optional[str] = None, date_to: Optional[str] = None) -> Tuple[str, List[Any]]:
+        clauses, params = ["user = ?"], [self.normalize_user(user)]
+        if vendor:
+            clauses.append("vendor_key = ?")
+            params.append(_vendor_key(vendor))
+        if invoice_number:
+            clauses.append("invoice_number = ?")
+            params.append(invoice_number.strip())
+        # Invoice dates are stored as YYYY-MM-DD, so string comparison is date order
+        if date_from:
+            clauses.append("invoice_date >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("invoice_date <= ?")
+            params.append(date_to)
+        return " AND ".join(clauses), params
+
+    @staticmethod
+    def _to_invoice(row: sqlite3.Row) -> Dict[str, Any]:
+        invoice = {field: row[field] for field in _FIELDS}
+        invoice.update({
+            "id": row["id"],
+            "line_items": json.loads(row["line_items"]),
+            "source_file": row["source_file"],
+            "file_url": row["file_url"],
+            "timestamp": _iso(row["created_at"]),
+        })
+        return invoice
+
+    def history(self, user: Optional[str], limit: int = 50, before: Optional[int] = None,
+                **filters: Optional[str]) -> Dict[str, Any]:
+        """One page of a user's invoices, newest first. Pass `next_before` back as `before` for the next page."""
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        where, params = self._where(user, **filters)
+        if before is not None:
+            where += " AND id < ?"
+            params.append(before)
+        with self._lock:
+            # One extra row tells whether another page exists without counting them all
+            rows = self._conn.execute(
+                f"SELECT * FROM invoices WHERE {where} ORDER BY id DESC LIMIT ?", (*params, limit + 1)
+            ).fetchall()
+        more = len(rows) > limit
+        invoices = [self._to_invoice(row) for row in rows[:limit]]
+        return {"invoices": invoices, "next_before": invoices[-1]["id"] if more else None}
+
+    def summary(self, user: Optional[str], **filters: Optional[str]) -> Dict[str, Any]:
+        """Invoice count and summed total_amount over all of a user's (filtered) invoices."""
+        where, params = self._where(user, **filters)
+        with self._lock:
+            count, total = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(total_amount), 0) FROM invoices WHERE {where}", params
+            ).fetchone()
+        return {"invoices": count, "total_value": round(total, 2)}
+
+    def sheet_rows(self, user: Optional[str], after: int = 0, limit: int = MAX_EXPORT_ROWS,
+                   **filters: Optional[str]) -> Dict[str, Any]:
+        """Invoices with ID > `after`, oldest first, flattened to SHEET_COLUMNS (one row per line item).
+
+        `last_id` is the ID to pass as `after` next time; a sync only ever fetches what is new.
+        Rows stop at whole invoices, so `limit` may be exceeded by one invoice's line items.
+        """
+        limit = max(1, min(limit, MAX_EXPORT_ROWS))
+        where, params = self._where(user, **filters)
+        rows, last_id, more = [], after, False
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT * FROM invoices WHERE {where} AND id > ? ORDER BY id", (*params, after)
+            )
+            for row in cursor:
+                if len(rows) >= limit:
+                    more = True
+                    break
+                header = [row["vendor_name"] or "", row["invoice_number"] or "", row["invoice_date"] or "",
+                          row["due_date"] or "", row["tax_amount"] or 0, row["total_amount"] or 0,
+                          row["currency"] or "USD"]
+                items = json.loads(row["line_items"]) or [{}]
+                for item in items:
+                    rows.append(header + [item.get("description") or "", item.get("quantity") or 0,
+                                          item.get("unit_price") or 0, item.get("amount") or 0,
+                                          row["file_url"] or "", _iso(row["created_at"])])
+                last_id = row["id"]
+        return {"columns": SHEET_COLUMNS, "rows": rows, "last_id": last_id, "more": more}
+
+    def delete_user(self, user: Optional[str]) -> int:
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM invoices WHERE user = ?", (self.normalize_user(user),)).rowcount
+            self._conn.commit()
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            invoices, users = self._conn.execute("SELECT COUNT(*), COUNT(DISTINCT user) FROM invoices").fetchone()
+        return {"invoices": invoices, "users": users}
@@ -0,0 +1,125 @@
+import os
+import time
+import logging
+import queue
+import secrets
+import threading
+from typing import Any, Callable, Dict, List, Optional, Union
+from src.metrics import ERRORS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+class JobQueue:
+    """Background job runner for uploaded files.
+
+    Files are queued on a bounded queue and processed by a fixed pool of worker threads,
+    so request latency is independent of OCR/LLM time and throughput is set by `workers`.
+    Job state lives in this process; run the API with a single gunicorn worker (and
+    several threads) so every poll sees the same jobs.
+
+    A job's source is either a saved file path or the upload's bytes; `process_fn` is
+    called as process_fn(source, filename, **options). Only path sources are deleted afterwards.
+    """
+
+    def __init__(self, process_fn: Callable[..., list], workers: int = 2, max_queue: int = 100,
+                 result_ttl: float = 3600, cleanup_files: bool = True):
+        self.process_fn = process_fn
+        self.result_ttl = result_ttl
+        self.cleanup_files = cleanup_files
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._cond = threading.Condition()
+        self._workers = []
+        for i in range(max(1, workers)):
+            worker = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, file_path: Union[str, bytes], filename: str,
+               options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Queues an upload (path or bytes). Raises queue.Full when the backlog is at capacity."""
+        self._purge_expired()
+        job = {
+            "job_id": secrets.token_hex(8),
+            "filename": filename,
+            "status": QUEUED,
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        with self._cond:
+            self._jobs[job["job_id"]] = job
+        try:
+            self._queue.put_nowait((job["job_id"], file_path, filename, options or {}))
+        except queue.Full:
+            with self._cond:
+                del self._jobs[job["job_id"]]
+            raise
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_ids: List[str], timeout: float = 0) -> List[Optional[Dict[str, Any]]]:
+        """Long-poll: blocks until every known job in `job_ids` has finished or `timeout` elapses."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                pending = [
+                    job_id for job_id in job_ids
+                    if job_id in self._jobs and self._jobs[job_id]["status"] not in FINISHED_STATES
+                ]
+                remaining = deadline - time.time()
+                if not pending or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [dict(self._jobs[job_id]) if job_id in self._jobs else None for job_id in job_ids]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED)}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+        return {"workers": len(self._workers), "queue_capacity": self._queue.maxsize, "jobs": counts}
+
+    def _run(self):
+        while True:
+            job_id, file_path, filename, options = self._queue.get()
+            self._update(job_id, status=RUNNING, started_at=time.time())
+            try:
+                result = self.process_fn(file_path, filename, **options)
+                self._update(job_id, status=DONE, result=result, finished_at=time.time())
+            except Exception as e:
+                logger.error("Job %s failed: %s", job_id, e)
+                ERRORS_TOTAL.inc(stage="job")
+                self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+            finally:
+                if self.cleanup_files and isinstance(file_path, str) and os.path.exists(file_path):
+                    os.remove(file_path)
+                self._queue.task_done()
+
+    def _update(self, job_id: str, **fields):
+        with self._cond:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+            self._cond.notify_all()
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.result_ttl
+        with self._cond:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job["status"] in FINISHED_STATES and job["finished_at"] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -0,0 +1,104 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from src.llm_client import LLMProvider
+from src.metrics import LLM_BATCH_DOCUMENTS
+from src.text_compactor import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+class BatchingLLM(LLMProvider):
+    """Packs short documents from concurrent callers into shared LLM requests.
+
+    A short document (at most `max_document_tokens`) waits up to `window` seconds for
+    others to arrive; the batch is sent as one request once the window closes, it holds
+    `max_documents`, or it would exceed `max_batch_tokens`. Each caller gets back only
+    the invoices tagged with its document's ID. A document that comes back with nothing
+    (unknown IDs, a failed batch) is retried alone. Longer documents skip batching.
+    A provider that can't pack documents (supports_packing is False) gets every call passed straight through.
+    """
+
+    def __init__(self, inner: LLMProvider, window: float = 0.05, max_documents: int = 8,
+                 max_document_tokens: int = 2000, max_batch_tokens: int = 12000, max_concurrent_batches: int = 4):
+        self.inner = inner
+        self.model = getattr(inner, "model", "")
+        self.window = window
+        self.max_documents = max(1, max_documents)
+        self.max_document_tokens = max_document_tokens
+        self.max_batch_tokens = max_batch_tokens
+        self.packing = getattr(inner, "supports_packing", False)
+        if not self.packing:
+            # Batching would only hold documents back to send them one request at a time
+            logger.warning("%s can't pack documents into one request; LLM batching is disabled.", type(inner).__name__)
+            return
+        self._queue: "queue.Queue[Tuple[str, int, Future]]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent_batches), thread_name_prefix="llm-batch")
+        self._counter = 0
+        self._counter_lock = threading.Lock()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="llm-batch-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def analyze_text(self, text: str) -> list[Dict[str, Any]]:
+        tokens = estimate_tokens(text)
+        if not self.packing or tokens > self.max_document_tokens:
+            return self.inner.analyze_text(text)
+        future: Future = Future()
+        self._queue.put((text, tokens, future))
+        return future.result()
+
+    def stats(self) -> Dict[str, Any]:
+        """Stats of the wrapped provider, e.g. the router's per-backend counters."""
+        return self.inner.stats()
+
+    def _next_id(self) -> str:
+        # Short IDs keep the per-document overhead to a few tokens
+        with self._counter_lock:
+            self._counter += 1
+            return f"d{self._counter}"
+
+    def _dispatch(self):
+        carry: Optional[Tuple[str, int, Future]] = None
+        while True:
+            first = carry or self._queue.get()
+            carry = None
+            batch = [first]
+            tokens = first[1]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_documents:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if tokens + item[1] > self.max_batch_tokens:
+                    carry = item  # starts the next batch
+                    break
+                batch.append(item)
+                tokens += item[1]
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[Tuple[str, int, Future]]):
+        documents = {self._next_id(): item for item in batch}
+        LLM_BATCH_DOCUMENTS.observe(len(documents))
+        try:
+            if len(documents) == 1:
+                (doc_id, (text, _, future)), = documents.items()
+                future.set_result(self.inner.analyze_text(text))
+                return
+            logger.info("Sending %d documents in one LLM request.", len(documents))
+            results = self.inner.analyze_documents({doc_id: item[0] for doc_id, item in documents.items()})
+            for doc_id, (text, _, future) in documents.items():
+                invoices = results.get(doc_id)
+                if not invoices:
+                    logger.info("No invoices mapped back to batched document %s; retrying it alone.", doc_id)
+                    invoices = self.inner.analyze_text(text)
+                future.set_result(invoices)
+        except Exception as e:
+            for _, _, future in documents.values():
+                if not future.done():
+                    future.set_exception(e)
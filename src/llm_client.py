@@ -1,17 +1,41 @@
 import os
 import json
-from typing import Dict, Any, Optional
+import time
+import random
+import logging
+import asyncio
+import functools
+from typing import Dict, Any, Optional, Type
 from abc import ABC, abstractmethod
-from src.schema import InvoiceData
+from pydantic import BaseModel, ValidationError
+from src.schema import DocumentInvoiceBatch, InvoiceData, InvoiceBatch
+from src.metrics import ERRORS_TOTAL, LLM_PARSE_TOTAL, LLM_REQUESTS_TOTAL, LLM_SECONDS, LLM_TOKENS_TOTAL
+
+logger = logging.getLogger(__name__)
 
 class LLMProvider(ABC):
+    # True when analyze_documents packs several documents into one request (see BatchingLLM)
+    supports_packing = False
+
+    def cache_key(self) -> str:
+        """Identifies whose answers these are, so cached results are only reused for the same provider and model."""
+        return f"{type(self).__name__}:{getattr(self, 'model', '')}"
+
     @abstractmethod
     def analyze_text(self, text: str) -> list[Dict[str, Any]]:
         pass
 
+    def analyze_documents(self, documents: Dict[str, str]) -> Dict[str, list[Dict[str, Any]]]:
+        """Analyzes several documents, {document_id: text} -> {document_id: invoices}.
+
+        One request per document here; providers that can pack them into a single request override it.
+        """
+        return {doc_id: self.analyze_text(text) for doc_id, text in documents.items()}
+
 class MockLLM(LLMProvider):
     def analyze_text(self, text: str) -> list[Dict[str, Any]]:
-        print("MOCK LLM: Returning dummy data.")
+        logger.info("MOCK LLM: Returning dummy data.")
+        LLM_REQUESTS_TOTAL.inc(provider="mock", outcome="ok")
         return [{
             "vendor_name": "Mock Vendor Inc.",
             "invoice_number": "MOCK-12345",
@@ -26,22 +50,7 @@ class MockLLM(LLMProvider):
             ]
         }]
 
-class OpenAIClient(LLMProvider):
-    def __init__(self, api_key: Optional[str] = None):
-        try:
-            from openai import OpenAI
-            base_url = os.getenv("OPENAI_BASE_URL")
-            self.model = os.getenv("OPENAI_MODEL", "gpt-4o")
-            
-            self.client = OpenAI(
-                api_key=api_key or os.getenv("OPENAI_API_KEY"),
-                base_url=base_url
-            )
-        except ImportError:
-            raise ImportError("OpenAI package not installed. Please run `pip install openai`")
-            
-    def analyze_text(self, text: str) -> list[Dict[str, Any]]:
-        system_prompt = """
+SYSTEM_PROMPT = """
         You are an expert invoice data extractor. 
         Your task is to extract structured data from the provided invoice text.
         
@@ -64,90 +73,461 @@ class OpenAIClient(LLMProvider):
             ]
         }
         """
-        
+
+# How the model is asked to format its answer, most to least constrained.
+# "json_schema" constrains decoding to InvoiceBatch's schema; "json_object" only guarantees
+# syntactically valid JSON; "text" is free-form and parsed with the regex strategies below.
+RESPONSE_FORMATS = ("json_schema", "json_object", "text")
+
+STRUCTURED_OUTPUT_INSTRUCTION = """
+        Wrap the result in a single JSON object of the form {"invoices": [ ... ]},
+        with one entry per invoice found in the text.
+        """
+
+MULTI_DOCUMENT_INSTRUCTION = """
+        The text contains several separate documents. Each one starts with a line
+        "=== DOCUMENT <id> ===" and ends with "=== END DOCUMENT <id> ===".
+        Treat every document independently, and set "document_id" on each invoice
+        to the id of the document it was found in.
+        """
+
+def pack_documents(documents: Dict[str, str]) -> str:
+    """Joins documents into one prompt body, each fenced by MULTI_DOCUMENT_INSTRUCTION's delimiters."""
+    return "\n".join(
+        f"=== DOCUMENT {doc_id} ===\n{text.strip()}\n=== END DOCUMENT {doc_id} ===" for doc_id, text in documents.items()
+    )
+
+def unpack_documents(documents: Dict[str, str], invoices: list[Dict[str, Any]]) -> Dict[str, list[Dict[str, Any]]]:
+    """Groups a multi-document response by document_id. Invoices with an unknown id are dropped."""
+    results: Dict[str, list[Dict[str, Any]]] = {doc_id: [] for doc_id in documents}
+    unmatched = 0
+    for invoice in invoices:
+        doc_id = str(invoice.pop("document_id", "") or "").strip()
+        if doc_id in results:
+            results[doc_id].append(invoice)
+        else:
+            unmatched += 1
+    if unmatched:
+        logger.warning("%d invoice(s) in a batched response had no known document_id.", unmatched)
+    return results
+
+def record_usage(response: Any):
+    """Adds the token counts a chat completion reports to apir_llm_tokens_total."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    LLM_TOKENS_TOTAL.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+    LLM_TOKENS_TOTAL.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+
+@functools.lru_cache(maxsize=None)
+def _json_schema(schema: Type[BaseModel]) -> Dict[str, Any]:
+    # Building a pydantic JSON schema walks the whole model; do it once per schema class
+    return schema.model_json_schema()
+
+def get_response_format(mode: str, schema: Type[BaseModel] = InvoiceBatch) -> Optional[Dict[str, Any]]:
+    """The `response_format` request parameter for a mode, or None for free-form text."""
+    if mode == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "invoice_batch",
+                "schema": _json_schema(schema),
+                # pydantic's schema has optional fields, which strict mode rejects
+                "strict": False
+            }
+        }
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+def build_messages(text: str, response_format: str = "text", multi_document: bool = False) -> list[Dict[str, str]]:
+    system_prompt = SYSTEM_PROMPT
+    if response_format != "text":
+        system_prompt += STRUCTURED_OUTPUT_INSTRUCTION
+    if multi_document:
+        system_prompt += MULTI_DOCUMENT_INSTRUCTION
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"Invoice Text:\n{text}"}
+    ]
+
+def parse_llm_response(content: str, response_format: str = "text",
+                       schema: Type[BaseModel] = InvoiceBatch) -> list[Dict[str, Any]]:
+    """Parses a model response into invoice dicts.
+
+    Structured responses are validated straight into `schema` (InvoiceBatch, or
+    DocumentInvoiceBatch for packed requests) in one pass; the regex strategies only run
+    when that fails or when the model was asked for free-form text.
+    """
+    if response_format != "text":
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Invoice Text:\n{text}"}
-                ]
+            batch = schema.model_validate_json(content)
+            LLM_PARSE_TOTAL.inc(outcome="structured")
+            logger.debug("Parsed %d invoices from structured output.", len(batch.invoices))
+            return [invoice.model_dump() for invoice in batch.invoices]
+        except ValidationError as e:
+            logger.warning("Structured output did not match schema, falling back to regex: %d errors", e.error_count())
+        # Structured mode was requested but the response didn't validate
+        LLM_PARSE_TOTAL.inc(outcome="regex_fallback")
+    else:
+        LLM_PARSE_TOTAL.inc(outcome="regex")
+    return parse_invoice_json(content)
+
+def is_response_format_unsupported(error: Exception) -> bool:
+    """True for a 400 from a backend that doesn't understand `response_format`."""
+    try:
+        from openai import BadRequestError
+    except ImportError:
+        return False
+    return isinstance(error, BadRequestError) and "response_format" in str(error).lower()
+
+def downgrade_response_format(mode: str) -> str:
+    return RESPONSE_FORMATS[min(RESPONSE_FORMATS.index(mode) + 1, len(RESPONSE_FORMATS) - 1)]
+
+def parse_invoice_json(content: str) -> list[Dict[str, Any]]:
+    """Recovers invoice JSON objects from a free-form LLM response."""
+    # %.500s truncates lazily, so nothing is formatted unless DEBUG is enabled
+    logger.debug("Raw LLM response:\n%.500s...", content)
+
+    # Robust JSON Extraction using Regex
+    # The LLM might return multiple JSON blocks or a list.
+    import re
+    
+    # Look for JSON objects {...}
+    # This regex matches balanced braces approximately (non-nested usually works for simple LLM output)
+    # or simply extract content between ```json ... ``` code blocks
+    
+    json_objects = []
+    
+    # Strategy 1: Extract from Code Blocks (Most reliable for this LLM output)
+    # Match either {...} OR [...] inside code blocks
+    code_block_pattern = r"```json\s*([\[\{][\s\S]*?[\]\}])\s*```"
+    matches = re.findall(code_block_pattern, content)
+    
+    if matches:
+        logger.debug("Found %d JSON code blocks.", len(matches))
+        for match in matches:
+            try:
+                obj = json.loads(match)
+                if isinstance(obj, list):
+                    json_objects.extend(obj)
+                else:
+                    json_objects.append(obj)
+            except json.JSONDecodeError:
+                pass
+    
+    # Strategy 2: If no code blocks, look for raw JSON objects/lists
+    if not json_objects:
+        # Try finding a top-level list [...]
+        list_pattern = r"(\[[\s\S]*\])"
+        list_match = re.search(list_pattern, content)
+        if list_match:
+            try:
+                obj = json.loads(list_match.group(1))
+                if isinstance(obj, list):
+                    json_objects.extend(obj)
+            except json.JSONDecodeError:
+                pass
+        
+        # If still nothing, look for finding individual objects {...}
+        if not json_objects:
+            raw_pattern = r"(\{[\s\S]*?\})"
+            potential_matches = re.findall(raw_pattern, content)
+            for match in potential_matches:
+                try:
+                    obj = json.loads(match)
+                    # Basic validation to filter out non-invoice JSON
+                    if isinstance(obj, dict) and "total_amount" in obj:
+                         json_objects.append(obj)
+                except json.JSONDecodeError:
+                    pass
+
+    if not json_objects:
+        logger.error("No valid JSON objects found in response.")
+        ERRORS_TOTAL.inc(stage="parse")
+        return []
+
+    # NORMALIZATION:
+    # We found multiple invoices. 
+    logger.debug("Recovered %d invoices.", len(json_objects))
+    
+    return json_objects
+
+class OpenAIClient(LLMProvider):
+    """Blocking OpenAI-protocol client. Any argument left as None falls back to the OPENAI_* env vars.
+
+    `name` labels this client's metrics, so several backends behind a router stay distinguishable.
+    `completions` replaces `client.chat.completions` (e.g. a ReplayCompletions); with
+    LLM_RECORD_PATH set, every successful completion is also recorded (see src.llm_replay).
+    """
+
+    supports_packing = True
+
+    def __init__(self, api_key: Optional[str] = None, response_format: Optional[str] = None,
+                 base_url: Optional[str] = None, model: Optional[str] = None,
+                 timeout: Optional[float] = None, max_retries: Optional[int] = None, name: str = "openai",
+                 completions: Any = None):
+        base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.model = model or os.getenv("OPENAI_MODEL", "gpt-4o")
+        self.response_format = response_format or os.getenv("OPENAI_RESPONSE_FORMAT", "json_schema")
+        self.name = name
+
+        if completions is None:
+            try:
+                from openai import OpenAI
+            except ImportError:
+                raise ImportError("OpenAI package not installed. Please run `pip install openai`")
+            options = {}
+            if timeout is not None:
+                options["timeout"] = timeout
+            if max_retries is not None:
+                options["max_retries"] = max_retries
+            self.client = OpenAI(
+                api_key=api_key or os.getenv("OPENAI_API_KEY"),
+                base_url=base_url,
+                **options
             )
-            content = response.choices[0].message.content
-            print(f"DEBUG: RAW LLM RESPONSE:\n{content[:500]}...") # Print first 500 chars
+            completions = self.client.chat.completions
+        from src.llm_replay import recording
+        self.completions = recording(completions)
 
-            # Robust JSON Extraction using Regex
-            # The LLM might return multiple JSON blocks or a list.
-            import re
-            
-            # Look for JSON objects {...}
-            # This regex matches balanced braces approximately (non-nested usually works for simple LLM output)
-            # or simply extract content between ```json ... ``` code blocks
-            
-            json_objects = []
-            
-            # Strategy 1: Extract from Code Blocks (Most reliable for this LLM output)
-            # Match either {...} OR [...] inside code blocks
-            code_block_pattern = r"```json\s*([\[\{][\s\S]*?[\]\}])\s*```"
-            matches = re.findall(code_block_pattern, content)
-            
-            if matches:
-                print(f"DEBUG: Found {len(matches)} JSON code blocks.")
-                for match in matches:
-                    try:
-                        obj = json.loads(match)
-                        if isinstance(obj, list):
-                            json_objects.extend(obj)
-                        else:
-                            json_objects.append(obj)
-                    except json.JSONDecodeError:
-                        pass
+    def _complete(self, text: str, multi_document: bool = False) -> tuple[str, str]:
+        """Returns (content, response_format actually used)."""
+        schema = DocumentInvoiceBatch if multi_document else InvoiceBatch
+        while True:
+            mode = self.response_format
+            request = {"model": self.model, "messages": build_messages(text, mode, multi_document)}
+            response_format = get_response_format(mode, schema)
+            if response_format:
+                request["response_format"] = response_format
+            try:
+                with LLM_SECONDS.time(provider=self.name):
+                    response = self.completions.create(**request)
+                LLM_REQUESTS_TOTAL.inc(provider=self.name, outcome="ok")
+                record_usage(response)
+                return response.choices[0].message.content, mode
+            except Exception as e:
+                if mode == "text" or not is_response_format_unsupported(e):
+                    LLM_REQUESTS_TOTAL.inc(provider=self.name, outcome="error")
+                    raise
+                # Remember the downgrade so later calls don't pay for the rejected request
+                self.response_format = downgrade_response_format(mode)
+                LLM_REQUESTS_TOTAL.inc(provider=self.name, outcome="downgraded")
+                logger.warning("Backend rejected response_format=%s; using %s instead.", mode, self.response_format)
             
-            # Strategy 2: If no code blocks, look for raw JSON objects/lists
-            if not json_objects:
-                # Try finding a top-level list [...]
-                list_pattern = r"(\[[\s\S]*\])"
-                list_match = re.search(list_pattern, content)
-                if list_match:
-                    try:
-                        obj = json.loads(list_match.group(1))
-                        if isinstance(obj, list):
-                            json_objects.extend(obj)
-                    except json.JSONDecodeError:
-                        pass
-                
-                # If still nothing, look for finding individual objects {...}
-                if not json_objects:
-                    raw_pattern = r"(\{[\s\S]*?\})"
-                    potential_matches = re.findall(raw_pattern, content)
-                    for match in potential_matches:
-                        try:
-                            obj = json.loads(match)
-                            # Basic validation to filter out non-invoice JSON
-                            if isinstance(obj, dict) and "total_amount" in obj:
-                                 json_objects.append(obj)
-                        except json.JSONDecodeError:
-                            pass
-
-            if not json_objects:
-                print("Error: No valid JSON objects found in response.")
-                return {}
-
-            # NORMALIZATION:
-            # We found multiple invoices. 
-            print(f"DEBUG: Recovered {len(json_objects)} invoices.")
-            
-            return json_objects
+    def analyze_text(self, text: str) -> list[Dict[str, Any]]:
+        content = None
+        try:
+            content, mode = self._complete(text)
+            return parse_llm_response(content, mode)
+        except Exception as e:
+            logger.error("Error calling LLM: %s", e)
+            ERRORS_TOTAL.inc(stage="llm")
+            if content is not None:
+                logger.debug("Failed Content: %s", content)
+            return []
+
+    def analyze_documents(self, documents: Dict[str, str]) -> Dict[str, list[Dict[str, Any]]]:
+        """Sends every document in one request, sharing a single copy of the system prompt."""
+        if len(documents) == 1:
+            return super().analyze_documents(documents)
+        try:
+            content, mode = self._complete(pack_documents(documents), multi_document=True)
+            invoices = parse_llm_response(content, mode, DocumentInvoiceBatch)
+        except Exception as e:
+            logger.error("Error calling LLM for %d batched documents: %s", len(documents), e)
+            ERRORS_TOTAL.inc(stage="llm")
+            invoices = []
+        return unpack_documents(documents, invoices)
+
+class AsyncLLMProvider(ABC):
+    """asyncio counterpart of LLMProvider, for analyzing many documents concurrently."""
+
+    @abstractmethod
+    async def analyze_text(self, text: str) -> list[Dict[str, Any]]:
+        pass
+
+    async def aclose(self):
+        pass
+
+class AsyncThreadedLLM(AsyncLLMProvider):
+    """asyncio face of a blocking provider whose own limits (router slots, batch windows)
+    already bound its concurrency; each call runs in a worker thread."""
+
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self.model = getattr(provider, "model", "")
+
+    async def analyze_text(self, text: str) -> list[Dict[str, Any]]:
+        return await asyncio.to_thread(self.provider.analyze_text, text)
+
+class AsyncMockLLM(AsyncLLMProvider):
+    def __init__(self):
+        self._mock = MockLLM()
+
+    async def analyze_text(self, text: str) -> list[Dict[str, Any]]:
+        return self._mock.analyze_text(text)
+
+class AsyncOpenAIClient(AsyncLLMProvider):
+    """Non-blocking OpenAI-protocol client.
+
+    One AsyncOpenAI instance (and its pooled HTTP connections) is shared by every call.
+    At most `max_concurrency` requests are in flight at once, each bounded by `timeout`.
+    429s, 5xx responses, timeouts and connection errors are retried with full-jitter
+    exponential backoff (honouring Retry-After when the server sends one).
+    `completions` and LLM_RECORD_PATH work as in OpenAIClient.
+    """
+
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 model: Optional[str] = None, max_concurrency: int = 8, timeout: float = 120.0,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 20.0,
+                 response_format: Optional[str] = None, completions: Any = None, name: str = "openai"):
+        try:
+            import openai  # noqa: F401
+        except ImportError:
+            if completions is None:
+                raise ImportError("OpenAI package not installed. Please run `pip install openai`")
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.model = model or os.getenv("OPENAI_MODEL", "gpt-4o")
+        self.response_format = response_format or os.getenv("OPENAI_RESPONSE_FORMAT", "json_schema")
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.name = name
+        self._client = None
+        # Injected completions (e.g. a replay) are loop-independent and kept as they are
+        self._injected = completions is not None
+        self._completions = completions
+        self._semaphore = None
+        self._loop = None
+
+    def _bind_loop(self):
+        # The HTTP pool and semaphore belong to one event loop; rebuild them if a new
+        # loop is driving us (e.g. successive asyncio.run() calls from sync code).
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if not self._injected:
+                from openai import AsyncOpenAI
+                from src.llm_replay import recording
+                self._client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    max_retries=0  # retries are handled here so they share the concurrency limit
+                )
+                self._completions = recording(self._client.chat.completions, asynchronous=True)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _is_retryable(self, error: Exception) -> bool:
+        from openai import APIConnectionError, APIStatusError, APITimeoutError
+        if isinstance(error, (APITimeoutError, APIConnectionError)):
+            return True
+        return isinstance(error, APIStatusError) and error.status_code in self.RETRYABLE_STATUS
+
+    async def _complete(self, text: str) -> tuple[str, str]:
+        """Returns (content, response_format actually used)."""
+        self._bind_loop()
+        attempt = 0
+        while True:
+            mode = self.response_format
+            request = {"model": self.model, "messages": build_messages(text, mode)}
+            response_format = get_response_format(mode)
+            if response_format:
+                request["response_format"] = response_format
+            try:
+                async with self._semaphore:
+                    # Timed inside the slot, so queueing behind max_concurrency isn't counted as latency
+                    with LLM_SECONDS.time(provider=self.name):
+                        response = await self._completions.create(**request)
+                LLM_REQUESTS_TOTAL.inc(provider=self.name, outcome="ok")
+                record_usage(response)
+                return response.choices[0].message.content, mode
+            except Exception as e:
+                if mode != "text" and is_response_format_unsupported(e):
+                    self.response_format = downgrade_response_format(mode)
+                    LLM_REQUESTS_TOTAL.inc(provider=self.name, outcome="downgraded")
+                    logger.warning("Backend rejected response_format=%s; using %s instead.", mode, self.response_format)
+                    continue
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    LLM_REQUESTS_TOTAL.inc(provider=self.name, outcome="error")
+                    raise
+                delay = self._retry_delay(attempt, e)
+                attempt += 1
+                LLM_REQUESTS_TOTAL.inc(provider=self.name, outcome="retried")
+                logger.warning("LLM request failed (%s); retry %d/%d in %.2fs", e.__class__.__name__, attempt, self.max_retries, delay)
+                # Sleep outside the semaphore so backoff doesn't hold a concurrency slot
+                await asyncio.sleep(delay)
+
+    async def analyze_text(self, text: str) -> list[Dict[str, Any]]:
+        try:
+            content, mode = await self._complete(text)
+            return parse_llm_response(content, mode)
         except Exception as e:
-            print(f"Error calling LLM: {e}")
-            if 'content' in locals():
-                 print(f"Failed Content: {content}")
+            logger.error("Error calling LLM: %s", e)
+            ERRORS_TOTAL.inc(stage="llm")
             return []
 
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self._loop = None
+
 class LLMFactory:
     @staticmethod
     def get_client(provider: str = "mock", api_key: str = None) -> LLMProvider:
         if provider.lower() == "openai":
             return OpenAIClient(api_key)
+        elif provider.lower() == "router":
+            # Several OpenAI-protocol backends (local and hosted), described in LLM_ROUTER_CONFIG
+            from src.llm_router import LLMRouter
+            return LLMRouter.from_config(os.getenv("LLM_ROUTER_CONFIG", "llm_router.json"), api_key)
+        elif provider.lower() == "replay":
+            # Recorded responses from LLM_REPLAY_PATH, served through the real client code.
+            # model="replay" keeps replayed results in their own cache namespace
+            from src.llm_replay import ReplayCompletions, ReplayCorpus
+            return OpenAIClient(api_key, model="replay", name="replay",
+                                completions=ReplayCompletions(ReplayCorpus.from_env()))
         else:
             return MockLLM()
+
+    @staticmethod
+    def get_async_client(provider: str = "mock", api_key: str = None, max_concurrency: int = None) -> AsyncLLMProvider:
+        if provider.lower() == "router":
+            # A standalone router; a Pipeline wraps its own instead so both paths share one.
+            # Concurrency is bounded per backend by the router's config, not max_concurrency
+            return AsyncThreadedLLM(LLMFactory.get_client("router", api_key))
+        if provider.lower() == "replay":
+            from src.llm_replay import AsyncReplayCompletions, ReplayCorpus
+            return AsyncOpenAIClient(
+                api_key,
+                model="replay",
+                name="replay",
+                max_concurrency=max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                completions=AsyncReplayCompletions(ReplayCorpus.from_env())
+            )
+        if provider.lower() == "openai":
+            return AsyncOpenAIClient(
+                api_key,
+                max_concurrency=max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                timeout=float(os.getenv("LLM_TIMEOUT", "120")),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "3"))
+            )
+        else:
+            return AsyncMockLLM()
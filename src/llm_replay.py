@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from src.metrics import LLM_REPLAY_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Record/replay for the chat-completions call, so the real client code (request building,
+# response_format downgrades, parsing, regex recovery, validation) can be load tested offline:
+#   LLM_RECORD_PATH=replay/corpus.jsonl python -m src.main --input invoices/   # against a real backend
+#   LLM_PROVIDER=replay LLM_REPLAY_PATH=replay/corpus.jsonl python app.py
+# Records hold SHA-256 hashes of the prompts, never their text; the response content is kept verbatim.
+
+RECORDED = "recorded"
+SAMPLE = "sample"
+
+def _sha256(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def request_mode(request: Dict[str, Any]) -> str:
+    """json_schema, json_object or text, as in OPENAI_RESPONSE_FORMAT."""
+    return (request.get("response_format") or {}).get("type", "text")
+
+def request_keys(request: Dict[str, Any]) -> Dict[str, str]:
+    """Hashes identifying a request: `key` for the exact prompt and output mode, `shape` for the
+    system prompt and mode alone (single vs. multi-document, structured vs. text).
+
+    The model name is left out, so a corpus recorded against one model replays under any other.
+    """
+    messages = request.get("messages") or []
+    system = [m.get("content") for m in messages if m.get("role") == "system"]
+    mode = request_mode(request)
+    return {"key": _sha256([messages, mode]), "shape": _sha256([system, mode])}
+
+def _usage(response: Any) -> Optional[Dict[str, int]]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    return {"prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0}
+
+class Recorder:
+    """Appends one JSONL record per successful completion. Safe to share between threads and processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(self, request: Dict[str, Any], response: Any, latency: float):
+        messages = request.get("messages") or []
+        record = {
+            **request_keys(request),
+            "mode": request_mode(request),
+            "model": request.get("model"),
+            "prompt_chars": sum(len(m.get("content") or "") for m in messages),
+            "content": response.choices[0].message.content,
+            "latency_s": round(latency, 4),
+            "usage": _usage(response),
+            "recorded_at": time.time(),
+        }
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        # One O_APPEND write per record, so --workers processes sharing the file never interleave lines
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+class RecordingCompletions:
+    """Wraps `client.chat.completions`, recording every request that succeeds."""
+
+    def __init__(self, completions: Any, recorder: Recorder):
+        self.completions = completions
+        self.recorder = recorder
+
+    def create(self, **request):
+        started = time.perf_counter()
+        response = self.completions.create(**request)
+        self.recorder.write(request, response, time.perf_counter() - started)
+        return response
+
+class AsyncRecordingCompletions(RecordingCompletions):
+    async def create(self, **request):
+        started = time.perf_counter()
+        response = await self.completions.create(**request)
+        self.recorder.write(request, response, time.perf_counter() - started)
+        return response
+
+def recording(completions: Any, path: Optional[str] = None, asynchronous: bool = False) -> Any:
+    """`completions` wrapped to record into `path` (default LLM_RECORD_PATH), or unchanged if unset."""
+    path = path if path is not None else os.getenv("LLM_RECORD_PATH")
+    if not path:
+        return completions
+    logger.info("Recording LLM responses to %s", path)
+    cls = AsyncRecordingCompletions if asynchronous else RecordingCompletions
+    return cls(completions, Recorder(path))
+
+class ReplayCorpus:
+    """Recorded completions, looked up by request.
+
+    An exact prompt is answered with its own recording(s), in turn. Any other prompt gets a
+    recording of the same shape (else the same mode, else any), chosen by its hash so a given
+    document always gets the same answer. Each answer is delayed by its recorded latency
+    (`latency="recorded"`) or by a seeded draw from all recorded latencies (`"sample"`), times
+    `latency_scale`; 0 replays as fast as possible.
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], latency: str = RECORDED,
+                 latency_scale: float = 1.0, seed: int = 0):
+        if latency not in (RECORDED, SAMPLE):
+            raise ValueError(f"Unknown replay latency {latency!r}; use {RECORDED} or {SAMPLE}")
+        if not records:
+            raise ValueError("Replay corpus is empty")
+        self.records = records
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self._rng = random.Random(seed)
+        self._latencies = [r.get("latency_s") or 0.0 for r in records]
+        self._by_key: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_shape: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_mode: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            self._by_key.setdefault(record["key"], []).append(record)
+            self._by_shape.setdefault(record["shape"], []).append(record)
+            self._by_mode.setdefault(record.get("mode", "text"), []).append(record)
+        self._turns: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "ReplayCorpus":
+        with open(path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        logger.info("Loaded %d recorded LLM responses from %s", len(records), path)
+        return cls(records, **kwargs)
+
+    @classmethod
+    def from_env(cls) -> "ReplayCorpus":
+        path = os.getenv("LLM_REPLAY_PATH")
+        if not path:
+            raise ValueError("LLM_PROVIDER=replay needs LLM_REPLAY_PATH (a corpus recorded with LLM_RECORD_PATH)")
+        return cls.load(
+            path,
+            latency=os.getenv("LLM_REPLAY_LATENCY", RECORDED),
+            latency_scale=float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1.0"))
+        )
+
+    def lookup(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        keys = request_keys(request)
+        exact = self._by_key.get(keys["key"])
+        if exact:
+            LLM_REPLAY_TOTAL.inc(result="hit")
+            with self._lock:
+                turn = self._turns.get(keys["key"], 0)
+                self._turns[keys["key"]] = turn + 1
+            return exact[turn % len(exact)]
+        LLM_REPLAY_TOTAL.inc(result="miss")
+        pool = self._by_shape.get(keys["shape"]) or self._by_mode.get(request_mode(request)) or self.records
+        return pool[int(keys["key"][:15], 16) % len(pool)]
+
+    def delay(self, record: Dict[str, Any]) -> float:
+        if self.latency == SAMPLE:
+            with self._lock:
+                latency = self._rng.choice(self._latencies)
+        else:
+            latency = record.get("latency_s") or 0.0
+        return latency * self.latency_scale
+
+    @staticmethod
+    def response(record: Dict[str, Any]) -> Any:
+        """A stand-in for the SDK's ChatCompletion with the fields the clients read."""
+        usage = record.get("usage")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=record["content"]))],
+            usage=SimpleNamespace(**usage) if usage else None
+        )
+
+class ReplayCompletions:
+    """Drop-in for `client.chat.completions` that answers from a ReplayCorpus."""
+
+    def __init__(self, corpus: ReplayCorpus):
+        self.corpus = corpus
+
+    def create(self, **request):
+        record = self.corpus.lookup(request)
+        time.sleep(self.corpus.delay(record))
+        return self.corpus.response(record)
+
+class AsyncReplayCompletions(ReplayCompletions):
+    async def create(self, **request):
+        record = self.corpus.lookup(request)
+        await asyncio.sleep(self.corpus.delay(record))
+        return self.corpus.response(record)
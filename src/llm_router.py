@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Union
+from src.llm_client import LLMProvider, OpenAIClient, pack_documents, parse_llm_response, unpack_documents
+from src.schema import DocumentInvoiceBatch
+from src.metrics import ERRORS_TOTAL, LLM_ROUTES_TOTAL
+from src.text_compactor import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.3
+# Hedge after this multiple of the primary's typical latency (when hedge_after is "auto")
+HEDGE_LATENCY_FACTOR = 2.0
+MIN_HEDGE_DELAY = 1.0
+
+class RouterBackend:
+    """One OpenAI-protocol endpoint behind the router.
+
+    Tracks an EWMA of response latency (unknown, and so tried first, until it has answered
+    once) and how many requests are running or waiting for
+    one of its `max_concurrency` slots. After a failure it sits out `cooldown` seconds
+    (doubling per consecutive failure) unless no other backend is left.
+    """
+
+    def __init__(self, name: str, client: OpenAIClient, max_concurrency: int = 4,
+                 min_input_tokens: int = 0, max_input_tokens: Optional[int] = None, cooldown: float = 30.0):
+        self.name = name
+        self.client = client
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_input_tokens = min_input_tokens
+        self.max_input_tokens = max_input_tokens
+        self.cooldown = cooldown
+        self.latency: Optional[float] = None
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting = 0
+        self._failures = 0
+        self._down_until = 0.0
+        self._requests = 0
+        self._errors = 0
+
+    @property
+    def model(self) -> str:
+        return self.client.model
+
+    def accepts(self, tokens: int) -> bool:
+        return tokens >= self.min_input_tokens and (self.max_input_tokens is None or tokens <= self.max_input_tokens)
+
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def expected_seconds(self) -> float:
+        """Estimated time for a new request to finish here: its latency, stretched by the queue ahead of it."""
+        with self._lock:
+            load = self._in_flight + self._waiting
+        if self.latency is None:
+            return float(load)  # untried: optimistic, so every backend gets measured
+        queued_ahead = max(0, load - self.max_concurrency + 1)
+        return self.latency * (1 + queued_ahead / self.max_concurrency)
+
+    def complete(self, text: str, multi_document: bool = False) -> tuple[str, str]:
+        """Sends one request once a slot is free. Returns (content, response_format used)."""
+        with self._lock:
+            self._waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self._waiting -= 1
+            self._in_flight += 1
+            self._requests += 1
+        started = time.perf_counter()
+        try:
+            result = self.client._complete(text, multi_document=multi_document)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+                self._failures += 1
+                self._down_until = time.monotonic() + self.cooldown * 2 ** min(self._failures - 1, 5)
+            raise
+        else:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.latency = elapsed if self.latency is None else EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.latency
+                self._failures = 0
+                self._down_until = 0.0
+            return result
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "model": self.model,
+                "latency_ewma_s": round(self.latency, 3) if self.latency is not None else None,
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "requests": self._requests,
+                "errors": self._errors,
+                "available": time.monotonic() >= self._down_until,
+            }
+
+class LLMRouter(LLMProvider):
+    """Routes each document to the backend expected to answer it soonest.
+
+    Backends are filtered by the document's token count (min/max_input_tokens), ranked by
+    latency and queue depth, and tried in that order. If the first choice hasn't answered
+    within `hedge_after` seconds, the next one is raced against it; if a backend fails
+    or times out, the next one takes over. The first successful response wins.
+    Packed multi-document requests (see BatchingLLM) are routed the same way, by their packed size.
+    """
+
+    supports_packing = True
+
+    def __init__(self, backends: List[RouterBackend], hedge_after: Union[float, str, None] = "auto"):
+        if not backends:
+            raise ValueError("LLM router needs at least one backend")
+        self.backends = backends
+        self.hedge_after = hedge_after
+        self.model = "+".join(b.model for b in backends)
+        workers = sum(b.max_concurrency for b in backends) * 2
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-router")
+
+    @classmethod
+    def from_config(cls, config: Union[str, Dict[str, Any]], api_key: Optional[str] = None) -> "LLMRouter":
+        """Builds a router from a JSON file path or dict (see llm_router.example.json)."""
+        if isinstance(config, str):
+            with open(config, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        backends = []
+        for entry in config.get("backends", []):
+            name = entry.get("name") or entry.get("model")
+            # Keys come from the environment, never the config file; local servers accept any key
+            key = os.getenv(entry["api_key_env"]) if entry.get("api_key_env") else None
+            client = OpenAIClient(
+                api_key=key or api_key or os.getenv("OPENAI_API_KEY") or "none",
+                response_format=entry.get("response_format"),
+                base_url=entry.get("base_url"),
+                model=entry.get("model"),
+                timeout=entry.get("timeout", 120.0),
+                # The router fails over instead of retrying the same backend
+                max_retries=entry.get("max_retries", 0),
+                name=name
+            )
+            backends.append(RouterBackend(
+                name,
+                client,
+                max_concurrency=entry.get("max_concurrency", 4),
+                min_input_tokens=entry.get("min_input_tokens", 0),
+                max_input_tokens=entry.get("max_input_tokens"),
+                cooldown=entry.get("cooldown", 30.0)
+            ))
+        return cls(backends, hedge_after=config.get("hedge_after", "auto"))
+
+    def rank(self, tokens: int) -> List[RouterBackend]:
+        """Backends in the order they should be tried for a document of `tokens` tokens."""
+        eligible = [b for b in self.backends if b.accepts(tokens)]
+        if not eligible:
+            logger.warning("No LLM backend is configured for %d-token documents; trying all of them.", tokens)
+            eligible = list(self.backends)
+        # Backends cooling down after a failure are kept as a last resort
+        return sorted(eligible, key=lambda b: (not b.available(), b.expected_seconds()))
+
+    def _hedge_delay(self, primary: RouterBackend) -> Optional[float]:
+        if self.hedge_after is None:
+            return None
+        if self.hedge_after == "auto":
+            return max(MIN_HEDGE_DELAY, (primary.latency or 0.0) * HEDGE_LATENCY_FACTOR)
+        return float(self.hedge_after)
+
+    def analyze_text(self, text: str) -> list[Dict[str, Any]]:
+        answer = self._route(text)
+        return parse_llm_response(*answer) if answer is not None else []
+
+    def analyze_documents(self, documents: Dict[str, str]) -> Dict[str, list[Dict[str, Any]]]:
+        """Sends every document in one request, routed, hedged and failed over like a single document."""
+        if len(documents) == 1:
+            return super().analyze_documents(documents)
+        answer = self._route(pack_documents(documents), multi_document=True)
+        invoices = parse_llm_response(*answer, DocumentInvoiceBatch) if answer is not None else []
+        return unpack_documents(documents, invoices)
+
+    def _route(self, text: str, multi_document: bool = False) -> Optional[tuple[str, str]]:
+        """(content, response_format used) from the first backend to answer, or None if all failed."""
+        candidates = self.rank(estimate_tokens(text))
+        in_flight: Dict[Future, RouterBackend] = {}
+
+        def launch(event: str):
+            backend = candidates.pop(0)
+            LLM_ROUTES_TOTAL.inc(backend=backend.name, event=event)
+            in_flight[self._executor.submit(backend.complete, text, multi_document)] = backend
+
+        launch("primary")
+        hedge_delay = self._hedge_delay(in_flight[next(iter(in_flight))])
+        hedged = False
+        while in_flight:
+            timeout = hedge_delay if not hedged and candidates else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                logger.info("LLM backend slower than %.1fs; hedging with %s", hedge_delay, candidates[0].name)
+                launch("hedge")
+                continue
+            for future in done:
+                backend = in_flight.pop(future)
+                try:
+                    content, mode = future.result()
+                except Exception as e:
+                    LLM_ROUTES_TOTAL.inc(backend=backend.name, event="failed")
+                    logger.warning("LLM backend %s failed (%s: %s)", backend.name, e.__class__.__name__, e)
+                    if not in_flight and candidates:
+                        launch("failover")
+                    hedged = False  # a failed hedge frees the slot for another
+                    continue
+                # A losing hedge keeps running in the background and still updates its backend's latency
+                LLM_ROUTES_TOTAL.inc(backend=backend.name, event="won")
+                return content, mode
+        logger.error("Error calling LLM: every backend failed")
+        ERRORS_TOTAL.inc(stage="llm")
+        return None
+
+    def cache_key(self) -> str:
+        # Any backend may answer, so results are only reusable for the same set of models
+        return "LLMRouter:" + "+".join(sorted({b.model for b in self.backends}))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {b.name: b.stats() for b in self.backends}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
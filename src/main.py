@@ -1,31 +1,116 @@
 import argparse
+import logging
 import os
+import signal
+import time
 from src.pipeline import Pipeline
+from src.batch import CheckpointJournal, ProgressReporter, run_parallel
+from src.cache import ExtractionCache
+from src.vendor_templates import VendorTemplateStore
+from src.dedup import FLAG, REUSE, DuplicateIndex
+from src.llm_client import LLMFactory
+from src.metrics import REGISTRY
+from src.image_preprocessing import ImagePreprocessor
+from src.watch import SUPPORTED_EXTENSIONS, DirectoryWatcher, watch
+from src.exporters import EXPORT_FORMATS, MultiExporter
 from dotenv import load_dotenv
 
 # Load env file if exists
 load_dotenv()
 
+def _stop_on_sigterm(signum, frame):
+    # Service managers stop daemons with SIGTERM; shut watch mode down like Ctrl-C
+    raise KeyboardInterrupt
+
 def main():
     parser = argparse.ArgumentParser(description="AI-Assisted Invoice Processing System")
     parser.add_argument("--input", default="input_data", help="Path to input file or directory (default: input_data)")
     parser.add_argument("--output", default="output_data/results.csv", help="Path to output CSV (default: output_data/results.csv)")
     parser.add_argument("--mock", action="store_true", help="Use Mock LLM to save costs/testing")
+    parser.add_argument("--llm-provider", default=os.getenv("LLM_PROVIDER", "openai"), choices=["openai", "router", "replay"], help="openai (one endpoint), router (several backends from $LLM_ROUTER_CONFIG) or replay (recorded responses from $LLM_REPLAY_PATH) (default: openai, or $LLM_PROVIDER)")
+    parser.add_argument("--ocr-workers", type=int, default=1, help="Processes used to OCR scanned PDF pages in parallel (0 = one per CPU, default: 1)")
+    parser.add_argument("--ocr-backend", default="auto", choices=["auto", "tesserocr", "pytesseract"], help="OCR engine: warm tesserocr engines or the pytesseract CLI (default: auto)")
+    parser.add_argument("--ocr-lang", default="eng", help="Tesseract language(s), e.g. eng or eng+deu (default: eng)")
+    parser.add_argument("--dpi", type=int, default=200, help="Rasterization DPI for scanned PDFs (default: 200)")
+    parser.add_argument("--grayscale", action="store_true", help="Rasterize scanned PDFs in grayscale (3x less memory)")
+    parser.add_argument("--preprocess", default="none", help="Image cleanup before OCR: none, all, or a comma list of downscale,grayscale,deskew,binarize,crop (default: none)")
+    parser.add_argument("--preprocess-dpi", type=int, default=300, help="Downscale images captured above this DPI before OCR (default: 300)")
+    parser.add_argument("--max-raster-mb", type=float, default=None, help="Cap on decoded page bitmaps held in memory at once, in MB")
+    parser.add_argument("--max-input-tokens", type=int, default=12000, help="Token budget per LLM call; longer documents are split into page-aligned chunks (default: 12000)")
+    parser.add_argument("--llm-concurrency", type=int, default=1, help="Analyze up to N files at once through the async LLM client (default: 1, sequential)")
+    parser.add_argument("--llm-batch-window", type=float, default=0.0, help="Pack short documents that arrive within this many seconds into one LLM request; needs --llm-concurrency > 1 or --watch with --workers > 1 (default: 0, off)")
+    parser.add_argument("--llm-batch-size", type=int, default=8, help="Max documents per batched LLM request (default: 8)")
+    parser.add_argument("--llm-batch-doc-tokens", type=int, default=2000, help="Only documents up to this many tokens are batched (default: 2000)")
+    parser.add_argument("--no-reask", action="store_true", help="Only flag invoices whose line items, totals or dates don't reconcile instead of re-asking the LLM about them")
+    parser.add_argument("--validation-report", action="store_true", help="Add validation: {confidence, flags} to each invoice in the results")
+    parser.add_argument("--cache", default=None, help="Path to a SQLite extraction cache; repeat files skip OCR and the LLM")
+    parser.add_argument("--templates", default=None, help="Path to a vendor template JSON store; known vendor layouts are extracted without the LLM")
+    parser.add_argument("--template-confidence", type=float, default=0.9, help="Minimum template match confidence before the LLM is skipped (default: 0.9)")
+    parser.add_argument("--duplicates", default=None, help="Path to a SQLite near-duplicate index; rescans and re-exports of invoices seen before are detected")
+    parser.add_argument("--duplicate-mode", default=REUSE, choices=[REUSE, FLAG], help="reuse the earlier extraction instead of calling the LLM, or only flag the results (default: reuse)")
+    parser.add_argument("--duplicate-threshold", type=float, default=0.85, help="Minimum text similarity (0-1) for a near-duplicate (default: 0.85)")
+    parser.add_argument("--workers", type=int, default=1, help="Process N files at once in separate processes; threads sharing one pipeline with --watch (default: 1)")
+    parser.add_argument("--checkpoint", default=None, help="JSONL journal of finished files (default: <output>.checkpoint.jsonl)")
+    parser.add_argument("--formats", default="csv,json", help=f"Comma-separated result formats written next to --output as each file finishes: {', '.join(EXPORT_FORMATS)} (default: csv,json)")
+    parser.add_argument("--row-group-size", type=int, default=10000, help="Rows per Parquet row group / Arrow record batch (default: 10000)")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "INFO"), choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Pipeline log verbosity (default: INFO, or $LOG_LEVEL)")
+    parser.add_argument("--resume", action="store_true", help="Skip files already in the checkpoint journal with the same content hash")
+    parser.add_argument("--watch", action="store_true", help="Keep running and process new or changed files in --input as they arrive (implies --resume; Ctrl-C to stop)")
+    parser.add_argument("--watch-interval", type=float, default=1.0, help="Seconds between scans of --input in watch mode (default: 1.0)")
+    parser.add_argument("--watch-settle", type=float, default=2.0, help="A file must be unchanged this many seconds before it is processed (default: 2.0)")
+    parser.add_argument("--watch-queue", type=int, default=100, help="Max files waiting for a worker in watch mode; scanning pauses when full (default: 100)")
     
     args = parser.parse_args()
+    try:
+        ImagePreprocessor.from_spec(args.preprocess)
+    except ValueError as e:
+        parser.error(str(e))
+    logging.basicConfig(level=args.log_level, format="%(message)s")
     
     api_key = os.getenv("OPENAI_API_KEY")
-    if not args.mock and not api_key:
+    # Router backends carry their own keys (or need none, like a local Ollama); replay needs none
+    if not args.mock and not api_key and args.llm_provider not in ("router", "replay"):
         print("WARNING: No OPENAI_API_KEY found. Defaulting to MOCK mode.")
         args.mock = True
 
-    pipeline = Pipeline(use_mock=args.mock, openai_api_key=api_key)
+    # Plain kwargs so --workers processes can each build an identical Pipeline
+    pipeline_kwargs = {
+        "use_mock": args.mock,
+        "llm_provider": args.llm_provider,
+        "openai_api_key": api_key,
+        "ocr_workers": args.ocr_workers,
+        "ocr_backend": args.ocr_backend,
+        "ocr_lang": args.ocr_lang,
+        "ocr_dpi": args.dpi,
+        "ocr_grayscale": args.grayscale,
+        "ocr_preprocess": args.preprocess,
+        "ocr_preprocess_dpi": args.preprocess_dpi,
+        "max_raster_mb": args.max_raster_mb,
+        "max_input_tokens": args.max_input_tokens,
+        "llm_batch_window": args.llm_batch_window,
+        "llm_batch_size": args.llm_batch_size,
+        "llm_batch_doc_tokens": args.llm_batch_doc_tokens,
+        "validation_reask": not args.no_reask,
+        "validation_report": args.validation_report,
+    }
+    pipeline = Pipeline(
+        **pipeline_kwargs,
+        cache=ExtractionCache(args.cache) if args.cache else None,
+        templates=VendorTemplateStore(args.templates, min_confidence=args.template_confidence) if args.templates else None,
+        duplicates=DuplicateIndex(args.duplicates, threshold=args.duplicate_threshold, mode=args.duplicate_mode) if args.duplicates else None,
+        # The router (like the batcher) is shared with the sync path via Pipeline.async_llm
+        async_llm=LLMFactory.get_async_client(
+            provider="mock" if args.mock else args.llm_provider,
+            api_key=api_key,
+            max_concurrency=args.llm_concurrency
+        ) if args.llm_concurrency > 1 and args.llm_batch_window <= 0 and args.llm_provider != "router" else None
+    )
     
     files_to_process = []
     if os.path.isdir(args.input):
         for root, _, files in os.walk(args.input):
             for file in files:
-                if file.lower().endswith(('.pdf', '.png', '.jpg', '.jpeg', '.tiff', '.bmp', '.txt')):
+                if file.lower().endswith(SUPPORTED_EXTENSIONS):
                     files_to_process.append(os.path.join(root, file))
     elif os.path.isfile(args.input):
          files_to_process.append(args.input)
@@ -33,29 +118,108 @@ def main():
         print(f"Input path not found: {args.input}")
         return
 
-    if not files_to_process:
+    if not files_to_process and not args.watch:
         print(f"No valid files found in {args.input}")
         return
 
-    print(f"Found {len(files_to_process)} files to process.")
-    
-    all_results = []
-    for file_path in files_to_process:
+    if not args.watch:
+        print(f"Found {len(files_to_process)} files to process.")
+
+    # Every finished file is journaled immediately, so a crash only loses in-flight work.
+    # Watch mode always resumes: the journal is its record of what was already ingested.
+    checkpoint_path = args.checkpoint or os.path.splitext(args.output)[0] + ".checkpoint.jsonl"
+    journal = CheckpointJournal(checkpoint_path, resume=args.resume or args.watch)
+    if args.resume and not args.watch:
+        pending = [f for f in files_to_process if not journal.is_done(f)]
+        print(f"Resuming from {checkpoint_path}: {len(files_to_process) - len(pending)} already done, {len(pending)} to go.")
+        files_to_process = pending
+
+    # Results are streamed to every output format as each file finishes. Files already
+    # journaled by a resumed run are replayed first, so outputs are always complete.
+    formats = [fmt.strip().lower() for fmt in args.formats.split(",") if fmt.strip()]
+    try:
+        exporter = MultiExporter(os.path.splitext(args.output)[0], formats, args.row_group_size)
+    except (ImportError, ValueError) as e:
+        print(f"Cannot write results: {e}")
+        return
+    for done in journal.take_latest_records():
+        exporter.write(done["file"], done["results"])
+
+    if args.watch:
+        # A changed file is appended again; the journal keeps only its latest results for the next restart
+        def on_result(file_path, results, elapsed):
+            journal.append(file_path, results, elapsed)
+            exporter.write(file_path, results)
+            invoices = sum(1 for r in results if "error" not in r)
+            print(f"{file_path}: {invoices} invoice(s) in {elapsed:.1f}s")
+
+        signal.signal(signal.SIGTERM, _stop_on_sigterm)
         try:
-            results = pipeline.process_file(file_path)
-            all_results.extend(results)
-        except Exception as e:
-            print(f"Error processing {file_path}: {e}")
+            watch(
+                DirectoryWatcher(args.input, journal, settle=args.watch_settle),
+                pipeline.process_file,
+                on_result,
+                workers=args.workers,
+                max_queue=args.watch_queue,
+                interval=args.watch_interval
+            )
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        finally:
+            exporter.close()
+        print(f"Saved results to {', '.join(exporter.paths)}")
+        print("Metrics:\n" + REGISTRY.summary())
+        return
+
+    progress = ProgressReporter(len(files_to_process))
+
+    def record(file_path, results, elapsed=0.0):
+        journal.append(file_path, results, elapsed)
+        exporter.write(file_path, results)
+        progress.update(file_path)
 
     try:
-        # Save JSON first (Robust backup)
-        json_output = args.output.replace('.csv', '.json')
-        pipeline.save_to_json(all_results, json_output)
-
-        # Then try CSV
-        pipeline.save_to_csv(all_results, args.output)
-    except Exception as e:
-        print(f"Fatal Error saving results: {e}")
+        if args.workers > 1:
+            run_parallel(
+                files_to_process,
+                dict(pipeline_kwargs, cache_path=args.cache, templates_path=args.templates,
+                     template_confidence=args.template_confidence, duplicates_path=args.duplicates,
+                     duplicate_mode=args.duplicate_mode, duplicate_threshold=args.duplicate_threshold),
+                args.workers,
+                journal,
+                progress,
+                exporter
+            )
+        elif args.llm_concurrency > 1:
+            pipeline.process_files_concurrently(files_to_process, on_result=record)
+        else:
+            for file_path in files_to_process:
+                started = time.time()
+                try:
+                    results = pipeline.process_file(file_path)
+                except Exception as e:
+                    print(f"Error processing {file_path}: {e}")
+                    results = [{"error": str(e), "file": file_path}]
+                record(file_path, results, time.time() - started)
+    finally:
+        exporter.close()
+
+    print(progress.summary())
+    print(f"Saved results to {', '.join(exporter.paths)}")
+
+    if pipeline.cache is not None:
+        print(f"Cache stats: {pipeline.cache.stats()}")
+    if pipeline.templates is not None and args.workers <= 1:
+        print(f"Template stats: {pipeline.templates.stats()}")
+    if pipeline.duplicates is not None:
+        print(f"Duplicate index: {pipeline.duplicates.stats()}")
+    if pipeline.ocr.preprocessor is not None and args.workers <= 1:
+        print(f"Preprocessing stats: {pipeline.ocr.preprocess_stats()}")
+    if args.llm_provider == "router" and not args.mock and args.workers <= 1:
+        print(f"Router stats: {pipeline.llm.stats()}")
+    if args.workers > 1:
+        print("Metrics: per-file work ran in worker processes; only the parent's metrics are shown.")
+    print("Metrics:\n" + REGISTRY.summary())
 
 if __name__ == "__main__":
     main()
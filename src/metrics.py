@@ -0,0 +1,195 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# In-process counters and histograms with a Prometheus text exposition. Each update is a
+# dict lookup and a few additions under a lock, cheap enough for the per-page hot path.
+# Metrics are per process: OCR worker processes are measured from the parent.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _format_labels(labelnames: Tuple[str, ...], key: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def total(self) -> float:
+        return sum(self.values().values())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._data: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                data = self._data[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            else:
+                data[len(self.buckets)] += 1
+            data[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], List[float]]:
+        with self._lock:
+            return {key: list(data) for key, data in self._data.items()}
+
+    def quantile(self, q: float, data: List[float]) -> float:
+        """Upper bucket bound covering quantile q, the usual histogram approximation."""
+        count = sum(data[:-1])
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, bound in enumerate(self.buckets):
+            seen += data[i]
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, data in sorted(self.snapshot().items()):
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += data[i]
+                le = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            cumulative += data[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {data[-1]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help_text, labelnames, buckets))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Human-readable digest for the end of a CLI run."""
+        lines = []
+        for metric in self._metrics.values():
+            if isinstance(metric, Histogram):
+                for key, data in sorted(metric.snapshot().items()):
+                    count = sum(data[:-1])
+                    label = ",".join(v for v in key if v)
+                    name = f"{metric.name}[{label}]" if label else metric.name
+                    unit = "s" if metric.name.endswith("_seconds") else ""
+                    lines.append(
+                        f"  {name:<44} n={count:<6} avg={data[-1] / count:.3f}{unit} "
+                        f"p50<={metric.quantile(0.5, data):g}{unit} p95<={metric.quantile(0.95, data):g}{unit}"
+                    )
+            else:
+                for key, value in sorted(metric.values().items()):
+                    label = ",".join(v for v in key if v)
+                    name = f"{metric.name}[{label}]" if label else metric.name
+                    lines.append(f"  {name:<44} {value:g}")
+        return "\n".join(lines) if lines else "  (no metrics recorded)"
+
+    def reset(self):
+        for metric in self._metrics.values():
+            metric.reset()
+
+REGISTRY = MetricsRegistry()
+
+OCR_SECONDS = REGISTRY.histogram(
+    "apir_ocr_seconds", "OCR time per page or image (averaged over a window when OCR runs in worker processes)", ("source",))
+RASTERIZE_SECONDS = REGISTRY.histogram("apir_rasterize_seconds", "PDF rasterization time per window of pages")
+NATIVE_EXTRACT_SECONDS = REGISTRY.histogram("apir_native_extract_seconds", "pypdf text-layer extraction time per document")
+LLM_SECONDS = REGISTRY.histogram("apir_llm_seconds", "LLM request latency per call to the backend", ("provider",))
+PREPROCESS_SECONDS = REGISTRY.histogram("apir_preprocess_seconds", "Image preprocessing time per page and step", ("step",))
+VALIDATION_SECONDS = REGISTRY.histogram("apir_validation_seconds", "InvoiceData validation time per document")
+LLM_BATCH_DOCUMENTS = REGISTRY.histogram(
+    "apir_llm_batch_documents", "Documents packed into each batched LLM request", buckets=(1, 2, 4, 8, 16, 32))
+DOCUMENT_SECONDS = REGISTRY.histogram("apir_document_seconds", "End-to-end processing time per document", ("source",))
+
+PAGES_TOTAL = REGISTRY.counter("apir_pages_total", "PDF pages and images processed, by extraction method", ("method",))
+CHARS_EXTRACTED_TOTAL = REGISTRY.counter("apir_chars_extracted_total", "Characters of text extracted before compaction")
+LLM_REQUESTS_TOTAL = REGISTRY.counter("apir_llm_requests_total", "LLM requests by outcome", ("provider", "outcome"))
+LLM_PARSE_TOTAL = REGISTRY.counter(
+    "apir_llm_parse_total", "LLM responses by how they were parsed: structured, regex_fallback or regex", ("outcome",)
+)
+LLM_TOKENS_TOTAL = REGISTRY.counter("apir_llm_tokens_total", "Tokens reported by the LLM backend", ("kind",))
+LLM_ROUTES_TOTAL = REGISTRY.counter(
+    "apir_llm_routes_total", "LLM router requests per backend: primary, hedge, failover, won or failed", ("backend", "event"))
+DUPLICATES_TOTAL = REGISTRY.counter(
+    "apir_duplicates_total", "Documents matching an earlier one, by match type and action taken", ("match", "action")
+)
+VALIDATION_FLAGS_TOTAL = REGISTRY.counter("apir_validation_flags_total", "Invoices failing each consistency check", ("flag",))
+VALIDATION_REASKS_TOTAL = REGISTRY.counter(
+    "apir_validation_reasks_total", "Targeted LLM re-asks of inconsistent invoices, by outcome", ("outcome",)
+)
+LLM_REPLAY_TOTAL = REGISTRY.counter(
+    "apir_llm_replay_total", "Replayed LLM responses: recorded prompt (hit) or a stand-in of the same shape (miss)", ("result",)
+)
+CACHE_LOOKUPS_TOTAL = REGISTRY.counter("apir_cache_lookups_total", "Extraction cache lookups", ("layer", "result"))
+ERRORS_TOTAL = REGISTRY.counter("apir_errors_total", "Errors by pipeline stage", ("stage",))
@@ -0,0 +1,108 @@
+import os
+import queue
+import logging
+import threading
+from abc import ABC, abstractmethod
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+class OCRBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def image_to_string(self, image: Image.Image) -> str:
+        pass
+
+    def close(self):
+        pass
+
+class PytesseractBackend(OCRBackend):
+    """Shells out to the tesseract CLI per image (new process, temp files, language data reload)."""
+    name = "pytesseract"
+
+    def __init__(self, lang: str = "eng"):
+        import pytesseract
+        self._pytesseract = pytesseract
+        self.lang = lang
+
+    def image_to_string(self, image: Image.Image) -> str:
+        return self._pytesseract.image_to_string(image, lang=self.lang)
+
+class TesserocrBackend(OCRBackend):
+    """Keeps warm libtesseract engines alive via tesserocr.
+
+    Language data is loaded once per engine and images are handed over in memory, so
+    there is no per-page process spawn or temp file. Engines are not thread-safe, so a
+    small pool is checked out one image at a time; threads beyond `pool_size` wait.
+    """
+    name = "tesserocr"
+
+    def __init__(self, lang: str = "eng", pool_size: int = 2, tessdata_path: str = None):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.lang = lang
+        self.tessdata_path = tessdata_path or os.getenv("TESSDATA_PREFIX")
+        self.pool_size = max(1, pool_size)
+        self._pool = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # Load one engine up front so a missing language pack fails here, not mid-request
+        self._pool.put(self._new_engine())
+        self._created = 1
+
+    def _new_engine(self):
+        kwargs = {"lang": self.lang}
+        if self.tessdata_path:
+            kwargs["path"] = self.tessdata_path
+        return self._tesserocr.PyTessBaseAPI(**kwargs)
+
+    def _checkout(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                return self._new_engine()
+        return self._pool.get()
+
+    def image_to_string(self, image: Image.Image) -> str:
+        api = self._checkout()
+        try:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()  # drop the image but keep the loaded model
+            self._pool.put(api)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().End()
+            except queue.Empty:
+                break
+        self._created = 0
+
+OCR_BACKENDS = {
+    "tesserocr": TesserocrBackend,
+    "pytesseract": PytesseractBackend,
+}
+
+def get_ocr_backend(name: str = "auto", lang: str = "eng", pool_size: int = 2) -> OCRBackend:
+    """Builds an OCR backend. "auto" prefers warm tesserocr engines and falls back to pytesseract."""
+    name = (name or "auto").lower()
+    if name == "auto":
+        try:
+            return TesserocrBackend(lang=lang, pool_size=pool_size)
+        except ImportError:
+            return PytesseractBackend(lang=lang)
+        except RuntimeError as e:
+            logger.warning("tesserocr unavailable (%s); falling back to pytesseract.", e)
+            return PytesseractBackend(lang=lang)
+    if name == "tesserocr":
+        return TesserocrBackend(lang=lang, pool_size=pool_size)
+    if name == "pytesseract":
+        return PytesseractBackend(lang=lang)
+    raise ValueError(f"Unknown OCR backend: {name}. Choose from: auto, {', '.join(OCR_BACKENDS)}")
@@ -1,67 +1,363 @@
-import pytesseract
-from pdf2image import convert_from_path
 from PIL import Image
+import io
 import os
-from typing import List
+import time
+import logging
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+from src.ocr_backends import OCRBackend, get_ocr_backend
+from src.image_preprocessing import ImagePreprocessor
+from src.metrics import ERRORS_TOTAL, NATIVE_EXTRACT_SECONDS, OCR_SECONDS, PAGES_TOTAL, RASTERIZE_SECONDS
+
+logger = logging.getLogger(__name__)
 
 # NOTE: Ensure Tesseract-OCR is installed on the system and in PATH.
-# If not in PATH, uncomment and set the line below:
-# pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+# If not in PATH, pass tesseract_cmd to OCREngine, e.g. r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+# pytesseract and pdf2image are imported on first use: pytesseract alone costs ~0.5s of
+# startup, and text-layer PDFs and .txt files never need either.
+
+# Rasterization never drops below this DPI when shrinking pages to fit the memory cap;
+# tesseract accuracy falls off sharply under ~100 DPI.
+MIN_OCR_DPI = 100
+# Used when pdfinfo cannot report a page size (US Letter, in points)
+DEFAULT_PAGE_SIZE_PTS = (612.0, 792.0)
+# A page only counts as having a text layer with at least this many letters/digits,
+# so a stray character or page number on a scanned page doesn't suppress OCR.
+MIN_TEXT_LAYER_CHARS = 20
+
+# Documents can be passed as a filesystem path, raw bytes or a binary file-like object
+Source = Union[str, bytes, BinaryIO]
+
+def _read_source(source: Source) -> Union[str, bytes]:
+    """Paths stay paths; file-like objects are read into bytes once."""
+    if isinstance(source, (str, bytes)):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    return source.read()
+
+def _describe(source: Union[str, bytes]) -> str:
+    return source if isinstance(source, str) else f"<{len(source)} bytes in memory>"
+
+# OCR backend (and preprocessor) owned by a pool worker process; lives as long as the process does
+_worker_backend: Optional[OCRBackend] = None
+_worker_preprocessor: Optional[ImagePreprocessor] = None
+
+def _init_ocr_worker(tesseract_cmd: str, backend_name: str, lang: str,
+                     preprocess_steps: Optional[List[str]] = None, preprocess_dpi: int = 300):
+    """Runs once in each pool process: same tesseract binary as the parent, plus a warm backend."""
+    global _worker_backend, _worker_preprocessor
+    import pytesseract
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    _worker_backend = get_ocr_backend(backend_name, lang, pool_size=1)
+    if preprocess_steps:
+        _worker_preprocessor = ImagePreprocessor(preprocess_steps, preprocess_dpi)
+
+def _ocr_page(image: Image.Image) -> Tuple[str, Dict[str, Dict[str, float]]]:
+    """Preprocesses and OCRs a single page in a pool worker. Module-level so it can be pickled.
+
+    Returns (text, preprocessing report) so the parent can account for the worker's time.
+    """
+    report = {}
+    if _worker_preprocessor is not None:
+        image, report = _worker_preprocessor.preprocess(image)
+    return _worker_backend.image_to_string(image), report
 
 class OCREngine:
-    def __init__(self, tesseract_cmd: str = None):
+    def __init__(self, tesseract_cmd: str = None, ocr_workers: int = 1, dpi: int = 200,
+                 grayscale: bool = False, max_raster_mb: Optional[float] = None,
+                 ocr_backend: str = "auto", lang: str = "eng",
+                 preprocess: Optional[str] = None, preprocess_dpi: int = 300):
          if tesseract_cmd:
+             import pytesseract
              pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
-    
-    def extract_text_from_image(self, image_path: str) -> str:
-        """Extracts text from a single image file."""
+         # ocr_workers <= 1 keeps the original sequential loop; 0 means "one per CPU".
+         if ocr_workers == 0:
+             ocr_workers = os.cpu_count() or 1
+         self.ocr_workers = max(1, ocr_workers)
+         self.dpi = dpi
+         self.grayscale = grayscale
+         # Upper bound on decoded page bitmaps held at once. None = one window of ocr_workers pages.
+         self.max_raster_mb = max_raster_mb
+         # "auto" uses warm tesserocr engines when installed, else pytesseract
+         self.ocr_backend = ocr_backend
+         self.lang = lang
+         # Optional downscale/grayscale/deskew/binarize/crop before OCR: "none", "all" or a step list
+         self.preprocessor = ImagePreprocessor.from_spec(preprocess, preprocess_dpi)
+         self._backend: Optional[OCRBackend] = None
+         self._pool: Optional[ProcessPoolExecutor] = None
+         self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> OCRBackend:
+        """In-process OCR backend, created on first use and reused for every later page."""
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = get_ocr_backend(self.ocr_backend, self.lang, pool_size=self.ocr_workers)
+                    logger.info("OCR backend: %s", self._backend.name)
+        return self._backend
+
+    def settings_key(self) -> str:
+        """The settings that change what text is extracted, e.g. to key cached text by."""
+        preprocess = "none"
+        if self.preprocessor is not None:
+            preprocess = f"{'+'.join(self.preprocessor.steps)}@{self.preprocessor.target_dpi}"
+        return (f"dpi={self.dpi},grayscale={int(self.grayscale)},backend={self.ocr_backend},"
+                f"lang={self.lang},preprocess={preprocess}")
+
+    def warm_up(self):
+        """Imports the OCR libraries and starts the in-process backend ahead of the first scan."""
+        import pdf2image  # noqa: F401
+        self.backend
+
+    def close(self):
+        """Shuts down the OCR worker pool and releases warm engines."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+            if self._backend is not None:
+                self._backend.close()
+                self._backend = None
+
+    def extract_text_from_image(self, image_path: Source) -> str:
+        """Extracts text from a single image file (path, bytes or file-like)."""
+        image_path = _read_source(image_path)
         try:
-            image = Image.open(image_path)
-            text = pytesseract.image_to_string(image)
+            image = Image.open(io.BytesIO(image_path) if isinstance(image_path, bytes) else image_path)
+            if self.preprocessor is not None:
+                image, _ = self.preprocessor.preprocess(image)
+            with OCR_SECONDS.time(source="image"):
+                text = self.backend.image_to_string(image)
+            PAGES_TOTAL.inc(method="image")
             return text
         except Exception as e:
-            print(f"Error processing image {image_path}: {e}")
+            logger.error("Error processing image %s: %s", _describe(image_path), e)
+            ERRORS_TOTAL.inc(stage="ocr")
             return ""
 
-    def convert_pdf_to_images(self, pdf_path: str) -> List[Image.Image]:
-        """Converts a PDF to a list of PIL Images."""
+    def convert_pdf_to_images(self, pdf_path: Source) -> List[Image.Image]:
+        """Converts a PDF to a list of PIL Images.
+
+        Holds every page in memory at once; prefer iter_pdf_pages for anything long.
+        """
+        pdf_path = _read_source(pdf_path)
         try:
-            # poppler_path might need to be configured for Windows if not in PATH
-            # e.g., poppler_path=r'C:\Program Files\poppler-xx\bin'
-            images = convert_from_path(pdf_path) 
-            return images
+            return [img for _, window in self.iter_pdf_pages(pdf_path) for img in window]
         except Exception as e:
-            print(f"Error converting PDF {pdf_path}: {e}")
+            logger.error("Error converting PDF %s: %s", _describe(pdf_path), e)
             return []
 
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extracts text from a PDF. Tries native text extraction first, then falls back to OCR."""
-        # Method 1: Native Extraction (pypdf)
+    def _plan_rasterization(self, pdf_path: Union[str, bytes]) -> Tuple[int, int, int]:
+        """Returns (page_count, dpi, pages_per_window) that keep decoded bitmaps under max_raster_mb."""
+        from pdf2image import pdfinfo_from_bytes, pdfinfo_from_path
+        if isinstance(pdf_path, bytes):
+            info = pdfinfo_from_bytes(pdf_path)
+        else:
+            info = pdfinfo_from_path(pdf_path)
+        page_count = int(info.get("Pages", 0))
+
+        width_pts, height_pts = DEFAULT_PAGE_SIZE_PTS
+        size_match = re.match(r"\s*([\d.]+)\s*x\s*([\d.]+)", str(info.get("Page size", "")))
+        if size_match:
+            width_pts, height_pts = float(size_match.group(1)), float(size_match.group(2))
+
+        dpi = self.dpi
+        window = self.ocr_workers
+        if self.max_raster_mb:
+            budget = self.max_raster_mb * 1024 * 1024
+            channels = 1 if self.raster_grayscale else 3
+            page_bytes = (width_pts / 72 * dpi) * (height_pts / 72 * dpi) * channels
+            if page_bytes > budget:
+                # A single page is already over budget: render it at a lower DPI instead
+                dpi = max(MIN_OCR_DPI, int(dpi * (budget / page_bytes) ** 0.5))
+                logger.info("Page bitmap exceeds %sMB at %d DPI; rasterizing at %d DPI.", self.max_raster_mb, self.dpi, dpi)
+                page_bytes = (width_pts / 72 * dpi) * (height_pts / 72 * dpi) * channels
+            window = max(1, min(window, int(budget // page_bytes)))
+
+        return page_count, dpi, window
+
+    def iter_pdf_pages(self, pdf_path: Union[str, bytes], plan: Optional[Tuple[int, int, int]] = None,
+                       pages: Optional[List[int]] = None) -> Iterator[Tuple[int, List[Image.Image]]]:
+        """Yields (first_page_number, images) windows so only a few pages are ever decoded at once.
+
+        `pages` restricts rasterization to those 1-based page numbers; each window is a run of
+        consecutive pages. Callers should close() each image once they are done with it.
+        """
+        # poppler_path might need to be configured for Windows if not in PATH
+        # e.g., poppler_path=r'C:\Program Files\poppler-xx\bin'
+        page_count, dpi, window = plan or self._plan_rasterization(pdf_path)
+        if pages is None:
+            pages = list(range(1, page_count + 1))
+
+        run: List[int] = []
+        for page in sorted(pages) + [None]:
+            if run and (page is None or page != run[-1] + 1 or len(run) == window):
+                from pdf2image import convert_from_bytes, convert_from_path
+                convert = convert_from_bytes if isinstance(pdf_path, bytes) else convert_from_path
+                with RASTERIZE_SECONDS.time():
+                    images = convert(
+                        pdf_path,
+                        dpi=dpi,
+                        first_page=run[0],
+                        last_page=run[-1],
+                        grayscale=self.raster_grayscale
+                    )
+                yield run[0], images
+                run = []
+            if page is not None:
+                run.append(page)
+
+    @property
+    def raster_grayscale(self) -> bool:
+        """Rasterize in grayscale when asked to, or when preprocessing would convert anyway."""
+        return self.grayscale or (self.preprocessor is not None and "grayscale" in self.preprocessor.steps)
+
+    def preprocess_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-step preprocessing time and size reduction so far (empty when preprocessing is off)."""
+        return self.preprocessor.stats() if self.preprocessor is not None else {}
+
+    def _ocr_pool(self, page_count: int) -> Optional[ProcessPoolExecutor]:
+        """The engine's long-lived worker pool, or None when OCR should stay in-process.
+
+        Workers (and their warm OCR engines) survive across documents and requests.
+        """
+        if min(self.ocr_workers, page_count) <= 1:
+            return None
+        with self._lock:
+            if self._pool is None:
+                import pytesseract
+                logger.info("Starting %d OCR worker processes...", self.ocr_workers)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.ocr_workers,
+                    initializer=_init_ocr_worker,
+                    initargs=(pytesseract.pytesseract.tesseract_cmd, self.ocr_backend, self.lang,
+                              self.preprocessor.steps if self.preprocessor else None,
+                              self.preprocessor.target_dpi if self.preprocessor else 300)
+                )
+            return self._pool
+
+    def ocr_images(self, images: List[Image.Image], pool: Optional[ProcessPoolExecutor] = None) -> List[str]:
+        """OCRs page images, in parallel when a pool is given. Output order always matches input order."""
+        if pool is None or len(images) <= 1:
+            texts = []
+            for img in images:
+                if self.preprocessor is not None:
+                    img, _ = self.preprocessor.preprocess(img)
+                with OCR_SECONDS.time(source="pdf"):
+                    texts.append(self.backend.image_to_string(img))
+            return texts
+        # map() yields results in submission order, so page numbering stays stable
+        started = time.perf_counter()
+        texts = []
+        for text, report in pool.map(_ocr_page, images):
+            texts.append(text)
+            if report and self.preprocessor is not None:
+                self.preprocessor.record(report)
+        per_page = (time.perf_counter() - started) / len(images)
+        for _ in images:
+            OCR_SECONDS.observe(per_page, source="pdf")
+        return texts
+
+    def ocr_pdf_pages(self, pdf_path: Union[str, bytes], pages: Optional[List[int]] = None,
+                      plan: Optional[Tuple[int, int, int]] = None) -> Dict[int, str]:
+        """Rasterizes and OCRs PDF pages one window at a time, freeing each window before the next.
+
+        Returns {page_number: text}. OCRs every page when `pages` is None.
+        """
+        plan = plan or self._plan_rasterization(pdf_path)
+        page_total = plan[0] if pages is None else len(pages)
+        pool = self._ocr_pool(page_total)
+        results: Dict[int, str] = {}
+        for first_page, images in self.iter_pdf_pages(pdf_path, plan, pages):
+            try:
+                texts = self.ocr_images(images, pool)
+            finally:
+                for img in images:
+                    img.close()
+            for offset, text in enumerate(texts):
+                results[first_page + offset] = text
+        return results
+
+    def ocr_pdf(self, pdf_path: Source) -> str:
+        """OCRs every page of a PDF, ignoring any text layer."""
+        pdf_path = _read_source(pdf_path)
+        return self.join_pages([
+            {"page": page, "method": "ocr", "text": text}
+            for page, text in sorted(self.ocr_pdf_pages(pdf_path).items())
+        ])
+
+    @staticmethod
+    def has_text_layer(text: str) -> bool:
+        return sum(ch.isalnum() for ch in text) >= MIN_TEXT_LAYER_CHARS
+
+    def extract_pdf_pages(self, pdf_path: Source) -> List[Dict[str, Any]]:
+        """Extracts each page through whichever path it needs.
+
+        Pages with a usable pypdf text layer are taken as-is ("native"); only the remaining
+        pages are rasterized and OCR'd ("ocr"). Pages that yield nothing either way are
+        reported as "empty". Returns one {"page", "method", "text"} dict per page, in order.
+        Accepts a path, bytes or a file-like object; in-memory input is never written out by pypdf.
+        """
+        pdf_path = _read_source(pdf_path)
+        # Method 1: Native Extraction (pypdf), page by page
+        native_texts: List[str] = []
+        native_started = time.perf_counter()
         try:
             from pypdf import PdfReader
-            reader = PdfReader(pdf_path)
-            text = ""
+            reader = PdfReader(io.BytesIO(pdf_path) if isinstance(pdf_path, bytes) else pdf_path)
             for page in reader.pages:
-                text += page.extract_text() + "\n"
-            
-            if text.strip():
-                return text
+                try:
+                    native_texts.append(page.extract_text() or "")
+                except Exception as e:
+                    logger.warning("Native extraction failed on a page of %s: %s", _describe(pdf_path), e)
+                    native_texts.append("")
         except Exception as e:
-            print(f"Native extraction failed for {pdf_path}: {e}")
+            logger.warning("Native extraction failed for %s: %s", _describe(pdf_path), e)
+            native_texts = []
+        NATIVE_EXTRACT_SECONDS.observe(time.perf_counter() - native_started)
 
-        # Method 2: OCR (pdf2image + pytesseract)
-        print(f"Native extraction empty or failed. Attempting OCR for {pdf_path}...")
-        try:
-            images = self.convert_pdf_to_images(pdf_path)
-            full_text = ""
-            for i, img in enumerate(images):
-                text = pytesseract.image_to_string(img)
-                full_text += f"\n--- Page {i+1} ---\n{text}"
-            return full_text
-        except Exception as e:
-             print(f"OCR failed for {pdf_path}. Ensure Poppler and Tesseract are installed. Error: {e}")
-             return ""
+        pages = [
+            {"page": i + 1, "method": "native", "text": text}
+            for i, text in enumerate(native_texts)
+        ]
+        ocr_needed = [p["page"] for p in pages if not self.has_text_layer(p["text"])]
+
+        # Method 2: OCR (pdf2image + pytesseract), only for pages without a text layer
+        if ocr_needed or not pages:
+            try:
+                plan = self._plan_rasterization(pdf_path)
+                if not pages:
+                    # pypdf couldn't open it at all; let poppler tell us how many pages there are
+                    pages = [{"page": i + 1, "method": "native", "text": ""} for i in range(plan[0])]
+                    ocr_needed = [p["page"] for p in pages]
+                logger.info("No text layer on %d/%d pages. Running OCR for %s...", len(ocr_needed), len(pages), _describe(pdf_path))
+                ocr_texts = self.ocr_pdf_pages(pdf_path, ocr_needed, plan)
+                for p in pages:
+                    if p["page"] in ocr_texts:
+                        p["method"] = "ocr"
+                        p["text"] = ocr_texts[p["page"]]
+            except Exception as e:
+                logger.error("OCR failed for %s. Ensure Poppler and Tesseract are installed. Error: %s", _describe(pdf_path), e)
+                ERRORS_TOTAL.inc(stage="ocr")
+
+        for p in pages:
+            if not p["text"].strip():
+                p["method"] = "empty"
+            PAGES_TOTAL.inc(method=p["method"])
+        return pages
+
+    @staticmethod
+    def join_pages(pages: List[Dict[str, Any]]) -> str:
+        return "".join(f"\n--- Page {p['page']} ---\n{p['text']}" for p in pages)
+
+    def extract_text_from_pdf(self, pdf_path: Source) -> str:
+        """Extracts text from a PDF, using the text layer where present and OCR for the rest."""
+        return self.join_pages(self.extract_pdf_pages(pdf_path))
 
-    def extract_text_from_scanned_pdf(self, pdf_path: str) -> str:
+    def extract_text_from_scanned_pdf(self, pdf_path: Source) -> str:
         """Alias for extract_text_from_pdf for clarity in pipeline."""
         return self.extract_text_from_pdf(pdf_path)
@@ -34,3 +34,14 @@ class InvoiceData(BaseModel):
             ]
         }
     }
+
+class InvoiceBatch(BaseModel):
+    """Top-level shape requested from the LLM in structured-output mode (one entry per invoice found)."""
+    invoices: List[InvoiceData] = Field(default_factory=list, description="Every invoice found in the document")
+
+class DocumentInvoice(InvoiceData):
+    document_id: Optional[str] = Field(None, description="ID of the document this invoice was found in")
+
+class DocumentInvoiceBatch(BaseModel):
+    """Shape requested when several documents are packed into one request; invoices are tagged with their document."""
+    invoices: List[DocumentInvoice] = Field(default_factory=list, description="Every invoice found in any of the documents")
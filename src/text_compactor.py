@@ -0,0 +1,193 @@
+import re
+from typing import Any, Dict, List, Optional
+
+# Page markers written by OCREngine.join_pages
+PAGE_MARKER = re.compile(r"\n?--- Page (\d+) ---\n")
+# Paragraphs that open with one of these headings are legal boilerplate, never invoice data
+BOILERPLATE_HEADINGS = re.compile(
+    r"^\s*(terms\s*(and|&)\s*conditions|terms\s+of\s+(sale|service|payment)|general\s+conditions|disclaimer)\b",
+    re.IGNORECASE
+)
+
+_tokenizer = None
+
+def estimate_tokens(text: str) -> int:
+    """Token count via tiktoken when installed, otherwise the ~4 chars/token rule of thumb."""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = False
+    if _tokenizer:
+        return len(_tokenizer.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def split_pages(text: str) -> List[Dict[str, Any]]:
+    """Splits extracted text on page markers (or form feeds). Returns [{"page", "text"}]."""
+    parts = PAGE_MARKER.split(text)
+    if len(parts) == 1:
+        pages = text.split("\f")
+        if len(pages) == 1:
+            return [{"page": 0, "text": text}]  # page 0 = unpaginated, joined back without a marker
+        return [{"page": i + 1, "text": page} for i, page in enumerate(pages)]
+    pages = []
+    if parts[0].strip():
+        pages.append({"page": 0, "text": parts[0]})
+    for i in range(1, len(parts), 2):
+        pages.append({"page": int(parts[i]), "text": parts[i + 1]})
+    return pages
+
+def join_pages(pages: List[Dict[str, Any]]) -> str:
+    return "".join(
+        f"\n--- Page {p['page']} ---\n{p['text']}" if p["page"] else p["text"] for p in pages
+    )
+
+def normalize_whitespace(text: str) -> str:
+    """Collapses runs of spaces/tabs, strips line ends and squeezes blank-line runs to one."""
+    lines = [re.sub(r"[ \t\u00a0]+", " ", line).strip() for line in text.splitlines()]
+    text = "\n".join(lines)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+PAGE_COUNTER = re.compile(r"\bpage\s*\d+(\s*(of|/)\s*\d+)?\b", re.IGNORECASE)
+
+def _line_key(line: str) -> str:
+    # Page counters are the only part of a running header that changes page to page.
+    # Other digits are kept, so line items that merely look alike are never matched.
+    return PAGE_COUNTER.sub("page #", line.lower()).strip()
+
+def remove_repeated_lines(pages: List[Dict[str, Any]], edge_lines: int = 4, min_fraction: float = 0.5) -> List[Dict[str, Any]]:
+    """Drops header/footer lines that recur near the top or bottom of most pages.
+
+    The first page keeps its copy, since that is usually where the vendor block lives.
+    """
+    if len(pages) < 2:
+        return pages
+
+    page_lines = [p["text"].splitlines() for p in pages]
+    counts: Dict[str, int] = {}
+    for lines in page_lines:
+        content = [line for line in lines if line.strip()]
+        edges = {_line_key(line) for line in content[:edge_lines] + content[-edge_lines:]}
+        for key in edges:
+            counts[key] = counts.get(key, 0) + 1
+
+    threshold = max(2, int(len(pages) * min_fraction + 0.5))
+    repeated = {key for key, count in counts.items() if count >= threshold and key}
+    if not repeated:
+        return pages
+
+    compacted = [pages[0]]
+    for page, lines in zip(pages[1:], page_lines[1:]):
+        kept = [line for line in lines if _line_key(line) not in repeated]
+        compacted.append({"page": page["page"], "text": "\n".join(kept)})
+    return compacted
+
+def remove_boilerplate(text: str) -> str:
+    """Removes blank-line-separated paragraphs that start with a terms/conditions heading."""
+    paragraphs = re.split(r"\n\s*\n", text)
+    return "\n\n".join(p for p in paragraphs if not BOILERPLATE_HEADINGS.match(p))
+
+def chunk_pages(pages: List[Dict[str, Any]], max_tokens: int) -> List[str]:
+    """Packs whole pages into chunks under max_tokens. A page that is too big on its own
+    is split on line boundaries."""
+    chunks: List[str] = []
+    current: List[Dict[str, Any]] = []
+    current_tokens = 0
+    for page in pages:
+        tokens = estimate_tokens(page["text"])
+        if tokens > max_tokens:
+            if current:
+                chunks.append(join_pages(current))
+                current, current_tokens = [], 0
+            part, part_tokens = [], 0
+            for line in page["text"].splitlines():
+                line_tokens = estimate_tokens(line) + 1
+                if part and part_tokens + line_tokens > max_tokens:
+                    chunks.append(join_pages([{"page": page["page"], "text": "\n".join(part)}]))
+                    part, part_tokens = [], 0
+                part.append(line)
+                part_tokens += line_tokens
+            if part:
+                chunks.append(join_pages([{"page": page["page"], "text": "\n".join(part)}]))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(join_pages(current))
+            current, current_tokens = [], 0
+        current.append(page)
+        current_tokens += tokens
+    if current:
+        chunks.append(join_pages(current))
+    return chunks
+
+class TextCompactor:
+    """Shrinks extracted text before it is sent to the LLM.
+
+    Normalizes whitespace, strips headers/footers repeated across pages and terms-and-
+    conditions paragraphs, then splits anything over `max_tokens` into page-aligned chunks.
+    """
+
+    def __init__(self, max_tokens: int = 12000, edge_lines: int = 4, remove_terms: bool = True):
+        self.max_tokens = max_tokens
+        self.edge_lines = edge_lines
+        self.remove_terms = remove_terms
+
+    def compact(self, text: str) -> Dict[str, Any]:
+        """Returns {"chunks": [...], "tokens_before", "tokens_after"}."""
+        tokens_before = estimate_tokens(text)
+        pages = [{"page": p["page"], "text": normalize_whitespace(p["text"])} for p in split_pages(text)]
+        pages = remove_repeated_lines(pages, self.edge_lines)
+        if self.remove_terms:
+            pages = [{"page": p["page"], "text": remove_boilerplate(p["text"])} for p in pages]
+        # Removals leave gaps behind; squeeze them again
+        pages = [{"page": p["page"], "text": normalize_whitespace(p["text"])} for p in pages]
+        pages = [p for p in pages if p["text"]]
+
+        chunks = chunk_pages(pages, self.max_tokens) if pages else []
+        tokens_after = sum(estimate_tokens(chunk) for chunk in chunks)
+        return {"chunks": chunks, "tokens_before": tokens_before, "tokens_after": tokens_after}
+
+def _invoice_key(invoice: Dict[str, Any]) -> Optional[tuple]:
+    number = str(invoice.get("invoice_number") or "").strip().lower()
+    vendor = re.sub(r"\W+", "", str(invoice.get("vendor_name") or "").lower())
+    if not number and not vendor:
+        return None
+    return (vendor, number)
+
+def merge_chunk_invoices(chunk_results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Merges per-chunk LLM results back into whole invoices.
+
+    Invoices with the same vendor and number are combined: line items are concatenated
+    in chunk order and header fields are filled from whichever chunk has them,
+    with totals taken from the latest chunk since they usually sit on the last page.
+    An entry with neither vendor nor number is treated as a continuation of the
+    previous invoice.
+    """
+    merged: List[Dict[str, Any]] = []
+    by_key: Dict[tuple, Dict[str, Any]] = {}
+    for results in chunk_results:
+        for invoice in results:
+            if not isinstance(invoice, dict):
+                continue
+            key = _invoice_key(invoice)
+            target = by_key.get(key) if key else (merged[-1] if merged else None)
+            if target is None and key and key[1]:
+                # Same number seen under a vendor name spelled differently (or missing) in another chunk
+                target = next((m for k, m in by_key.items() if k[1] == key[1]), None)
+            if target is None:
+                target = {k: v for k, v in invoice.items() if k != "line_items"}
+                target["line_items"] = []
+                merged.append(target)
+                if key:
+                    by_key[key] = target
+            else:
+                for field, value in invoice.items():
+                    if field == "line_items":
+                        continue
+                    if field in ("total_amount", "tax_amount") and value is not None:
+                        target[field] = value
+                    elif target.get(field) in (None, "") and value not in (None, ""):
+                        target[field] = value
+            target["line_items"].extend(invoice.get("line_items") or [])
+    return merged
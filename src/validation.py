@@ -0,0 +1,182 @@
+import json
+import logging
+from datetime import date
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from pydantic import TypeAdapter, ValidationError
+from src.schema import InvoiceData
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INVOICE_LIST = TypeAdapter(List[InvoiceData])
+
+# Confidence lost per flag; an invoice with any REASK_FLAGS is worth a second LLM pass
+FLAG_PENALTIES = {
+    "line_amount_mismatch": 0.2,   # quantity * unit_price != amount on some line
+    "total_mismatch": 0.3,         # line items (+ tax) don't add up to total_amount
+    "invalid_date": 0.2,           # invoice_date/due_date not a real YYYY-MM-DD date
+    "due_before_invoice": 0.1,
+    "future_date": 0.1,
+    "negative_amount": 0.2,
+    "missing_total": 0.3,
+    "missing_vendor": 0.1,
+    "missing_invoice_number": 0.1,
+}
+REASK_FLAGS = {"line_amount_mismatch", "total_mismatch", "invalid_date", "due_before_invoice", "negative_amount"}
+
+FLAG_DESCRIPTIONS = {
+    "line_amount_mismatch": "quantity * unit_price does not equal amount on at least one line item",
+    "total_mismatch": "the line item amounts plus tax_amount do not add up to total_amount",
+    "invalid_date": "invoice_date or due_date is not a valid YYYY-MM-DD date",
+    "due_before_invoice": "due_date is before invoice_date",
+    "future_date": "invoice_date is in the future",
+    "negative_amount": "an amount is negative",
+}
+
+def validate_batch(raw_json_list: List[Any]) -> List[Dict[str, Any]]:
+    """Validates every LLM result in one TypeAdapter call.
+
+    Returns dumped invoices in input order; an entry that fails validation becomes
+    {"error", "raw_json"} as before. Only the failing entries are validated again one
+    by one, to give each its own error message.
+    """
+    try:
+        return [invoice.model_dump() for invoice in INVOICE_LIST.validate_python(raw_json_list)]
+    except ValidationError as e:
+        failed = {error["loc"][0] for error in e.errors() if error["loc"]}
+    results = []
+    for index, raw_json in enumerate(raw_json_list):
+        if index not in failed:
+            results.append(None)
+            continue
+        try:
+            results.append(InvoiceData(**raw_json).model_dump())
+        except Exception as e:
+            logger.warning("Validation Error: %s", e)
+            results.append({"error": str(e), "raw_json": raw_json})
+    passed = [raw for index, raw in enumerate(raw_json_list) if index not in failed]
+    dumped = iter(invoice.model_dump() for invoice in INVOICE_LIST.validate_python(passed))
+    return [result if result is not None else next(dumped) for result in results]
+
+def _parse_dates(values: List[Any]) -> Tuple["np.ndarray", "np.ndarray"]:
+    """(datetime64[D] array with NaT where absent or invalid, bool array of values given but invalid)."""
+    import numpy as np
+    strings = np.array([str(v).strip() if v else "" for v in values], dtype=str)
+    given = strings != ""
+    well_formed = np.char.str_len(strings) == 10  # numpy would also accept "2024-01" or "2024"
+    try:
+        parsed = np.where(well_formed, strings, "NaT").astype("datetime64[D]")
+    except ValueError:
+        # At least one impossible date (e.g. 2024-13-40): only then parse them one at a time
+        parsed = np.array([_to_date(v) for v in np.where(well_formed, strings, "NaT")], dtype="datetime64[D]")
+    return parsed, given & np.isnat(parsed)
+
+def _to_date(value: str):
+    import numpy as np
+    try:
+        return np.datetime64(value, "D")
+    except ValueError:
+        return np.datetime64("NaT")
+
+class InvoiceChecker:
+    """Arithmetic and date reconciliation over a batch of validated invoices.
+
+    The checks run as NumPy column operations over every line item of every invoice
+    at once (per-invoice sums are bincounts over the line items' owner index), then each
+    invoice gets {"confidence", "flags"} under "validation". Amounts agree within
+    `tolerance` (absolute) or `relative_tolerance` of the larger value, whichever is
+    looser, so rounding on printed invoices isn't flagged.
+    """
+
+    def __init__(self, tolerance: float = 0.02, relative_tolerance: float = 0.005):
+        self.tolerance = tolerance
+        self.relative_tolerance = relative_tolerance
+
+    def _mismatch(self, left: "np.ndarray", right: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+        allowed = np.maximum(self.tolerance, self.relative_tolerance * np.maximum(np.abs(left), np.abs(right)))
+        # Comparisons with NaN are False, so absent fields never count as mismatches
+        return np.abs(left - right) > allowed
+
+    def check(self, invoices: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Annotates the non-error invoices in place and returns the list."""
+        import numpy as np
+
+        positions = [i for i, inv in enumerate(invoices) if "error" not in inv]
+        if not positions:
+            return invoices
+        headers = [invoices[i] for i in positions]
+        count = len(headers)
+        items = [(n, item.get("quantity"), item.get("unit_price"), item.get("amount"))
+                 for n, header in enumerate(headers) for item in header.get("line_items") or []]
+        owner = np.array([item[0] for item in items], dtype=np.intp)
+        quantity, unit_price, amount = (np.array([item[k] for item in items], dtype=float) for k in (1, 2, 3))
+        total = np.array([h.get("total_amount") for h in headers], dtype=float)
+        tax = np.array([h.get("tax_amount") for h in headers], dtype=float)
+
+        def per_invoice(values: "np.ndarray") -> "np.ndarray":
+            return np.bincount(owner, weights=values, minlength=count)
+
+        def given(field: str) -> "np.ndarray":
+            return np.array([bool(str(h.get(field) or "").strip()) for h in headers])
+
+        flags = {}
+        with np.errstate(invalid="ignore"):
+            flags["line_amount_mismatch"] = per_invoice(self._mismatch(quantity * unit_price, amount)) > 0
+            # Only invoices whose every line has an amount can be reconciled against the total.
+            # Totals may include tax (subtotal + tax) or already be tax-inclusive (subtotal)
+            lines = per_invoice(np.ones(len(items)))
+            complete = (lines > 0) & (per_invoice(~np.isnan(amount)) == lines)
+            subtotal = per_invoice(np.nan_to_num(amount))
+            flags["total_mismatch"] = (complete & self._mismatch(subtotal + np.nan_to_num(tax), total)
+                                       & self._mismatch(subtotal, total))
+
+            invoice_date, bad_invoice_date = _parse_dates([h.get("invoice_date") for h in headers])
+            due_date, bad_due_date = _parse_dates([h.get("due_date") for h in headers])
+            flags["invalid_date"] = bad_invoice_date | bad_due_date
+            flags["due_before_invoice"] = due_date < invoice_date
+            flags["future_date"] = invoice_date > np.datetime64(date.today(), "D") + 1
+
+            negative_lines = per_invoice((unit_price < 0) | (amount < 0)) > 0
+            flags["negative_amount"] = (total < 0) | (tax < 0) | negative_lines
+            flags["missing_total"] = np.isnan(total)
+        flags["missing_vendor"] = ~given("vendor_name")
+        flags["missing_invoice_number"] = ~given("invoice_number")
+
+        names = list(FLAG_PENALTIES)
+        matrix = np.column_stack([flags[name] for name in names])
+        confidence = np.clip(1.0 - matrix @ np.array([FLAG_PENALTIES[name] for name in names]), 0.0, 1.0).round(2)
+        for i, row, score in zip(positions, matrix.tolist(), confidence.tolist()):
+            invoices[i]["validation"] = {"confidence": score, "flags": [name for name, bad in zip(names, row) if bad]}
+        return invoices
+
+def without_report(invoice: Dict[str, Any]) -> Dict[str, Any]:
+    """`invoice` without the "validation" annotation InvoiceChecker adds."""
+    return {k: v for k, v in invoice.items() if k != "validation"}
+
+def needs_reask(invoice: Dict[str, Any]) -> bool:
+    return "error" not in invoice and bool(REASK_FLAGS.intersection(invoice.get("validation", {}).get("flags", ())))
+
+def build_reask_text(text: str, invoice: Dict[str, Any]) -> str:
+    """Document text for a targeted second extraction: the source, the rejected reading, and what is wrong with it."""
+    problems = [FLAG_DESCRIPTIONS[flag] for flag in invoice["validation"]["flags"] if flag in FLAG_DESCRIPTIONS]
+    previous = without_report(invoice)
+    return (
+        "A previous extraction of the invoice below failed these checks:\n"
+        + "\n".join(f"- {problem}" for problem in problems)
+        + "\n\nPrevious extraction:\n" + json.dumps(previous, default=str)
+        + f"\n\nRe-read the document and return the corrected invoice {previous.get('invoice_number') or ''}."
+        + " Copy numbers and dates exactly as printed.\n\nDocument:\n" + text
+    )
+
+def pick_correction(original: Dict[str, Any], candidates: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The re-asked invoice to keep instead of `original`, or None if none is more consistent."""
+    best = None
+    for candidate in candidates:
+        if "error" in candidate:
+            continue
+        if candidate["validation"]["confidence"] > (best or original)["validation"]["confidence"]:
+            best = candidate
+    return best
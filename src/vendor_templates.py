@@ -0,0 +1,550 @@
+import os
+import re
+import json
+import atexit
+import time
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from src.text_compactor import PAGE_MARKER
+
+logger = logging.getLogger(__name__)
+
+# Money as it appears on invoices: optional sign/currency symbol, thousands separators
+NUMBER = r"-?[$€£]?-?\d[\d,]*(?:\.\d+)?"
+NUMBER_TOKEN = re.compile(NUMBER)
+
+# Date layouts tried when locating a validated YYYY-MM-DD date in the source text
+DATE_FORMATS = {
+    "%Y-%m-%d": r"\d{4}-\d{1,2}-\d{1,2}",
+    "%d/%m/%Y": r"\d{1,2}/\d{1,2}/\d{4}",
+    "%m/%d/%Y": r"\d{1,2}/\d{1,2}/\d{4}",
+    "%d.%m.%Y": r"\d{1,2}\.\d{1,2}\.\d{4}",
+    "%d-%m-%Y": r"\d{1,2}-\d{1,2}-\d{4}",
+    "%B %d, %Y": r"[A-Za-z]+ \d{1,2}, \d{4}",
+    "%b %d, %Y": r"[A-Za-z]{3} \d{1,2}, \d{4}",
+    "%d %B %Y": r"\d{1,2} [A-Za-z]+ \d{4}",
+    "%d %b %Y": r"\d{1,2} [A-Za-z]{3} \d{4}",
+}
+
+# Label words that make an anchor the likely home of a field when a value occurs twice
+FIELD_HINTS = {
+    "invoice_number": ("invoice", "inv", "no", "number", "#", "ref"),
+    "invoice_date": ("date",),
+    "due_date": ("due",),
+    "tax_amount": ("tax", "vat", "gst"),
+    "total_amount": ("total", "amount due", "balance"),
+}
+HEADER_FIELDS = ("invoice_number", "invoice_date", "due_date", "tax_amount", "total_amount")
+AMOUNT_FIELDS = ("tax_amount", "total_amount")
+DATE_FIELDS = ("invoice_date", "due_date")
+ITEM_FIELDS = ("quantity", "unit_price", "amount")
+MAX_ANCHOR_WORDS = 4
+MAX_FINGERPRINT_LINES = 40
+
+def _lines(text: str) -> List[str]:
+    lines = []
+    for line in PAGE_MARKER.sub("\n", text).splitlines():
+        line = re.sub(r"\s+", " ", line).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+def _parse_number(token: str) -> Optional[float]:
+    try:
+        return float(token.replace("$", "").replace("€", "").replace("£", "").replace(",", ""))
+    except ValueError:
+        return None
+
+def _same_amount(a: Optional[float], b: Optional[float]) -> bool:
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(float(a) - float(b)) < 0.005 + 1e-6 * abs(float(b))
+
+def _vendor_key(vendor_name: str) -> str:
+    return re.sub(r"\W+", "", (vendor_name or "").lower())
+
+def _id_pattern(value: str) -> str:
+    """Shape of an identifier: digit runs vary, everything else is literal (INV-1001 -> INV\\-\\d+)."""
+    return "".join(r"\d+" if part.isdigit() else re.escape(part) for part in re.findall(r"\d+|\D+", value))
+
+def _anchor_before(line: str, start: int) -> str:
+    """Label words just left of a value, stopping at anything that looks like another value."""
+    words = line[:start].split()
+    anchor = []
+    for word in reversed(words):
+        if re.search(r"\d", word) or len(anchor) == MAX_ANCHOR_WORDS:
+            break
+        anchor.insert(0, word)
+    return " ".join(anchor)
+
+def _hinted(field: str, anchor: str) -> bool:
+    anchor = anchor.lower()
+    if field == "invoice_date" and "due" in anchor:
+        return False
+    return any(hint in anchor for hint in FIELD_HINTS.get(field, ()))
+
+class VendorTemplate:
+    """Anchor/regex extraction rules for one vendor's invoice layout.
+
+    Built from validated InvoiceData outputs. Header fields are found by the label that
+    precedes them ("Invoice #:", "Total Due"), line items by the column order of the rows
+    under the table header. `fingerprint` holds the digit-free lines every sample shared,
+    which is what identifies the layout.
+    """
+
+    def __init__(self, vendor_name: str, currency: str = "USD", fingerprint: List[str] = None,
+                 fields: Dict[str, Dict[str, Any]] = None, items: Dict[str, Any] = None,
+                 checks: Dict[str, Any] = None, samples: int = 1, updated_at: float = None):
+        self.vendor_name = vendor_name
+        self.currency = currency
+        self.fingerprint = fingerprint or []
+        self.fields = fields or {}
+        self.items = items
+        self.checks = checks or {}
+        self.samples = samples
+        self.updated_at = updated_at or time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "VendorTemplate":
+        return cls(**data)
+
+    @classmethod
+    def learn(cls, text: str, invoice: Dict[str, Any]) -> Optional["VendorTemplate"]:
+        """Derives rules from one validated invoice, or None if the text doesn't support them.
+
+        Every non-empty field must be locatable in the text, so a template never answers
+        with less than the LLM did on its own sample.
+        """
+        lines = _lines(text)
+        vendor_name = invoice.get("vendor_name")
+        if not vendor_name or not invoice.get("invoice_number") or invoice.get("total_amount") is None:
+            return None
+        if re.sub(r"\s+", " ", vendor_name).lower() not in "\n".join(lines).lower():
+            return None
+
+        items, item_lines = cls._learn_items(lines, invoice.get("line_items") or [])
+        if invoice.get("line_items") and items is None:
+            return None
+
+        fields = {}
+        for field in HEADER_FIELDS:
+            value = invoice.get(field)
+            if value in (None, ""):
+                continue
+            rule = cls._learn_field(lines, field, value, item_lines)
+            if rule is None:
+                return None
+            fields[field] = rule
+
+        fingerprint = []
+        descriptions = {str(item.get("description", "")).lower() for item in invoice.get("line_items") or []}
+        for line in lines:
+            key = line.lower()
+            if len(key) >= 4 and not re.search(r"\d", key) and key not in descriptions and key not in fingerprint:
+                fingerprint.append(key)
+        template = cls(
+            vendor_name=vendor_name,
+            currency=invoice.get("currency") or "USD",
+            fingerprint=fingerprint[:MAX_FINGERPRINT_LINES],
+            fields=fields,
+            items=items,
+            checks=cls._learn_checks(invoice)
+        )
+        return template if template.reproduces(text, invoice) else None
+
+    @staticmethod
+    def _learn_field(lines: List[str], field: str, value: Any, skip_lines: set) -> Optional[Dict[str, Any]]:
+        candidates = []
+        for i, line in enumerate(lines):
+            if i in skip_lines:
+                continue
+            for rule, start in VendorTemplate._locate(line, field, value):
+                # Labels with digits in them ("Tax (8%):") are kept whole; a later sample
+                # that disagrees replaces the rule
+                anchor = _anchor_before(line, start) or line[:start].strip()
+                if anchor:
+                    candidates.append(dict(rule, anchor=anchor, next_line=False))
+                elif i > 0 and not re.search(r"\d", lines[i - 1]):
+                    # Value sits alone under its label
+                    pattern = re.compile(rule["pattern"])
+                    occurrence = sum(1 for m in pattern.finditer(line) if m.start() < start)
+                    candidates.append(dict(rule, anchor=lines[i - 1], next_line=True, occurrence=occurrence))
+        if not candidates:
+            return None
+        hinted = [c for c in candidates if _hinted(field, c["anchor"])]
+        return (hinted or candidates)[-1 if field == "total_amount" else 0]
+
+    @staticmethod
+    def _locate(line: str, field: str, value: Any) -> List[Tuple[Dict[str, Any], int]]:
+        """Every spot in `line` holding `value`, with the rule that would match it there."""
+        found = []
+        if field in AMOUNT_FIELDS:
+            for m in NUMBER_TOKEN.finditer(line):
+                if _same_amount(_parse_number(m.group(0)), value):
+                    found.append(({"kind": "amount", "pattern": NUMBER}, m.start()))
+        elif field in DATE_FIELDS:
+            for fmt, pattern in DATE_FORMATS.items():
+                for m in re.finditer(pattern, line):
+                    try:
+                        parsed = datetime.strptime(m.group(0), fmt).date().isoformat()
+                    except ValueError:
+                        continue
+                    if parsed == value:
+                        found.append(({"kind": "date", "pattern": pattern, "format": fmt}, m.start()))
+        else:
+            value = str(value)
+            for m in re.finditer(r"(?<![\w-])" + re.escape(value) + r"(?![\w-])", line):
+                found.append(({"kind": "id", "pattern": _id_pattern(value)}, m.start()))
+        return found
+
+    @staticmethod
+    def _learn_items(lines: List[str], line_items: List[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], set]:
+        if not line_items:
+            return None, set()
+        rows = []
+        columns = None
+        for item in line_items:
+            description = re.sub(r"\s+", " ", str(item.get("description", ""))).strip().lower()
+            start = rows[-1] + 1 if rows else 0
+            index = next((i for i in range(start, len(lines)) if description and lines[i].lower().startswith(description)), None)
+            if index is None:
+                return None, set()
+            tokens = [_parse_number(t) for t in NUMBER_TOKEN.findall(lines[index][len(description):])]
+            mapping = [None] * len(tokens)
+            for field in ITEM_FIELDS:
+                if item.get(field) is None:
+                    continue
+                slot = next((j for j, t in enumerate(tokens) if mapping[j] is None and _same_amount(t, item[field])), None)
+                if slot is None:
+                    return None, set()
+                mapping[slot] = field
+            if columns is not None and mapping != columns:
+                return None, set()
+            columns = mapping
+            rows.append(index)
+
+        # Rows must be contiguous, so the region between header and footer is unambiguous
+        if rows != list(range(rows[0], rows[0] + len(rows))) or rows[0] == 0:
+            return None, set()
+        after = lines[rows[-1] + 1].split() if rows[-1] + 1 < len(lines) else []
+        footer = []
+        for word in after:
+            if re.search(r"\d", word):
+                break
+            footer.append(word)
+        return {
+            "start": lines[rows[0] - 1],
+            "end": " ".join(footer) or None,
+            "columns": columns,
+        }, set(rows)
+
+    @staticmethod
+    def _learn_checks(invoice: Dict[str, Any]) -> Dict[str, Any]:
+        items = invoice.get("line_items") or []
+        total = invoice.get("total_amount")
+        tax = invoice.get("tax_amount") or 0.0
+        checks = {"items_sum": None, "line_math": False}
+        if items and all(item.get("amount") is not None for item in items):
+            items_sum = sum(item["amount"] for item in items)
+            if tax and _same_amount(items_sum + tax, total):
+                checks["items_sum"] = "plus_tax"
+            elif _same_amount(items_sum, total):
+                checks["items_sum"] = "equals_total"
+        checks["line_math"] = bool(items) and all(
+            None not in (item.get("quantity"), item.get("unit_price"), item.get("amount"))
+            and _same_amount(item["quantity"] * item["unit_price"], item["amount"])
+            for item in items
+        )
+        return checks
+
+    def merge(self, other: "VendorTemplate", text: str, invoice: Dict[str, Any]):
+        """Folds in another validated sample. Rules that still reproduce it are kept and the
+        fingerprint narrows to the lines both share; a changed layout replaces the rules."""
+        if self.reproduces(text, invoice):
+            shared = [line for line in self.fingerprint if line in set(other.fingerprint)]
+            self.fingerprint = shared or other.fingerprint
+            self.checks = {
+                "items_sum": self.checks.get("items_sum") if self.checks.get("items_sum") == other.checks.get("items_sum") else None,
+                "line_math": bool(self.checks.get("line_math") and other.checks.get("line_math")),
+            }
+            self.samples += 1
+        else:
+            self.fingerprint, self.fields, self.items, self.checks = other.fingerprint, other.fields, other.items, other.checks
+            self.samples = 1
+        self.updated_at = time.time()
+
+    def fingerprint_score(self, lines_lower: set) -> float:
+        if not self.fingerprint:
+            return 0.0
+        return sum(1 for line in self.fingerprint if line in lines_lower) / len(self.fingerprint)
+
+    def extract(self, text: str, lines: List[str] = None) -> Tuple[Optional[Dict[str, Any]], float]:
+        """Applies the rules. Returns (invoice, field coverage) or (None, 0.0) when the
+        layout clearly doesn't fit (e.g. an unexpected line inside the item table)."""
+        lines = lines if lines is not None else _lines(text)
+        invoice = {
+            "vendor_name": self.vendor_name,
+            "invoice_number": None,
+            "invoice_date": None,
+            "due_date": None,
+            "tax_amount": None,
+            "total_amount": None,
+            "currency": self.currency,
+            "line_items": [],
+        }
+        found = 0
+        for field, rule in self.fields.items():
+            value = self._apply_rule(lines, rule)
+            if value is not None:
+                invoice[field] = value
+                found += 1
+
+        expected = len(self.fields)
+        if self.items:
+            expected += 1
+            items = self._extract_items(lines)
+            if items is None:
+                return None, 0.0
+            if items:
+                invoice["line_items"] = items
+                found += 1
+        return invoice, (found / expected if expected else 0.0)
+
+    @staticmethod
+    def _convert(rule: Dict[str, Any], raw: str) -> Any:
+        if rule["kind"] == "amount":
+            return _parse_number(raw)
+        if rule["kind"] == "date":
+            try:
+                return datetime.strptime(raw, rule["format"]).date().isoformat()
+            except ValueError:
+                return None
+        return raw
+
+    def _apply_rule(self, lines: List[str], rule: Dict[str, Any]) -> Any:
+        if rule.get("next_line"):
+            anchor = rule["anchor"].lower()
+            for i, line in enumerate(lines[:-1]):
+                if line.lower() == anchor:
+                    matches = list(re.finditer(rule["pattern"], lines[i + 1]))
+                    if len(matches) > rule.get("occurrence", 0):
+                        return self._convert(rule, matches[rule.get("occurrence", 0)].group(0))
+            return None
+        pattern = re.compile(r"(?<!\w)" + re.escape(rule["anchor"]) + r"\s*(" + rule["pattern"] + r")(?![\w])", re.IGNORECASE)
+        for line in lines:
+            m = pattern.search(line)
+            if m:
+                return self._convert(rule, m.group(1))
+        return None
+
+    def _extract_items(self, lines: List[str]) -> Optional[List[Dict[str, Any]]]:
+        start = self.items["start"].lower()
+        end = (self.items.get("end") or "").lower()
+        columns = self.items["columns"]
+        row = re.compile(r"^(.+?)" + "".join(r"\s+(" + NUMBER + ")" for _ in columns) + r"$")
+        try:
+            index = next(i for i, line in enumerate(lines) if line.lower() == start)
+        except StopIteration:
+            return []
+        items = []
+        for line in lines[index + 1:]:
+            lower = line.lower()
+            if end and lower.startswith(end):
+                break
+            if lower == start:
+                continue  # table header repeated on the next page
+            m = row.match(line)
+            if not m:
+                if items and not end:
+                    break
+                return None
+            item = {"description": m.group(1), "quantity": None, "unit_price": None, "amount": None}
+            for field, raw in zip(columns, m.groups()[1:]):
+                if field:
+                    item[field] = _parse_number(raw)
+            items.append(item)
+        return items
+
+    def passes_checks(self, invoice: Dict[str, Any]) -> bool:
+        items = invoice.get("line_items") or []
+        if self.checks.get("line_math"):
+            for item in items:
+                if None in (item.get("quantity"), item.get("unit_price"), item.get("amount")):
+                    return False
+                if not _same_amount(item["quantity"] * item["unit_price"], item["amount"]):
+                    return False
+        relation = self.checks.get("items_sum")
+        if relation and items:
+            items_sum = sum(item.get("amount") or 0.0 for item in items)
+            expected = (invoice.get("total_amount") or 0.0) - (invoice.get("tax_amount") or 0.0 if relation == "plus_tax" else 0.0)
+            if not _same_amount(items_sum, expected):
+                return False
+        return True
+
+    def reproduces(self, text: str, invoice: Dict[str, Any]) -> bool:
+        """True if the rules extract the same values the validated invoice has."""
+        extracted, _ = self.extract(text)
+        if extracted is None:
+            return False
+        for field in HEADER_FIELDS:
+            expected, got = invoice.get(field), extracted.get(field)
+            if field in AMOUNT_FIELDS:
+                if not _same_amount(got, expected):
+                    return False
+            elif (expected or None) != got and str(expected) != str(got):
+                return False
+        expected_items = invoice.get("line_items") or []
+        got_items = extracted["line_items"]
+        if len(expected_items) != len(got_items):
+            return False
+        for want, got in zip(expected_items, got_items):
+            if any(not _same_amount(got.get(f), want.get(f)) for f in ITEM_FIELDS):
+                return False
+        return True
+
+class VendorTemplateStore:
+    """Learned vendor templates with a match-or-fall-back lookup, persisted as JSON.
+
+    `match(text)` answers with an invoice when a template fits with at least
+    `min_confidence`; otherwise the caller goes to the LLM and hands the validated result
+    to `learn()`. Templates are only used after `min_samples` agreeing samples, so lines
+    specific to one customer drop out of the fingerprint first. The JSON file can also be
+    edited by hand to load or pin rules.
+
+    Learned changes are written at most every `save_interval` seconds (0 = on every
+    change), and on close() or interpreter exit, so results don't each rewrite the file.
+    """
+
+    def __init__(self, path: str = "cache/vendor_templates.json", min_confidence: float = 0.9,
+                 min_samples: int = 2, min_fingerprint: float = 0.8, save_interval: float = 5.0):
+        self.path = path
+        self.min_confidence = min_confidence
+        self.min_samples = min_samples
+        self.min_fingerprint = min_fingerprint
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self.templates: Dict[str, VendorTemplate] = {}
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "rejected": 0, "learned": 0, "match_ms": 0.0}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except json.JSONDecodeError as e:
+                # A truncated or hand-broken file must not stop the service; it is relearned
+                logger.error("Ignoring unreadable vendor templates file %s (%s); starting empty.", path, e)
+                data = {}
+            self.templates = {key: VendorTemplate.from_dict(t) for key, t in data.get("templates", {}).items()}
+        atexit.register(self.close)
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Each writer gets its own temp file (threads here, --workers processes sharing the
+        # path), and the lock keeps this process's snapshot, write and replace in order
+        with self._lock:
+            data = {"templates": {key: t.to_dict() for key, t in self.templates.items()}}
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory or ".",
+                                             prefix=os.path.basename(self.path) + ".", suffix=".tmp",
+                                             delete=False) as f:
+                tmp_path = f.name
+                try:
+                    json.dump(data, f, indent=2)
+                except BaseException:
+                    f.close()
+                    os.remove(tmp_path)
+                    raise
+            os.replace(tmp_path, self.path)
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        """Returns {"invoice", "vendor", "confidence"} for the best fitting template, or None."""
+        started = time.perf_counter()
+        lines = _lines(text)
+        lines_lower = {line.lower() for line in lines}
+        haystack = "\n".join(lines).lower()
+        best = None
+        candidates = 0
+        with self._lock:
+            templates = [t for t in self.templates.values() if t.samples >= self.min_samples]
+        for template in templates:
+            if re.sub(r"\s+", " ", template.vendor_name).lower() not in haystack:
+                continue
+            score = template.fingerprint_score(lines_lower)
+            if score < self.min_fingerprint:
+                continue
+            candidates += 1
+            invoice, coverage = template.extract(text, lines)
+            if invoice is None:
+                continue
+            confidence = score * coverage * (1.0 if template.passes_checks(invoice) else 0.5)
+            if best is None or confidence > best["confidence"]:
+                best = {"invoice": invoice, "vendor": template.vendor_name, "confidence": round(confidence, 3)}
+
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._stats["match_ms"] += (time.perf_counter() - started) * 1000
+            if best is not None and best["confidence"] >= self.min_confidence:
+                self._stats["hits"] += 1
+                return best
+            self._stats["rejected" if candidates else "misses"] += 1
+        return None
+
+    def learn(self, text: str, invoices: List[Dict[str, Any]]) -> bool:
+        """Updates the vendor's template from a validated single-invoice result."""
+        if len(invoices) != 1 or "error" in invoices[0]:
+            return False
+        invoice = invoices[0]
+        learned = VendorTemplate.learn(text, invoice)
+        if learned is None:
+            return False
+        key = _vendor_key(invoice["vendor_name"])
+        with self._lock:
+            existing = self.templates.get(key)
+            if existing is None:
+                self.templates[key] = learned
+            else:
+                existing.merge(learned, text, invoice)
+            self._stats["learned"] += 1
+            self._dirty = True
+            if self.save_interval > 0 and self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_interval, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+        if self.save_interval <= 0:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Writes learned changes not yet on disk."""
+        with self._lock:
+            self._save_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+        self.save()
+
+    def close(self):
+        with self._lock:
+            timer, self._save_timer = self._save_timer, None
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["templates"] = len(self.templates)
+            stats["active_templates"] = sum(1 for t in self.templates.values() if t.samples >= self.min_samples)
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 3) if stats["lookups"] else 0.0
+        stats["avg_match_ms"] = round(stats.pop("match_ms") / stats["lookups"], 3) if stats["lookups"] else 0.0
+        return stats
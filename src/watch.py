@@ -0,0 +1,143 @@
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from src.batch import CheckpointJournal
+from src.metrics import ERRORS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.tiff', '.bmp', '.txt')
+
+# (size, mtime_ns): cheap to read on every poll; content is only hashed once this settles
+Signature = Tuple[int, int]
+
+class DirectoryWatcher:
+    """Polls a directory tree for new or changed invoice files.
+
+    A file is reported once its size and mtime have stayed the same for `settle` seconds,
+    so half-copied files are never picked up. Settled files whose content hash matches the
+    journal (touched but unchanged, or done by a previous run) are skipped without processing.
+    """
+
+    def __init__(self, root: str, journal: CheckpointJournal, settle: float = 2.0,
+                 extensions: Iterable[str] = SUPPORTED_EXTENSIONS):
+        self.root = root
+        self.journal = journal
+        self.settle = settle
+        self.extensions = tuple(extensions)
+        self._pending: Dict[str, Tuple[Signature, float]] = {}  # path -> (signature, unchanged since)
+        self._handled: Dict[str, Signature] = {}  # path -> signature when last queued or skipped
+
+    def _scan(self) -> Dict[str, Signature]:
+        if os.path.isfile(self.root):
+            paths = [self.root]
+        else:
+            paths = []
+            for dirpath, dirnames, files in os.walk(self.root):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                paths.extend(
+                    os.path.join(dirpath, name) for name in files
+                    # Hidden files and Office lock files are editors' scratch space, not invoices
+                    if name.lower().endswith(self.extensions) and not name.startswith(('.', '~$'))
+                )
+        signatures = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # removed between listing and stat
+            signatures[path] = (st.st_size, st.st_mtime_ns)
+        return signatures
+
+    def poll(self) -> List[str]:
+        """One scan of the tree. Returns settled paths that are new or changed since last reported."""
+        now = time.monotonic()
+        signatures = self._scan()
+        for path in set(self._pending) - set(signatures):
+            del self._pending[path]
+        for path in set(self._handled) - set(signatures):
+            del self._handled[path]
+
+        ready = []
+        for path, signature in sorted(signatures.items()):
+            if self._handled.get(path) == signature:
+                continue
+            pending = self._pending.get(path)
+            if pending is None or pending[0] != signature:
+                # New or still being written: restart its settle timer
+                self._pending[path] = (signature, now)
+                continue
+            if now - pending[1] < self.settle:
+                continue
+            del self._pending[path]
+            self._handled[path] = signature
+            try:
+                if self.journal.is_done(path):
+                    logger.debug("Unchanged since last run, skipping %s", path)
+                    continue
+            except OSError as e:
+                logger.warning("Cannot read %s: %s", path, e)
+                continue
+            ready.append(path)
+        return ready
+
+def watch(watcher: DirectoryWatcher, process_fn: Callable[[str], list],
+          on_result: Callable[[str, list, float], None], workers: int = 1, max_queue: int = 100,
+          interval: float = 1.0, stop: Optional[threading.Event] = None):
+    """Feeds settled files through a bounded queue to `workers` threads until `stop` is set.
+
+    When the queue is full, scanning waits for room instead of buffering the whole inbox.
+    `on_result(path, results, elapsed)` is called for each finished file, one at a time.
+    Files still queued at shutdown are not journaled, so the next run picks them up.
+    """
+    stop = stop or threading.Event()
+    pending: "queue.Queue[str]" = queue.Queue(maxsize=max(1, max_queue))
+    result_lock = threading.Lock()
+
+    def run():
+        while not stop.is_set():
+            try:
+                path = pending.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            started = time.time()
+            try:
+                results = process_fn(path)
+            except Exception as e:
+                logger.error("Error processing %s: %s", path, e)
+                ERRORS_TOTAL.inc(stage="watch")
+                results = [{"error": str(e), "file": path}]
+            try:
+                with result_lock:
+                    on_result(path, results, time.time() - started)
+            except Exception:
+                # e.g. the file was moved before it could be journaled, or an export hit a full
+                # disk: log it and keep serving the queue rather than losing this worker
+                logger.exception("Error recording results for %s", path)
+                ERRORS_TOTAL.inc(stage="watch")
+            finally:
+                pending.task_done()
+
+    threads = [threading.Thread(target=run, name=f"watch-worker-{i}", daemon=True) for i in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+
+    logger.info("Watching %s (poll every %.1fs, settle %.1fs)", watcher.root, interval, watcher.settle)
+    try:
+        while not stop.is_set():
+            for path in watcher.poll():
+                logger.info("Queued %s", path)
+                while not stop.is_set():
+                    try:
+                        pending.put(path, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+            stop.wait(interval)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,158 @@
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal OpenAI-protocol server for exercising the LLM clients offline.
+# Point the app at it with:
+#   OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub OPENAI_MODEL=stub
+
+class StubState:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, fail_rate: float = 0.0,
+                 structured_output: bool = True):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.structured_output = structured_output
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+def build_invoice(user_text: str) -> dict:
+    """Builds a plausible invoice from whatever the prompt contains, so responses vary with input."""
+    number = re.search(r"(?:INV|PO)-?\d+", user_text)
+    total = re.search(r"Total[^\d]*([\d,]+\.?\d*)", user_text, re.IGNORECASE)
+    amount = float(total.group(1).replace(",", "")) if total else 100.0
+    return {
+        "vendor_name": "Stub Vendor LLC",
+        "invoice_number": number.group(0) if number else "STUB-0001",
+        "invoice_date": "2024-01-15",
+        "due_date": "2024-02-14",
+        "tax_amount": 0.0,
+        "total_amount": amount,
+        "currency": "USD",
+        "line_items": [
+            {"description": "Stub service", "quantity": 1, "unit_price": amount, "amount": amount}
+        ]
+    }
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass  # keep benchmark output clean
+
+        def _send(self, status: int, body: dict, headers: dict = None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                with state.lock:
+                    self._send(200, {"requests": state.requests, "max_in_flight": state.max_in_flight})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            with state.lock:
+                state.requests += 1
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                delay = state.latency + random.uniform(0, state.jitter)
+                if delay:
+                    time.sleep(delay)
+
+                if state.fail_rate and random.random() < state.fail_rate:
+                    status = random.choice([429, 500, 503])
+                    self._send(status, {"error": {"message": "stub failure", "type": "server_error"}},
+                               {"Retry-After": "0"} if status == 429 else None)
+                    return
+
+                response_format = request.get("response_format")
+                if response_format and not state.structured_output:
+                    self._send(400, {"error": {"message": "Unsupported parameter: 'response_format'",
+                                               "type": "invalid_request_error"}})
+                    return
+
+                user_text = " ".join(
+                    m.get("content", "") for m in request.get("messages", []) if m.get("role") == "user"
+                )
+                # Packed multi-document requests get one invoice per document, tagged with its ID
+                documents = re.findall(r"=== DOCUMENT (\S+) ===\n([\s\S]*?)\n=== END DOCUMENT \1 ===", user_text)
+                if documents:
+                    invoices = [dict(build_invoice(text), document_id=doc_id) for doc_id, text in documents]
+                else:
+                    invoices = [build_invoice(user_text)]
+                if response_format:
+                    content = json.dumps({"invoices": invoices})
+                else:
+                    content = "```json\n" + json.dumps(invoices, indent=2) + "\n```"
+                prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // 4
+                completion_tokens = len(content) // 4
+                self._send(200, {
+                    "id": f"chatcmpl-stub-{state.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens
+                    }
+                })
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+    return Handler
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 8001, **state_kwargs) -> ThreadingHTTPServer:
+    """Starts the stub in a background thread. Use port=0 to pick a free port."""
+    server = ThreadingHTTPServer((host, port), make_handler(StubState(**state_kwargs)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Base response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 429/5xx")
+    parser.add_argument("--no-structured-output", action="store_true", help="Reject requests that set response_format, like older local backends")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(
+        (args.host, args.port),
+        make_handler(StubState(args.latency, args.jitter, args.fail_rate, not args.no_structured_output))
+    )
+    print(f"Stub LLM listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
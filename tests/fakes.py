@@ -0,0 +1,31 @@
+import re
+import json
+import threading
+from types import SimpleNamespace
+
+class FakeCompletions:
+    """Stands in for `client.chat.completions`, answering like a well-behaved model.
+
+    A packed prompt gets one invoice per "=== DOCUMENT <id> ===" block, tagged with its id;
+    any other prompt gets a single invoice. Every request is kept in `requests`.
+    """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def create(self, **request):
+        with self._lock:
+            self.requests.append(request)
+        if self.fail:
+            raise ConnectionError("backend down")
+        text = request["messages"][-1]["content"]
+        ids = re.findall(r"=== DOCUMENT (\S+) ===", text)
+        if ids:
+            invoices = [{"document_id": doc_id, "vendor_name": f"Vendor {doc_id}", "invoice_number": doc_id,
+                         "total_amount": 10.0} for doc_id in ids]
+        else:
+            invoices = [{"vendor_name": "Vendor", "invoice_number": "INV-1", "total_amount": 10.0}]
+        content = json.dumps({"invoices": invoices})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
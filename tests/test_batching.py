@@ -0,0 +1,78 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.llm_batching import BatchingLLM
+from src.llm_client import MockLLM, OpenAIClient, pack_documents, unpack_documents
+from tests.fakes import FakeCompletions
+
+def analyze_concurrently(llm, texts):
+    with ThreadPoolExecutor(max_workers=len(texts)) as executor:
+        return list(executor.map(llm.analyze_text, texts))
+
+def test_pack_documents_fences_each_document():
+    packed = pack_documents({"d1": "first\n", "d2": " second"})
+    assert packed == "=== DOCUMENT d1 ===\nfirst\n=== END DOCUMENT d1 ===\n=== DOCUMENT d2 ===\nsecond\n=== END DOCUMENT d2 ==="
+
+def test_unpack_documents_groups_by_id_and_drops_unknown_ids():
+    invoices = [{"document_id": "d2", "invoice_number": "B"}, {"document_id": " d1 ", "invoice_number": "A"},
+                {"document_id": "d9", "invoice_number": "?"}, {"invoice_number": "untagged"}]
+    results = unpack_documents({"d1": "", "d2": ""}, invoices)
+    assert results == {"d1": [{"invoice_number": "A"}], "d2": [{"invoice_number": "B"}]}
+
+def test_openai_client_packs_documents_into_one_request():
+    completions = FakeCompletions()
+    client = OpenAIClient(model="fake", completions=completions)
+    results = client.analyze_documents({"d1": "first invoice", "d2": "second invoice"})
+    assert len(completions.requests) == 1
+    assert [inv["invoice_number"] for inv in results["d1"]] == ["d1"]
+    assert [inv["invoice_number"] for inv in results["d2"]] == ["d2"]
+
+def test_concurrent_short_documents_share_one_request():
+    completions = FakeCompletions()
+    llm = BatchingLLM(OpenAIClient(model="fake", completions=completions), window=0.5, max_documents=4)
+    results = analyze_concurrently(llm, [f"invoice {i}" for i in range(4)])
+    assert len(completions.requests) == 1
+    # Each caller gets back only its own document's invoice
+    assert len({r[0]["invoice_number"] for r in results}) == 4
+    assert all(len(r) == 1 for r in results)
+
+def test_batches_are_capped_at_max_documents():
+    completions = FakeCompletions()
+    llm = BatchingLLM(OpenAIClient(model="fake", completions=completions), window=0.5, max_documents=2)
+    analyze_concurrently(llm, [f"invoice {i}" for i in range(4)])
+    assert len(completions.requests) == 2
+
+def test_long_documents_skip_batching():
+    completions = FakeCompletions()
+    llm = BatchingLLM(OpenAIClient(model="fake", completions=completions), window=5.0, max_document_tokens=10)
+    result = llm.analyze_text("word " * 200)
+    assert result[0]["invoice_number"] == "INV-1"
+    assert "=== DOCUMENT" not in completions.requests[0]["messages"][-1]["content"]
+
+def test_document_missing_from_batch_is_retried_alone():
+    class DropsFirst(FakeCompletions):
+        def create(self, **request):
+            response = super().create(**request)
+            content = response.choices[0].message.content
+            # Lose the first document's invoice from packed answers
+            response.choices[0].message.content = content.replace('"document_id": "d', '"document_id": "x', 1)
+            return response
+
+    completions = DropsFirst()
+    llm = BatchingLLM(OpenAIClient(model="fake", completions=completions), window=0.5, max_documents=2)
+    results = analyze_concurrently(llm, ["invoice a", "invoice b"])
+    assert all(len(r) == 1 for r in results)
+    assert len(completions.requests) == 2
+
+def test_providers_that_cannot_pack_are_passed_through():
+    calls = []
+
+    class CountingMock(MockLLM):
+        def analyze_text(self, text):
+            calls.append(threading.current_thread().name)
+            return super().analyze_text(text)
+
+    llm = BatchingLLM(CountingMock(), window=5.0)
+    assert not llm.packing
+    results = analyze_concurrently(llm, ["a", "b", "c"])
+    assert len(calls) == 3 and all(r[0]["vendor_name"] == "Mock Vendor Inc." for r in results)
+    assert not any(name.startswith("llm-batch") for name in calls)
@@ -0,0 +1,55 @@
+import time
+from src.cache import RESULT_LAYER, TEXT_LAYER, ExtractionCache
+
+def make_cache(tmp_path, **kwargs) -> ExtractionCache:
+    return ExtractionCache(str(tmp_path / "cache.sqlite3"), **kwargs)
+
+def test_text_is_keyed_by_extraction_settings(tmp_path):
+    cache = make_cache(tmp_path)
+    content_hash = cache.hash_bytes(b"scan")
+    cache.put_text(content_hash, "300 dpi text", "dpi=300")
+    assert cache.get_text(content_hash, "dpi=300") == "300 dpi text"
+    assert cache.get_text(content_hash, "dpi=200") is None
+    assert cache.get_text(content_hash) is None
+
+def test_results_are_keyed_by_namespace(tmp_path):
+    cache = make_cache(tmp_path)
+    invoices = [{"vendor_name": "ACME", "total_amount": 12.5}]
+    cache.put_result("abc", "OpenAIClient:gpt-4o", invoices)
+    assert cache.get_result("abc", "OpenAIClient:gpt-4o") == invoices
+    assert cache.get_result("abc", "OpenAIClient:gpt-4o-mini") is None
+
+def test_hash_file_matches_hash_bytes(tmp_path):
+    path = tmp_path / "invoice.txt"
+    path.write_bytes(b"x" * 3000)
+    assert ExtractionCache.hash_file(str(path), chunk_size=1024) == ExtractionCache.hash_bytes(b"x" * 3000)
+
+def test_entries_persist_across_instances(tmp_path):
+    make_cache(tmp_path).put_text("abc", "text")
+    assert make_cache(tmp_path).get_text("abc") == "text"
+
+def test_evict_drops_least_recently_used_first(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=250)
+    for key in ("old", "used", "new"):
+        cache.put_text(key, "x" * 100)
+        time.sleep(0.01)
+    cache.get_text("old")  # touched, so "used" is now the least recently used
+    cache.evict()
+    assert cache.get_text("used") is None
+    assert cache.get_text("old") is not None
+    assert cache.get_text("new") is not None
+
+def test_evict_drops_expired_entries(tmp_path):
+    cache = make_cache(tmp_path, max_age_seconds=60)
+    cache.put_text("abc", "text")
+    cache._conn.execute("UPDATE entries SET created_at = created_at - 120")
+    assert cache.get_text("abc") is None
+
+def test_stats_count_hits_and_misses_per_layer(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put_text("abc", "text")
+    cache.get_text("abc")
+    cache.get_result("abc", "ns")
+    stats = cache.stats()
+    assert stats[TEXT_LAYER]["hits"] == 1 and stats[TEXT_LAYER]["entries"] == 1
+    assert stats[RESULT_LAYER]["misses"] == 1 and stats[RESULT_LAYER]["entries"] == 0
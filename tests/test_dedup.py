@@ -0,0 +1,68 @@
+import pytest
+from src.dedup import FLAG, DuplicateIndex, choose_bands, shingles
+
+pytest.importorskip("numpy")
+
+INVOICE_TEXT = """ACME Industrial Supply
+Invoice No: INV-2024-0042
+Date: 2024-03-01  Due: 2024-03-31
+Bill to: Northwind Traders, 12 Harbour Road
+Widget assembly kit        4 x 25.00     100.00
+Replacement bearings       10 x 3.50      35.00
+Subtotal 135.00  Tax 13.50  Total 148.50
+Payment by bank transfer within 30 days. Thank you for your business.
+"""
+
+INVOICE = {"vendor_name": "ACME Industrial Supply", "invoice_number": "INV-2024-0042", "total_amount": 148.5}
+
+@pytest.fixture
+def index(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicates.sqlite3"), threshold=0.8)
+    yield index
+    index.close()
+
+def test_shingles_ignore_case_spacing_and_punctuation():
+    assert shingles("Total:  148.50\nACME") == shingles("total 148 50 acme")
+
+def test_choose_bands_covers_every_permutation():
+    bands, rows = choose_bands(128, 0.85)
+    assert bands * rows == 128
+    assert (1 / bands) ** (1 / rows) <= 0.85
+
+def test_rescan_is_found_and_confirmed(index):
+    index.add(index.signature(INVOICE_TEXT), [INVOICE], "MockLLM:", source="scan.pdf", content_hash="h1")
+    rescan = INVOICE_TEXT.replace("Thank you", "Thank  you").replace("Northwind", "Northwlnd")
+    match = index.find_similar(index.signature(rescan))
+    assert match is not None
+    assert match["source"] == "scan.pdf" and match["namespace"] == "MockLLM:"
+    assert match["invoices"] == [INVOICE]
+    assert index.confirms(match, rescan)
+
+def test_same_layout_with_another_number_is_not_confirmed(index):
+    index.add(index.signature(INVOICE_TEXT), [INVOICE], "MockLLM:")
+    other = INVOICE_TEXT.replace("INV-2024-0042", "INV-2024-0043")
+    match = index.find_similar(index.signature(other))
+    assert match is None or not index.confirms(match, other)
+
+def test_unrelated_document_is_not_similar(index):
+    index.add(index.signature(INVOICE_TEXT), [INVOICE], "MockLLM:")
+    unrelated = "Globex Corporation quarterly statement of account, 17 Elm Street, balance brought forward 0.00"
+    assert index.find_similar(index.signature(unrelated)) is None
+
+def test_key_match_normalizes_vendor_number_and_total(index):
+    doc_id = index.add(index.signature(INVOICE_TEXT), [INVOICE], "MockLLM:", source="scan.pdf")
+    reprint = {"vendor_name": "acme  industrial supply", "invoice_number": "INV 2024 0042", "total_amount": "148.50"}
+    match = index.find_key(reprint)
+    assert match is not None and match["source"] == "scan.pdf"
+    assert index.find_key(reprint, exclude=doc_id) is None
+    assert index.find_key(dict(reprint, total_amount=150)) is None
+
+def test_error_results_and_empty_text_are_not_indexed(index):
+    assert index.add(index.signature(INVOICE_TEXT), [{"error": "No invoices found by AI"}], "MockLLM:") is None
+    assert index.signature("  ... ") is None
+    assert index.stats()["documents"] == 0
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        DuplicateIndex(str(tmp_path / "d.sqlite3"), mode="ignore")
+    assert DuplicateIndex(str(tmp_path / "d.sqlite3"), mode=FLAG).mode == FLAG
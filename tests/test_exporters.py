@@ -0,0 +1,81 @@
+import csv
+import json
+import pytest
+from src.exporters import (EXPORT_COLUMNS, CsvExporter, JsonArrayExporter, JsonlExporter, MultiExporter,
+                           ResultExporter, flatten_invoices, get_exporter)
+
+INVOICE = {
+    "vendor_name": "ACME", "invoice_number": "INV-1", "invoice_date": "2024-03-01", "total_amount": "148.50",
+    "line_items": [
+        {"description": "Widget", "quantity": 4, "unit_price": 25, "amount": 100},
+        {"description": "Bearing", "quantity": 10, "unit_price": "3.5", "amount": 35},
+    ],
+}
+ERROR = {"error": "No text extracted"}
+
+def test_flatten_repeats_the_header_per_line_item_and_skips_errors():
+    rows = list(flatten_invoices("a.pdf", [INVOICE, ERROR]))
+    assert len(rows) == 2
+    assert all(list(row) == EXPORT_COLUMNS for row in rows)
+    assert rows[0]["source_file"] == "a.pdf" and rows[1]["invoice_number"] == "INV-1"
+    # Numeric columns are coerced to float, missing values to None
+    assert rows[0]["total_amount"] == 148.5 and rows[1]["unit_price"] == 3.5
+    assert rows[0]["due_date"] is None
+
+def test_invoice_without_line_items_is_one_row():
+    rows = list(flatten_invoices("b.pdf", [{"vendor_name": "ACME", "total_amount": "n/a"}]))
+    assert len(rows) == 1 and rows[0]["description"] is None and rows[0]["total_amount"] is None
+
+def test_csv_exporter_streams_rows_and_appends_without_a_second_header(tmp_path):
+    path = str(tmp_path / "out.csv")
+    with CsvExporter(path) as exporter:
+        exporter.write("a.pdf", [INVOICE])
+    with CsvExporter(path, append=True) as exporter:
+        exporter.write("b.pdf", [INVOICE, ERROR])
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["source_file"] for row in rows] == ["a.pdf", "a.pdf", "b.pdf", "b.pdf"]
+
+def test_jsonl_exporter_keeps_errors(tmp_path):
+    path = tmp_path / "out.jsonl"
+    with JsonlExporter(str(path)) as exporter:
+        exporter.write("a.pdf", [INVOICE, ERROR])
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [r.get("error") for r in records] == [None, "No text extracted"]
+    assert all(r["source_file"] == "a.pdf" for r in records)
+
+@pytest.mark.parametrize("batches", [[], [[INVOICE]], [[INVOICE], [ERROR, INVOICE]]])
+def test_json_array_exporter_writes_valid_json(tmp_path, batches):
+    path = tmp_path / "out.json"
+    with JsonArrayExporter(str(path)) as exporter:
+        for invoices in batches:
+            exporter.write("a.pdf", invoices)
+    assert json.loads(path.read_text(encoding="utf-8")) == [inv for invoices in batches for inv in invoices]
+
+def test_multi_exporter_fans_out_to_every_format(tmp_path):
+    base = str(tmp_path / "results")
+    with MultiExporter(base, ["csv", "jsonl"]) as exporter:
+        exporter.write("a.pdf", [INVOICE])
+    assert exporter.paths == [base + ".csv", base + ".jsonl"]
+    assert (tmp_path / "results.jsonl").read_text(encoding="utf-8").count("\n") == 1
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        get_exporter("xlsx", str(tmp_path / "out.xlsx"))
+
+def test_result_exporter_is_abstract(tmp_path):
+    with pytest.raises(TypeError):
+        ResultExporter(str(tmp_path / "out"))
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_arrow_formats_round_trip(tmp_path, fmt):
+    pa = pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"out.{fmt}")
+    with get_exporter(fmt, path, row_group_size=1) as exporter:
+        exporter.write("a.pdf", [INVOICE])
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    else:
+        table = pa.ipc.open_file(path).read_all()
+    assert table.num_rows == 2 and table.column_names == EXPORT_COLUMNS
@@ -0,0 +1,64 @@
+import pytest
+from src.llm_batching import BatchingLLM
+from src.llm_client import OpenAIClient
+from src.llm_router import LLMRouter, RouterBackend
+from tests.fakes import FakeCompletions
+from tests.test_batching import analyze_concurrently
+
+def backend(name, completions, **kwargs) -> RouterBackend:
+    return RouterBackend(name, OpenAIClient(model=name, name=name, completions=completions), **kwargs)
+
+def test_needs_a_backend():
+    with pytest.raises(ValueError):
+        LLMRouter([])
+
+def test_fails_over_to_the_next_backend():
+    down, up = FakeCompletions(fail=True), FakeCompletions()
+    router = LLMRouter([backend("down", down), backend("up", up)], hedge_after=None)
+    result = router.analyze_text("invoice text")
+    assert result[0]["invoice_number"] == "INV-1"
+    assert len(down.requests) == 1 and len(up.requests) == 1
+    stats = router.stats()
+    assert stats["down"]["errors"] == 1 and not stats["down"]["available"]
+    assert stats["up"]["latency_ewma_s"] is not None
+    # The failed backend is cooling down, so the next request goes straight to the healthy one
+    router.analyze_text("another invoice")
+    assert len(down.requests) == 1 and len(up.requests) == 2
+
+def test_every_backend_failing_returns_no_invoices():
+    router = LLMRouter([backend("a", FakeCompletions(fail=True)), backend("b", FakeCompletions(fail=True))],
+                       hedge_after=None)
+    assert router.analyze_text("invoice text") == []
+
+def test_ranks_backends_by_input_size():
+    small = backend("small", FakeCompletions(), max_input_tokens=100)
+    large = backend("large", FakeCompletions(), min_input_tokens=101)
+    router = LLMRouter([small, large], hedge_after=None)
+    assert [b.name for b in router.rank(50)] == ["small"]
+    assert [b.name for b in router.rank(5000)] == ["large"]
+
+def test_prefers_the_faster_backend():
+    slow, fast = backend("slow", FakeCompletions()), backend("fast", FakeCompletions())
+    slow.latency, fast.latency = 2.0, 0.5
+    assert [b.name for b in LLMRouter([slow, fast]).rank(10)] == ["fast", "slow"]
+
+def test_packed_documents_go_out_as_one_request_with_failover():
+    down, up = FakeCompletions(fail=True), FakeCompletions()
+    router = LLMRouter([backend("down", down), backend("up", up)], hedge_after=None)
+    results = router.analyze_documents({"d1": "first invoice", "d2": "second invoice"})
+    assert len(down.requests) == 1 and len(up.requests) == 1
+    assert [inv["invoice_number"] for inv in results["d1"]] == ["d1"]
+    assert [inv["invoice_number"] for inv in results["d2"]] == ["d2"]
+
+def test_batching_over_the_router_packs_documents():
+    completions = FakeCompletions()
+    router = LLMRouter([backend("only", completions)], hedge_after=None)
+    llm = BatchingLLM(router, window=0.5, max_documents=6)
+    results = analyze_concurrently(llm, [f"invoice {i}" for i in range(6)])
+    assert len(completions.requests) == 1
+    assert len({r[0]["invoice_number"] for r in results}) == 6
+    assert llm.stats() == router.stats()
+
+def test_cache_key_covers_every_backend_model():
+    router = LLMRouter([backend("b", FakeCompletions()), backend("a", FakeCompletions())])
+    assert router.cache_key() == "LLMRouter:a+b"